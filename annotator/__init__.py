@@ -0,0 +1,18 @@
+"""Ядро Kazakh Tool-Call Annotator: работа с БД без привязки к UI.
+
+Подмодули загружаются лениво при первом обращении (annotator.storage,
+annotator.model, ...), так что ``import annotator`` ничего не тянет.
+"""
+import importlib
+
+__all__ = [
+    "bench", "browse", "cache", "db", "dedup", "delta", "export", "ids", "importer", "jobs", "model", "normalized",
+    "perf", "planner", "review", "revisions", "search", "shards", "snapshot", "stats", "storage", "tools", "toolsets",
+    "validation", "writer",
+]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,290 @@
+"""Бенчмарк путей записи, экспорта и чтения на синтетических данных.
+
+Для каждого размера создаётся отдельная временная база, заполняется
+синтетическими аннотациями (многошаговые turns с инструментами из
+tool_library.json) и замеряются:
+
+  * массовая загрузка (путь импорта);
+  * save_annotation — один писатель и несколько потоков одновременно;
+  * экспорт самой большой категории — время и пик памяти;
+  * первая и глубокая страница просмотра, список категорий;
+  * вход пользователя.
+
+Результаты пишутся в JSON, чтобы сравнивать версии между собой:
+
+    python -m annotator.bench --rows 10000 100000 --out bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from annotator import browse, db, export, importer, model, storage, tools, writer
+
+AUTHORS = tuple(f"annotator_{i}" for i in range(12))
+WORDS = (
+    "Алматы", "Астана", "Шымкент", "ауа", "райы", "ертең", "бүгін", "қала", "табу",
+    "сурет", "іздеу", "кесте", "пойыз", "ұшақ", "билет", "баға", "теңге", "доллар",
+    "жаңалық", "мейрамхана", "қонақүй", "кітап", "ән", "фильм", "дәрігер", "дүкен",
+    "көрсет", "айт", "қанша", "қайда", "қашан", "неше", "жақын", "арзан", "жылдам",
+)
+
+DEFAULT_ROWS = (10_000,)
+SEED_BATCH = 1000
+SAVE_OPS = 500
+WRITERS = 4
+LATENCY_REPEATS = 200
+LOGIN_REPEATS = 500
+DEEP_PAGE = 20
+
+BENCH_USER = "bench_user"
+BENCH_PASSWORD = "bench_password"
+
+
+# --- СИНТЕТИЧЕСКИЕ ДАННЫЕ ---
+def _sentence(rng, low=3, high=9):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+
+def _fake_value(rng, p_type):
+    if p_type in ("int", "integer"):
+        return rng.randint(1, 100)
+    if p_type in ("float", "number"):
+        return round(rng.uniform(0, 1000), 2)
+    if p_type in ("bool", "boolean"):
+        return rng.random() < 0.5
+    if p_type in ("list", "array"):
+        return [rng.choice(WORDS) for _ in range(rng.randint(1, 3))]
+    if p_type in ("dict", "object"):
+        return {"key": rng.choice(WORDS)}
+    return rng.choice(WORDS)
+
+
+def synthetic_record(rng, index, catalog, author=None):
+    """Запись в формате экспорта: те же turns, что строит страница аннотации."""
+    category = rng.choice(model.CATEGORIES)
+    query = _sentence(rng)
+    selected = rng.sample(catalog.names, k=min(len(catalog.names), rng.randint(1, 4)))
+    steps = []
+    for _ in range(rng.randint(1, 4)):
+        spec = catalog.get(rng.choice(selected))
+        args = {name: _fake_value(rng, p_type) for name, p_type in spec.types.items()
+                if name in spec.required or rng.random() < 0.5}
+        steps.append({
+            "plan": _sentence(rng, 2, 5),
+            "thought": _sentence(rng),
+            "tool": spec.name,
+            "args": json.dumps(args, ensure_ascii=False),
+            "output": json.dumps({"result": _sentence(rng)}, ensure_ascii=False),
+        })
+    turns, answers = model.build_turns(query, steps, _sentence(rng, 5, 15), catalog)
+    return model.build_annotation(
+        f"bench_{category}_{index:07d}", category, rng.choice(model.DIFFICULTIES), query,
+        [catalog.library[name] for name in selected], answers, turns, author or rng.choice(AUTHORS))
+
+
+def iter_synthetic(count, seed=0, start=0, catalog=None):
+    rng = random.Random(seed)
+    catalog = catalog or tools.get_catalog()
+    for index in range(start, start + count):
+        yield synthetic_record(rng, index, catalog)
+
+
+# --- ИЗМЕРЕНИЯ ---
+def _summary(samples):
+    """Сводка латентностей в миллисекундах."""
+    ordered = sorted(samples)
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def _timed(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return _summary(samples)
+
+
+def seed_database(path, rows, seed=0):
+    catalog = tools.get_catalog()
+    result = importer.ImportResult()
+    started = time.perf_counter()
+    batch = []
+    for record in iter_synthetic(rows, seed=seed, catalog=catalog):
+        batch.append(importer.normalize_record(record, "bench"))
+        if len(batch) >= SEED_BATCH:
+            result.add(writer.write(lambda conn: importer._write_batch(conn, batch, importer.ON_CONFLICT_SKIP),
+                                    path=path))
+            batch = []
+    if batch:
+        result.add(writer.write(lambda conn: importer._write_batch(conn, batch, importer.ON_CONFLICT_SKIP),
+                                path=path))
+    seconds = time.perf_counter() - started
+    return {"rows": result.inserted, "seconds": round(seconds, 3),
+            "rows_per_second": round(result.inserted / seconds, 1) if seconds else None}
+
+
+def bench_save_single(path, ops, start):
+    records = list(iter_synthetic(ops, seed=1, start=start))
+    samples = []
+    started = time.perf_counter()
+    for record in records:
+        t0 = time.perf_counter()
+        storage.save_annotation(record, path=path)
+        samples.append(time.perf_counter() - t0)
+    seconds = time.perf_counter() - started
+    return {**_summary(samples), "ops_per_second": round(ops / seconds, 1)}
+
+
+def bench_save_concurrent(path, ops, writers, start):
+    records = list(iter_synthetic(ops, seed=2, start=start))
+    samples = []
+    lock = threading.Lock()
+
+    def save(record):
+        t0 = time.perf_counter()
+        storage.save_annotation(record, path=path)
+        elapsed = time.perf_counter() - t0
+        with lock:
+            samples.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        # list() пробрасывает исключения из потоков
+        list(pool.map(save, records))
+    seconds = time.perf_counter() - started
+    return {**_summary(samples), "writers": writers, "ops_per_second": round(ops / seconds, 1)}
+
+
+def bench_export(path, directory):
+    counts = db.fetch_all("SELECT category, count(*) FROM annotations GROUP BY category ORDER BY 2 DESC", path=path)
+    category, rows = counts[0]
+
+    started = time.perf_counter()
+    tmp_path, written = export.export_category(category, export.FORMAT_JSON, directory, path=path)
+    seconds = time.perf_counter() - started
+    size = os.path.getsize(tmp_path)
+    os.remove(tmp_path)
+
+    # Пик памяти меряется отдельным прогоном: tracemalloc замедляет выполнение
+    tracemalloc.start()
+    tmp_path, _ = export.export_category(category, export.FORMAT_JSON, directory, path=path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    os.remove(tmp_path)
+    return {
+        "category": category,
+        "rows": written,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(written / seconds, 1) if seconds else None,
+        "bytes": size,
+        "peak_python_memory_bytes": peak,
+    }
+
+
+def bench_pages(path):
+    first_page = lambda: browse.fetch_page({}, None, path=path)
+
+    cursor = None
+    for _ in range(DEEP_PAGE):
+        _, cursor = browse.fetch_page({}, cursor, path=path)
+        if cursor is None:
+            break
+    deep_page = lambda: browse.fetch_page({}, cursor, path=path)
+    filtered = {"category": model.CATEGORIES[0], "author": AUTHORS[0]}
+    filtered_page = lambda: browse.fetch_page(filtered, None, path=path)
+    return {
+        "first_page": _timed(first_page, LATENCY_REPEATS),
+        f"page_{DEEP_PAGE}": _timed(deep_page, LATENCY_REPEATS),
+        "filtered_first_page": _timed(filtered_page, LATENCY_REPEATS),
+        "list_categories": _timed(lambda: export.list_categories(path=path), LATENCY_REPEATS),
+    }
+
+
+def bench_login(path):
+    storage.create_user(BENCH_USER, BENCH_PASSWORD, path=path)
+    ok = _timed(lambda: storage.login_user(BENCH_USER, BENCH_PASSWORD, path=path), LOGIN_REPEATS)
+    missing = _timed(lambda: storage.login_user("nobody", BENCH_PASSWORD, path=path), LOGIN_REPEATS)
+    return {"success": ok, "unknown_user": missing}
+
+
+def run_size(rows, workdir, save_ops=SAVE_OPS, writers=WRITERS):
+    path = os.path.join(workdir, f"bench_{rows}.db")
+    db.init_db(path)
+    result = {"rows": rows, "seed": seed_database(path, rows)}
+    db_bytes = os.path.getsize(path)
+    result["save_single"] = bench_save_single(path, save_ops, start=rows)
+    result["save_concurrent"] = bench_save_concurrent(path, save_ops, writers, start=rows + save_ops)
+    result["export_category"] = bench_export(path, workdir)
+    result["pages"] = bench_pages(path)
+    result["login"] = bench_login(path)
+    result["db_bytes"] = db_bytes
+    db.get_pool(path).close()
+    return result
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк записи, экспорта и чтения на синтетических данных")
+    parser.add_argument("--rows", type=int, nargs="+", default=list(DEFAULT_ROWS),
+                        help="размеры синтетической базы (например 10000 100000 1000000)")
+    parser.add_argument("--out", default="bench.json", help="файл с результатами (JSON)")
+    parser.add_argument("--label", default=None, help="метка прогона, например версия или ветка")
+    parser.add_argument("--save-ops", type=int, default=SAVE_OPS)
+    parser.add_argument("--writers", type=int, default=WRITERS)
+    parser.add_argument("--workdir", default=None, help="каталог для временных баз (по умолчанию tmp)")
+    parser.add_argument("--keep", action="store_true", help="не удалять временные базы")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="annotator_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        "label": args.label,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": environment(),
+        "results": [],
+    }
+    try:
+        for rows in args.rows:
+            print(f"rows={rows}...", file=sys.stderr)
+            report["results"].append(run_size(rows, workdir, args.save_ops, args.writers))
+            # Промежуточный результат сохраняется после каждого размера
+            with open(args.out, "w", encoding="utf-8") as fh:
+                json.dump(report, fh, ensure_ascii=False, indent=2)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
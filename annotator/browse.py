@@ -0,0 +1,70 @@
+"""Постраничный просмотр аннотаций на стороне сервера.
+
+Используется keyset-пагинация по (created_at, id): стоимость загрузки
+страницы не зависит от её номера и от размера таблицы. Тяжёлые JSON-колонки
+в список не попадают и читаются отдельно для раскрытой записи.
+"""
+from annotator import db, toolsets
+
+PAGE_SIZE = 50
+
+LIST_COLUMNS = ("id", "category", "difficulty", "query", "author", "created_at")
+DETAIL_COLUMNS = ("tools_json", "answers_json", "turns_json")
+FILTER_COLUMNS = ("category", "difficulty", "author")
+
+
+def _where(filters, cursor):
+    clauses = []
+    params = []
+    for column in FILTER_COLUMNS:
+        value = (filters or {}).get(column)
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if cursor is not None:
+        clauses.append("(created_at, id) < (?, ?)")
+        params.extend(cursor)
+    sql = " WHERE " + " AND ".join(clauses) if clauses else ""
+    return sql, params
+
+
+def build_page_query(filters=None, cursor=None, limit=PAGE_SIZE):
+    where, params = _where(filters, cursor)
+    sql = (f"SELECT {', '.join(LIST_COLUMNS)} FROM annotations{where} "
+           "ORDER BY created_at DESC, id DESC LIMIT ?")
+    return sql, (*params, limit)
+
+
+def fetch_page(filters=None, cursor=None, page_size=PAGE_SIZE, path=None):
+    """Возвращает (строки, курсор следующей страницы или None).
+
+    cursor — пара (created_at, id) последней строки предыдущей страницы.
+    """
+    # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+    sql, params = build_page_query(filters, cursor, page_size + 1)
+    rows = db.fetch_all(sql, params, path=path)
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = (last[LIST_COLUMNS.index("created_at")], last[0])
+    return rows, next_cursor
+
+
+def fetch_details(annotation_id, path=None):
+    row = db.fetch_one(f"SELECT {', '.join(DETAIL_COLUMNS)}, tool_set FROM annotations WHERE id = ?",
+                       (annotation_id,), path=path)
+    if row is None:
+        return None
+    details = dict(zip(DETAIL_COLUMNS, row))
+    if row[-1] is not None:
+        details["tools_json"] = toolsets.ToolSetCache(path).serialized(row[-1])
+    return details
+
+
+def distinct_values(column, path=None):
+    if column not in FILTER_COLUMNS:
+        raise ValueError(f"Недопустимая колонка фильтра: {column}")
+    rows = db.fetch_all(f"SELECT DISTINCT {column} FROM annotations "
+                        f"WHERE {column} IS NOT NULL ORDER BY {column}", path=path)
+    return [row[0] for row in rows]
@@ -0,0 +1,154 @@
+"""Кэш результатов чтения, привязанный к версиям таблиц.
+
+Триггеры увеличивают счётчик в table_versions при каждом изменении
+annotations и users. Результат кэшируется вместе с версиями таблиц, от
+которых он зависит. Перед выдачей версии перечитываются одним запросом по
+первичному ключу. Как только версия выросла, все зависящие от таблицы
+записи выбрасываются, кто бы ни записал данные: другая сессия, CLI или
+другой процесс.
+
+Кэш общий для всех сессий процесса и ограничен по памяти (LRU по оценке
+размера). Возвращаемые значения общие — их нельзя изменять на месте.
+"""
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from annotator import db
+
+MAX_BYTES = int(os.environ.get("ANNOTATOR_CACHE_MAX_MB", "128")) * 1024 * 1024
+# Значения крупнее этой доли бюджета не кэшируются вовсе
+MAX_ENTRY_SHARE = 4
+
+TRACKED_TABLES = ("annotations", "users")
+
+
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    for table in TRACKED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES (?, 0)", (table,))
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_table_version_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+                END
+            ''')
+
+
+def table_versions(tables, path=None):
+    placeholders = ",".join("?" * len(tables))
+    rows = db.fetch_all(f"SELECT name, version FROM table_versions WHERE name IN ({placeholders})",
+                        tuple(tables), path=path)
+    versions = dict(rows)
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def approx_size(value, _depth=0):
+    """Грубая оценка занимаемой памяти; DataFrame меряется сам."""
+    memory_usage = getattr(value, "memory_usage", None)
+    if callable(memory_usage):
+        return int(memory_usage(deep=True).sum())
+    if isinstance(value, (bytes, bytearray, str)):
+        return sys.getsizeof(value)
+    size = sys.getsizeof(value)
+    if _depth < 3:
+        if isinstance(value, dict):
+            size += sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in value.items())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(approx_size(item, _depth + 1) for item in value)
+    return size
+
+
+class VersionedCache:
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> (tables, versions, value, size)
+        self._entries = OrderedDict()
+        # (path, table) -> последняя увиденная версия
+        self._seen = {}
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.bytes -= entry[3]
+
+    def _observe(self, path, tables, versions):
+        """Выбрасывает записи, зависящие от таблиц, версия которых выросла."""
+        changed = [table for table, version in zip(tables, versions)
+                   if self._seen.get((path, table), version) != version]
+        for table, version in zip(tables, versions):
+            self._seen[(path, table)] = version
+        if not changed:
+            return
+        for key in [key for key, entry in self._entries.items()
+                    if key[0] == path and any(table in changed for table in entry[0])]:
+            self._drop(key)
+
+    def get_or_compute(self, key, tables, compute, path=None, sizeof=approx_size):
+        key = (path or db.DB_FILE, *key)
+        versions = table_versions(tables, path=path)
+        with self._lock:
+            self._observe(key[0], tables, versions)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] == versions:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        value = compute()
+        size = sizeof(value)
+        if size > self.max_bytes // MAX_ENTRY_SHARE:
+            return value
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (tables, versions, value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._seen.clear()
+            self.bytes = 0
+
+    def info(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_cache = VersionedCache()
+
+
+def get_cache():
+    return _cache
+
+
+def cached(*tables, sizeof=approx_size):
+    """Декоратор: результат f(*args, path=None) кэшируется до изменения таблиц tables.
+
+    Аргументы должны быть хэшируемыми.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, path=None):
+            return _cache.get_or_compute((fn.__module__, fn.__qualname__, args), tables,
+                                         lambda: fn(*args, path=path), path=path, sizeof=sizeof)
+        return wrapper
+    return decorator
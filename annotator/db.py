@@ -0,0 +1,390 @@
+"""Общий слой подключений к SQLite.
+
+Модуль импортируется один раз на процесс, поэтому пул подключений и признак
+выполненной миграции схемы переживают перезапуски Streamlit-скрипта и общие
+для всех сессий.
+"""
+import hashlib
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from annotator import perf
+
+# --- КОНФИГУРАЦИЯ ---
+DB_FILE = os.environ.get("ANNOTATOR_DB_FILE", "kazakh_tool_dataset.db")
+
+BUSY_TIMEOUT_MS = 5000
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.05
+POOL_MAX_IDLE = 16
+
+# Применяются к каждому новому подключению (journal_mode=WAL хранится в самом
+# файле БД и выставляется один раз при инициализации).
+CONNECTION_PRAGMAS = (
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -32000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    # Сохранения и импорт идут через UPSERT (триггеры UPDATE); прагма оставлена,
+    # чтобы REPLACE в ручных правках тоже вызывал триггеры удаления индексов
+    "PRAGMA recursive_triggers = ON",
+)
+
+
+# --- ФУНКЦИИ БЕЗОПАСНОСТИ ---
+def make_hashes(password):
+    return hashlib.sha256(str.encode(password)).hexdigest()
+
+
+# --- МИГРАЦИИ СХЕМЫ ---
+# Версия схемы хранится в PRAGMA user_version. Каждая миграция выполняется
+# ровно один раз, новые добавляются только в конец списка.
+def _migration_base_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS annotations (
+            id TEXT PRIMARY KEY,
+            category TEXT,
+            difficulty TEXT,
+            query TEXT,
+            tools_json TEXT,
+            answers_json TEXT,
+            turns_json TEXT,
+            author TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Старые базы создавались без колонки author
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(annotations)")}
+    if "author" not in columns:
+        conn.execute("ALTER TABLE annotations ADD COLUMN author TEXT")
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT
+        )
+    ''')
+    if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+        conn.execute('INSERT INTO users (username, password) VALUES (?, ?)',
+                     ('admin', make_hashes('admin123')))
+
+
+def _migration_browse_index(conn):
+    # Keyset-пагинация просмотрщика: ORDER BY created_at DESC, id DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_created ON annotations (created_at, id)")
+
+
+def _migration_filter_indexes(conn):
+    # Фильтры экспорта и просмотрщика; id в конце индекса позволяет обслуживать
+    # keyset-пагинацию (created_at, id) целиком из индекса
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_category_created "
+                 "ON annotations (category, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_author_created "
+                 "ON annotations (author, created_at, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annotations_difficulty "
+                 "ON annotations (difficulty, created_at, id)")
+    conn.execute("ANALYZE")
+
+
+def _migration_query_minhash(conn):
+    # Индекс почти-дубликатов запросов; заполняется по уже сохранённым записям
+    from annotator import dedup
+    dedup.create_schema(conn)
+    dedup.rebuild(conn)
+
+
+def _migration_fulltext_search(conn):
+    from annotator import search
+    search.create_schema(conn)
+    search.rebuild(conn)
+
+
+def _migration_statistics(conn):
+    from annotator import stats
+    stats.create_schema(conn)
+    stats.rebuild(conn)
+
+
+def _migration_export_jobs(conn):
+    from annotator import jobs
+    jobs.create_schema(conn)
+
+
+def _migration_json_safe_triggers(conn):
+    # Исправление триггеров из миграций _migration_fulltext_search и
+    # _migration_statistics: элементы-скаляры в turns_json/answers_json ломали
+    # в них json_extract. Триггеры пересоздаются, агрегаты считаются заново.
+    from annotator import search, stats
+    search.drop_triggers(conn)
+    search.create_schema(conn)
+    stats.drop_triggers(conn)
+    stats.create_schema(conn)
+    stats.rebuild(conn)
+
+
+def _migration_normalized_turns(conn):
+    from annotator import normalized
+    normalized.create_schema(conn)
+    normalized.rebuild(conn)
+
+
+def _migration_tool_sets(conn):
+    from annotator import toolsets
+    toolsets.create_schema(conn)
+    toolsets.backfill(conn)
+
+
+def _migration_change_log(conn):
+    from annotator import delta
+    delta.create_schema(conn)
+    delta.backfill(conn)
+
+
+def _migration_export_snapshots(conn):
+    conn.execute("ALTER TABLE export_jobs ADD COLUMN snapshot TEXT")
+
+
+def _migration_table_versions(conn):
+    from annotator import cache
+    cache.create_schema(conn)
+
+
+def _migration_id_counters(conn):
+    from annotator import ids
+    ids.create_schema(conn)
+    ids.backfill(conn)
+
+
+def _migration_revisions(conn):
+    from annotator import revisions
+    revisions.create_schema(conn)
+
+
+def _migration_review_queue(conn):
+    from annotator import review
+    review.create_schema(conn)
+    review.backfill(conn)
+    conn.execute("ALTER TABLE export_jobs ADD COLUMN accepted_only INTEGER NOT NULL DEFAULT 0")
+
+
+def _migration_id_counter_trigger(conn):
+    # Счётчики id догоняют записи, вставленные после _migration_id_counters
+    from annotator import ids
+    ids.create_schema(conn)
+    ids.backfill(conn)
+
+
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_browse_index,
+    _migration_filter_indexes,
+    _migration_query_minhash,
+    _migration_fulltext_search,
+    _migration_statistics,
+    _migration_export_jobs,
+    _migration_json_safe_triggers,
+    _migration_normalized_turns,
+    _migration_tool_sets,
+    _migration_change_log,
+    _migration_export_snapshots,
+    _migration_table_versions,
+    _migration_id_counters,
+    _migration_revisions,
+    _migration_review_queue,
+    _migration_id_counter_trigger,
+]
+
+
+def migrate(conn):
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    if current >= len(MIGRATIONS):
+        return current
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Перечитываем версию под блокировкой: другой процесс мог успеть раньше
+        current = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version in range(current, len(MIGRATIONS)):
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return len(MIGRATIONS)
+
+
+# --- ПОВТОРЫ ПРИ БЛОКИРОВКЕ ---
+def is_busy_error(exc):
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    message = str(exc).lower()
+    return "locked" in message or "busy" in message
+
+
+def with_retry(fn, attempts=RETRY_ATTEMPTS):
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == attempts - 1:
+                raise
+            time.sleep(RETRY_BASE_DELAY * (2 ** attempt) * (1 + random.random()))
+
+
+# --- ПУЛ ПОДКЛЮЧЕНИЙ ---
+class ConnectionPool:
+    def __init__(self, path, max_idle=POOL_MAX_IDLE):
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = queue.LifoQueue()
+        self._local = threading.local()
+        self._bootstrap()
+
+    def _open(self):
+        # isolation_level=None: транзакциями управляем явно через BEGIN/COMMIT.
+        # check_same_thread=False: Streamlit выполняет каждый перезапуск в новом
+        # потоке, а подключение из пула может достаться любому из них.
+        # factory: при включённых замерах каждый запрос попадает в annotator.perf
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000,
+                               isolation_level=None, check_same_thread=False,
+                               factory=perf.connection_factory())
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _bootstrap(self):
+        conn = self._open()
+        try:
+            with_retry(lambda: conn.execute("PRAGMA journal_mode = WAL").fetchone())
+            with_retry(lambda: migrate(conn))
+        except BaseException:
+            conn.close()
+            raise
+        self._idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._open()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._idle.qsize() < self.max_idle:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        # Вложенные вызовы в одном потоке получают то же подключение,
+        # что позволяет хелперам участвовать во внешней транзакции.
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            yield conn
+            return
+        conn = self._acquire()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._release(conn)
+
+    @contextmanager
+    def detached(self):
+        """Подключение без привязки к потоку: вложенные вызовы его не получат."""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path=None):
+    path = path or DB_FILE
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = ConnectionPool(path)
+                _pools[path] = pool
+    return pool
+
+
+def init_db(path=None):
+    # Схема поднимается один раз на процесс; повторные вызовы бесплатны
+    return get_pool(path)
+
+
+def connection(path=None):
+    return get_pool(path).connection()
+
+
+def transaction(path=None):
+    return get_pool(path).transaction()
+
+
+def run_write(fn, path=None):
+    """Выполняет fn(conn) в транзакции с повтором при "database is locked"."""
+    pool = get_pool(path)
+
+    def attempt():
+        with pool.transaction() as conn:
+            return fn(conn)
+
+    with pool.connection() as conn:
+        if conn.in_transaction:
+            # Уже внутри внешней транзакции: повтор здесь невозможен
+            return fn(conn)
+        return with_retry(attempt)
+
+
+def fetch_all(sql, params=(), path=None):
+    with connection(path) as conn:
+        return with_retry(lambda: conn.execute(sql, params).fetchall())
+
+
+def fetch_one(sql, params=(), path=None):
+    with connection(path) as conn:
+        return with_retry(lambda: conn.execute(sql, params).fetchone())
+
+
+def close_all():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
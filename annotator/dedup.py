@@ -0,0 +1,216 @@
+"""Поиск почти-дубликатов запросов через MinHash + LSH.
+
+Для каждого запроса строится MinHash-сигнатура по символьным n-граммам.
+Сигнатура режется на полосы (bands), хэш каждой полосы — ключ корзины в
+таблице query_lsh. Кандидаты — записи, совпавшие хотя бы в одной корзине;
+поиск — BANDS индексных выборок, независимо от размера таблицы.
+"""
+import hashlib
+import random
+import re
+import struct
+import zlib
+
+from annotator import db
+
+NGRAM = 3
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+DEFAULT_THRESHOLD = 0.7
+
+_MERSENNE = (1 << 61) - 1
+_MASK32 = 0xFFFFFFFF
+_rng = random.Random(20240601)
+# Фиксированные параметры перестановок: сигнатуры должны совпадать между процессами
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERM)]
+_SIGNATURE_FORMAT = f"<{NUM_PERM}I"
+
+_NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+# --- СИГНАТУРЫ ---
+def normalize(text):
+    return " ".join(_NON_WORD_RE.sub(" ", (text or "").lower()).split())
+
+
+def shingles(text, n=NGRAM):
+    text = normalize(text)
+    if not text:
+        return set()
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def signature(text):
+    hashed = [zlib.crc32(s.encode("utf-8")) for s in shingles(text)]
+    if not hashed:
+        return None
+    return [min((a * x + b) % _MERSENNE for x in hashed) & _MASK32 for a, b in _PERMUTATIONS]
+
+
+def band_keys(sig):
+    keys = []
+    for band in range(BANDS):
+        part = struct.pack(f"<{ROWS_PER_BAND}I", *sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])
+        digest = hashlib.blake2b(part, digest_size=8).digest()
+        keys.append((band, int.from_bytes(digest, "little", signed=True)))
+    return keys
+
+
+def similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+def _pack(sig):
+    return struct.pack(_SIGNATURE_FORMAT, *sig)
+
+
+def _unpack(blob):
+    return struct.unpack(_SIGNATURE_FORMAT, blob)
+
+
+# --- ИНДЕКС ---
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS query_minhash (
+            id TEXT PRIMARY KEY,
+            signature BLOB NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS query_lsh (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            id TEXT NOT NULL,
+            PRIMARY KEY (band, bucket, id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_query_lsh_id ON query_lsh (id)")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_minhash_delete
+        AFTER DELETE ON annotations
+        BEGIN
+            DELETE FROM query_lsh WHERE id = OLD.id;
+            DELETE FROM query_minhash WHERE id = OLD.id;
+        END
+    ''')
+
+
+def index_signatures(conn, rows):
+    """Обновляет индекс для пар (id, сигнатура) внутри транзакции вызывающего.
+
+    Сигнатуры считаются заранее (signature), вне транзакции записи.
+    """
+    # При повторах id в одном батче побеждает последняя версия
+    rows = list(dict(rows).items())
+    conn.executemany("DELETE FROM query_lsh WHERE id = ?", [(row_id,) for row_id, _ in rows])
+    conn.executemany("DELETE FROM query_minhash WHERE id = ?", [(row_id,) for row_id, _ in rows])
+    minhash_rows = []
+    lsh_rows = []
+    for row_id, sig in rows:
+        if sig is None:
+            continue
+        minhash_rows.append((row_id, _pack(sig)))
+        lsh_rows.extend((band, bucket, row_id) for band, bucket in band_keys(sig))
+    conn.executemany("INSERT INTO query_minhash (id, signature) VALUES (?, ?)", minhash_rows)
+    conn.executemany("INSERT OR IGNORE INTO query_lsh (band, bucket, id) VALUES (?, ?, ?)", lsh_rows)
+
+
+def index_rows(conn, rows):
+    """Обновляет индекс для пар (id, query) внутри транзакции вызывающего."""
+    index_signatures(conn, [(row_id, signature(query)) for row_id, query in rows])
+
+
+def index_query(conn, row_id, query):
+    index_rows(conn, [(row_id, query)])
+
+
+def rebuild(conn, batch_size=2000):
+    conn.execute("DELETE FROM query_lsh")
+    conn.execute("DELETE FROM query_minhash")
+    cursor = conn.execute("SELECT id, query FROM annotations")
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        index_rows(conn, rows)
+
+
+# --- ПОИСК ---
+def find_similar(query, exclude_id=None, threshold=DEFAULT_THRESHOLD, limit=10, path=None):
+    """Возвращает [(id, оценка сходства)] по убыванию сходства."""
+    sig = signature(query)
+    if sig is None:
+        return []
+    keys = band_keys(sig)
+    with db.connection(path) as conn:
+        candidates = set()
+        for band, bucket in keys:
+            candidates.update(row[0] for row in conn.execute(
+                "SELECT id FROM query_lsh WHERE band = ? AND bucket = ?", (band, bucket)))
+        candidates.discard(exclude_id)
+        matches = []
+        for candidate in candidates:
+            row = conn.execute("SELECT signature FROM query_minhash WHERE id = ?", (candidate,)).fetchone()
+            if row is None:
+                continue
+            score = similarity(sig, _unpack(row[0]))
+            if score >= threshold:
+                matches.append((candidate, score))
+    matches.sort(key=lambda item: (-item[1], item[0]))
+    return matches[:limit]
+
+
+def find_clusters(threshold=DEFAULT_THRESHOLD, path=None):
+    """Группирует почти-дубликаты по всей таблице. Возвращает список списков id."""
+    parent = {}
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(a, b):
+        parent.setdefault(a, a)
+        parent.setdefault(b, b)
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    signatures = {}
+    with db.connection(path) as conn:
+        def get_signature(row_id):
+            if row_id not in signatures:
+                row = conn.execute("SELECT signature FROM query_minhash WHERE id = ?", (row_id,)).fetchone()
+                signatures[row_id] = _unpack(row[0]) if row else None
+            return signatures[row_id]
+
+        buckets = conn.execute('''
+            SELECT group_concat(id, char(31)) FROM query_lsh
+            GROUP BY band, bucket HAVING count(*) > 1
+        ''')
+        for (ids_joined,) in buckets:
+            # Каждый id сравнивается с представителями уже найденных групп корзины,
+            # а не со всеми парами: корзина из одинаковых запросов обходится за O(n)
+            representatives = []
+            for row_id in sorted(ids_joined.split("\x1f")):
+                sig = get_signature(row_id)
+                if sig is None:
+                    continue
+                for rep_id, rep_sig in representatives:
+                    if similarity(sig, rep_sig) >= threshold:
+                        union(rep_id, row_id)
+                        break
+                else:
+                    representatives.append((row_id, sig))
+
+    clusters = {}
+    for row_id in parent:
+        clusters.setdefault(find(row_id), []).append(row_id)
+    return sorted((sorted(members) for members in clusters.values() if len(members) > 1),
+                  key=lambda members: (-len(members), members[0]))
@@ -0,0 +1,221 @@
+"""Отслеживание изменений и дельта-экспорт с водяной меткой.
+
+Каждая вставка, изменение и удаление записи annotations попадает в
+change_log с монотонно растущим seq (AUTOINCREMENT — номера не
+переиспользуются). Удаления записываются как tombstone. Дельта-экспорт
+берёт изменения с seq больше водяной метки и дописывает их отдельным
+файлом в каталог с манифестом; старые файлы не переписываются.
+
+    python -m annotator.delta export sync_dir --category tool_awareness
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from annotator import export, snapshot, toolsets, writer
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+DELTA_TEMPLATE = "delta-{:06d}.jsonl"
+
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+
+TRACKED_COLUMNS = "id, category, difficulty, query, tools_json, answers_json, turns_json, author, tool_set"
+
+
+def create_schema(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(annotations)")}
+    if "updated_at" not in columns:
+        conn.execute("ALTER TABLE annotations ADD COLUMN updated_at TIMESTAMP")
+        conn.execute("UPDATE annotations SET updated_at = created_at")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            annotation_id TEXT NOT NULL,
+            category TEXT,
+            op TEXT NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_log_annotation ON change_log (annotation_id, seq)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_change_log_category ON change_log (category, seq)")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_change_insert
+        AFTER INSERT ON annotations
+        BEGIN
+            INSERT INTO change_log (annotation_id, category, op) VALUES (NEW.id, NEW.category, '{OP_UPSERT}');
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_change_delete
+        AFTER DELETE ON annotations
+        BEGIN
+            INSERT INTO change_log (annotation_id, category, op) VALUES (OLD.id, OLD.category, '{OP_DELETE}');
+        END
+    ''')
+    # Смена id или категории — для старого ключа это удаление
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_change_update
+        AFTER UPDATE OF {TRACKED_COLUMNS} ON annotations
+        BEGIN
+            INSERT INTO change_log (annotation_id, category, op)
+            SELECT OLD.id, OLD.category, '{OP_DELETE}'
+            WHERE OLD.id != NEW.id OR OLD.category IS NOT NEW.category;
+            INSERT INTO change_log (annotation_id, category, op) VALUES (NEW.id, NEW.category, '{OP_UPSERT}');
+        END
+    ''')
+
+
+def backfill(conn):
+    # Начальное состояние: каждая существующая запись — одно изменение
+    conn.execute(f'''
+        INSERT INTO change_log (annotation_id, category, op, changed_at)
+        SELECT id, category, '{OP_UPSERT}', coalesce(updated_at, created_at)
+        FROM annotations ORDER BY rowid
+    ''')
+
+
+def current_seq(conn):
+    return conn.execute("SELECT coalesce(max(seq), 0) FROM change_log").fetchone()[0]
+
+
+def prune(before_seq, path=None):
+    """Удаляет из журнала записи до before_seq, у которых есть более поздние изменения того же id.
+
+    Более позднее изменение должно быть в той же категории: иначе пропал бы
+    tombstone, по которому читатели старой категории удаляют запись.
+    """
+    def run(conn):
+        cursor = conn.execute('''
+            DELETE FROM change_log AS c
+            WHERE c.seq < ? AND EXISTS (
+                SELECT 1 FROM change_log AS later
+                WHERE later.annotation_id = c.annotation_id AND later.category IS c.category
+                    AND later.seq > c.seq
+            )
+        ''', (before_seq,))
+        return cursor.rowcount
+    return writer.write(run, path=path)
+
+
+# --- ЧТЕНИЕ ИЗМЕНЕНИЙ ---
+def iter_changes(since, until, category=None, conn=None):
+    """Последнее изменение каждого id в (since, until]: (seq, id, op, category)."""
+    where = "seq > ? AND seq <= ?"
+    params = [since, until]
+    if category is not None:
+        where += " AND category = ?"
+        params.append(category)
+    return conn.execute(f'''
+        SELECT seq, annotation_id, op, category FROM change_log
+        WHERE seq IN (
+            SELECT max(seq) FROM change_log WHERE {where} GROUP BY annotation_id
+        )
+        ORDER BY seq
+    ''', params)
+
+
+def iter_delta(since, until, category=None, conn=None, path=None):
+    tool_sets = toolsets.ToolSetCache(path, conn=conn)
+    row_sql = f"SELECT {export.EXPORT_COLUMNS} FROM annotations WHERE id = ?"
+    for seq, annotation_id, op, change_category in iter_changes(since, until, category, conn).fetchall():
+        if op == OP_UPSERT:
+            row = conn.execute(row_sql, (annotation_id,)).fetchone()
+            # Запись могла уйти в другую категорию после этого изменения — тогда
+            # для этой категории это удаление
+            if row is not None and (category is None or row[1] == category):
+                yield {"op": OP_UPSERT, "seq": seq, "record": export.row_to_record(row, tool_sets)}
+                continue
+        yield {"op": OP_DELETE, "seq": seq, "id": annotation_id, "category": change_category}
+
+
+# --- МАНИФЕСТ ---
+def load_manifest(out_dir):
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {"format_version": FORMAT_VERSION, "category": None, "watermark": 0, "deltas": []}
+    with open(manifest_path, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def _save_manifest(out_dir, manifest):
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+
+def export_delta(out_dir, since=None, category=None, path=None):
+    """Дописывает в out_dir файл изменений после водяной метки и обновляет манифест.
+
+    since по умолчанию берётся из манифеста. Возвращает описание дельты
+    (или None, если изменений нет).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    if manifest["deltas"] and manifest.get("category") != category:
+        raise ValueError(f"Каталог {out_dir} уже ведётся для категории {manifest.get('category')!r}")
+    manifest["category"] = category
+    since = manifest["watermark"] if since is None else since
+
+    # Метка и содержимое дельты берутся из одного снимка
+    with snapshot.open_snapshot(path) as snap:
+        until = snap.seq
+        if until <= since:
+            return None
+        number = len(manifest["deltas"]) + 1
+        file_name = DELTA_TEMPLATE.format(number)
+        tmp_path = os.path.join(out_dir, file_name + ".tmp")
+        counts = {OP_UPSERT: 0, OP_DELETE: 0}
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            for change in iter_delta(since, until, category, snap.conn, path):
+                counts[change["op"]] += 1
+                fh.write(json.dumps(change, ensure_ascii=False) + "\n")
+
+    if not counts[OP_UPSERT] and not counts[OP_DELETE]:
+        # seq сдвинулся из-за других категорий — пустой файл не нужен
+        os.remove(tmp_path)
+        return None
+    os.replace(tmp_path, os.path.join(out_dir, file_name))
+    delta = {
+        "file": file_name,
+        "from_seq": since,
+        "to_seq": until,
+        "upserts": counts[OP_UPSERT],
+        "deletes": counts[OP_DELETE],
+        "bytes": os.path.getsize(os.path.join(out_dir, file_name)),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    manifest["deltas"].append(delta)
+    manifest["watermark"] = until
+    _save_manifest(out_dir, manifest)
+    return delta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Дельта-экспорт изменений после водяной метки")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="дописать дельту в каталог синхронизации")
+    exp.add_argument("out_dir")
+    exp.add_argument("--since", type=int, default=None, help="водяная метка (по умолчанию из манифеста)")
+    exp.add_argument("--category", default=None)
+    exp.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    prn = sub.add_parser("prune", help="сжать журнал изменений до указанного seq")
+    prn.add_argument("--before", type=int, required=True)
+    prn.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    args = parser.parse_args(argv)
+
+    if args.command == "prune":
+        print(json.dumps({"pruned": prune(args.before, path=args.db)}))
+        return 0
+    delta = export_delta(args.out_dir, since=args.since, category=args.category, path=args.db)
+    print(json.dumps(delta or {"changes": 0}, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Потоковый экспорт аннотаций в JSON / JSONL.
+
+Строки читаются курсором порциями, фильтр по категории выполняется в SQL,
+результат пишется в файл по одной записи, поэтому расход памяти не зависит
+от размера датасета.
+"""
+import json
+import os
+import tempfile
+from contextlib import nullcontext
+
+from annotator import db, snapshot, toolsets
+
+CHUNK_SIZE = 500
+
+FORMAT_JSON = "json"
+FORMAT_JSONL = "jsonl"
+FORMATS = (FORMAT_JSON, FORMAT_JSONL)
+
+MIME_TYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_JSONL: "application/jsonl",
+}
+
+EXPORT_COLUMNS = "id, category, difficulty, query, tools_json, answers_json, turns_json, tool_set"
+
+
+# --- ЧТЕНИЕ ---
+# Только записи, принятые на проверке (annotator.review)
+ACCEPTED_FILTER = "id IN (SELECT annotation_id FROM review_queue WHERE status = 'accepted')"
+
+
+def _where(category=None, accepted_only=False):
+    conditions, params = [], ()
+    if category is not None:
+        conditions.append("category = ?")
+        params = (category,)
+    if accepted_only:
+        conditions.append(ACCEPTED_FILTER)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def build_query(category=None, accepted_only=False):
+    where, params = _where(category, accepted_only)
+    sql = f"SELECT {EXPORT_COLUMNS} FROM annotations{where}"
+    if category is not None:
+        # Порядок совпадает с индексом (category, created_at, id)
+        sql += " ORDER BY created_at, id"
+    return sql, params
+
+
+def count_query(category=None, accepted_only=False):
+    where, params = _where(category, accepted_only)
+    return f"SELECT count(*) FROM annotations{where}", params
+
+
+def iter_rows(category=None, chunk_size=CHUNK_SIZE, path=None, conn=None, accepted_only=False):
+    """conn — подключение снимка (annotator.snapshot); по умолчанию — из пула."""
+    sql, params = build_query(category, accepted_only)
+    with (nullcontext(conn) if conn is not None else db.connection(path)) as conn:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+
+def row_to_record(row, tool_sets):
+    row_id, category, difficulty, query, tools_json, answers_json, turns_json, tool_set = row
+    # tools/answers в экспорте — строки с JSON, turns — вложенный объект.
+    # Каждый blob разбирается и сериализуется ровно один раз, наборы
+    # инструментов берутся из кэша tool_sets.
+    return {
+        "id": row_id,
+        "category": category,
+        "difficulty": difficulty,
+        "query": query,
+        "tools": tool_sets.tools_json(tools_json, tool_set),
+        "answers": json.dumps(json.loads(answers_json), ensure_ascii=False),
+        "turns": json.loads(turns_json),
+    }
+
+
+def iter_records(category=None, on_error=None, chunk_size=CHUNK_SIZE, path=None, conn=None,
+                 accepted_only=False):
+    tool_sets = toolsets.ToolSetCache(path, conn=conn)
+    for row in iter_rows(category, chunk_size=chunk_size, path=path, conn=conn, accepted_only=accepted_only):
+        try:
+            yield row_to_record(row, tool_sets)
+        except Exception as e:
+            if on_error is None:
+                raise
+            on_error(row[0], e)
+
+
+# --- СЕРИАЛИЗАЦИЯ ---
+def iter_json_array(records):
+    # Побайтово совпадает с json.dumps(list(records), indent=4, ensure_ascii=False),
+    # но не держит весь список в памяти
+    first = True
+    for record in records:
+        body = json.dumps(record, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+        yield ("[\n    " if first else ",\n    ") + body
+        first = False
+    yield "[]" if first else "\n]"
+
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+SERIALIZERS = {
+    FORMAT_JSON: iter_json_array,
+    FORMAT_JSONL: iter_jsonl,
+}
+
+
+def write_records(records, fh, fmt=FORMAT_JSON):
+    count = 0
+
+    def counted():
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    for chunk in SERIALIZERS[fmt](counted()):
+        fh.write(chunk)
+    return count
+
+
+def export_category(category, fmt=FORMAT_JSON, directory=None, on_error=None, path=None,
+                    accepted_only=False):
+    """Пишет экспорт во временный файл и возвращает (путь, число записей).
+
+    Строки читаются из одного снимка базы, параллельные сохранения в файл не попадают.
+    """
+    if fmt not in SERIALIZERS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+    fd, file_path = tempfile.mkstemp(prefix="export_", suffix=f".{fmt}", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            with snapshot.open_snapshot(path) as snap:
+                records = iter_records(category, on_error=on_error, path=path, conn=snap.conn,
+                                       accepted_only=accepted_only)
+                count = write_records(records, fh, fmt)
+    except BaseException:
+        os.remove(file_path)
+        raise
+    return file_path, count
+
+
+def list_categories(path=None):
+    rows = db.fetch_all("SELECT DISTINCT category FROM annotations ORDER BY category", path=path)
+    return [row[0] for row in rows]
@@ -0,0 +1,82 @@
+"""Выдача id образцов по категориям блоками из таблицы счётчиков.
+
+Сессия резервирует блок из BLOCK_SIZE номеров одним UPSERT ... RETURNING
+по первичному ключу категории, поэтому выдача не зависит от размера
+annotations, а два аннотатора никогда не получат один и тот же номер.
+Триггер сдвигает счётчик за каждый вставленный id вида kk_<категория>_N
+(импорт, ручной ввод), так что следующий блок всегда начинается за ними.
+"""
+import re
+
+from annotator import db, writer
+
+BLOCK_SIZE = 10
+ID_TEMPLATE = "kk_{category}_{number:03d}"
+ID_RE = re.compile(r"^kk_(?P<category>.+)_(?P<number>\d+)$")
+
+
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS id_counters (
+            category TEXT PRIMARY KEY,
+            next_value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # prefix — id без хвостовых цифр; то же разбиение, что у ID_RE
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_id_counter
+        AFTER INSERT ON annotations
+        WHEN NEW.id GLOB 'kk_?*_[0-9]*'
+        BEGIN
+            INSERT INTO id_counters (category, next_value)
+            SELECT substr(prefix, 4, length(prefix) - 4), CAST(substr(NEW.id, length(prefix) + 1) AS INTEGER) + 1
+            FROM (SELECT rtrim(NEW.id, '0123456789') AS prefix)
+            WHERE prefix GLOB 'kk_?*_' AND length(NEW.id) - length(prefix) BETWEEN 1 AND 18
+            ON CONFLICT (category) DO UPDATE SET next_value = max(next_value, excluded.next_value);
+        END
+    ''')
+
+
+def backfill(conn):
+    # Один проход при миграции: счётчик каждой категории — за максимальным занятым номером
+    highest = {}
+    for (sample_id,) in conn.execute("SELECT id FROM annotations"):
+        match = ID_RE.match(sample_id or "")
+        if match:
+            category, number = match["category"], int(match["number"])
+            highest[category] = max(highest.get(category, 0), number)
+    conn.executemany('''
+        INSERT INTO id_counters (category, next_value) VALUES (?, ?)
+        ON CONFLICT (category) DO UPDATE SET next_value = max(next_value, excluded.next_value)
+    ''', [(category, number + 1) for category, number in highest.items()])
+
+
+def format_id(category, number):
+    return ID_TEMPLATE.format(category=category, number=number)
+
+
+def reserve_block(category, size=BLOCK_SIZE, path=None):
+    """Атомарно резервирует номера [start, end) для категории."""
+    def reserve(conn):
+        end = conn.execute('''
+            INSERT INTO id_counters (category, next_value) VALUES (?, 1 + ?)
+            ON CONFLICT (category) DO UPDATE SET next_value = next_value + excluded.next_value - 1
+            RETURNING next_value
+        ''', (category, size)).fetchall()[0][0]
+        return end - size, end
+    return writer.write(reserve, path=path)
+
+
+def next_id(blocks, category, path=None):
+    """Следующий свободный id из блока сессии; blocks — {категория: [следующий, конец]}."""
+    while True:
+        block = blocks.get(category)
+        if block is None or block[0] >= block[1]:
+            block = blocks[category] = list(reserve_block(category, path=path))
+        number = block[0]
+        block[0] += 1
+        sample_id = format_id(category, number)
+        # Счётчик уже за всеми вставленными id; занятым может оказаться только
+        # номер, введённый вручную после резервирования блока, — он пропускается
+        if db.fetch_one("SELECT 1 FROM annotations WHERE id = ?", (sample_id,), path=path) is None:
+            return sample_id
@@ -0,0 +1,396 @@
+"""Пакетный импорт аннотаций из JSON-массива или JSONL.
+
+Формат записей — тот же, что выдаёт экспорт: tools и answers могут быть
+строками с JSON (как в экспорте) или уже разобранными списками. Файл читается
+потоково, записи проверяются и пишутся батчами через executemany. Батч
+уходит единственному писателю (annotator.writer) небольшими порциями, а
+сигнатуры MinHash считаются до записи, так что сохранения из интерфейса
+встают в очередь между порциями, а не ждут весь импорт.
+
+    python -m annotator.importer drafts.jsonl --on-conflict version
+"""
+import argparse
+import io
+import json
+import sys
+import time
+
+from annotator import dedup, revisions, storage, tools, toolsets, validation, writer
+
+BATCH_SIZE = 5000
+# Записей на одну транзакцию писателя
+WRITE_CHUNK = 100
+READ_CHUNK = 1 << 16
+MAX_KEPT_ERRORS = 1000
+
+ON_CONFLICT_SKIP = "skip"
+ON_CONFLICT_OVERWRITE = "overwrite"
+ON_CONFLICT_VERSION = "version"
+CONFLICT_MODES = (ON_CONFLICT_SKIP, ON_CONFLICT_OVERWRITE, ON_CONFLICT_VERSION)
+
+REQUIRED_FIELDS = ("id", "category", "difficulty", "query", "turns")
+# Пишутся в annotations как есть, поэтому обязаны быть строками
+STRING_FIELDS = ("id", "category", "difficulty", "query", "author")
+
+class RecordError(ValueError):
+    pass
+
+
+# --- ПОТОКОВОЕ ЧТЕНИЕ ---
+def _iter_lines(buffer, fh):
+    """Строки потока, начиная с уже прочитанного buffer."""
+    while True:
+        newline = buffer.find("\n")
+        while newline < 0:
+            chunk = fh.read(READ_CHUNK)
+            if not chunk:
+                if buffer:
+                    yield buffer
+                return
+            buffer += chunk
+            newline = buffer.find("\n")
+        yield buffer[:newline]
+        buffer = buffer[newline + 1:]
+
+
+def _iter_jsonl(buffer, fh):
+    index = 0
+    for line_number, line in enumerate(_iter_lines(buffer, fh), start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError as e:
+            obj = RecordError(f"строка {line_number}: некорректный JSON: {e}")
+        yield index, obj
+        index += 1
+
+
+def _iter_array(buffer, fh):
+    decoder = json.JSONDecoder()
+    eof = False
+
+    def fill():
+        nonlocal buffer, eof
+        chunk = fh.read(READ_CHUNK)
+        if not chunk:
+            eof = True
+        buffer += chunk
+
+    def skip(chars):
+        nonlocal buffer
+        while True:
+            stripped = buffer.lstrip(chars)
+            if stripped or eof:
+                buffer = stripped
+                return
+            buffer = ""
+            fill()
+
+    index = 0
+    while True:
+        skip(" \t\r\n,")
+        if not buffer:
+            raise RecordError("JSON-массив не закрыт")
+        if buffer[0] == "]":
+            return
+        while True:
+            try:
+                obj, end = decoder.raw_decode(buffer)
+                break
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise RecordError(f"запись {index}: некорректный JSON: {e}") from None
+                fill()
+        buffer = buffer[end:]
+        yield index, obj
+        index += 1
+
+
+def iter_json_records(fh):
+    """Генерирует (номер записи, объект) из JSON-массива или JSONL.
+
+    В JSONL каждая строка разбирается отдельно: вместо объекта битой строки
+    выдаётся RecordError с номером строки, чтение продолжается. Обрезанный
+    или некорректный JSON-массив — RecordError, дальше читать нельзя.
+    """
+    buffer = ""
+    while True:
+        chunk = fh.read(READ_CHUNK)
+        if not chunk:
+            return
+        buffer = (buffer + chunk).lstrip(" \t\r\n\ufeff")
+        if buffer:
+            break
+    if buffer[0] == "[":
+        yield from _iter_array(buffer[1:], fh)
+    else:
+        yield from _iter_jsonl(buffer, fh)
+
+
+# --- ПРОВЕРКА И НОРМАЛИЗАЦИЯ ---
+def _as_list(value, field):
+    if isinstance(value, str):
+        value = json.loads(value)
+    if not isinstance(value, list):
+        raise RecordError(f"{field}: ожидается список")
+    return value
+
+
+def normalize_record(obj, default_author, validators=None):
+    """Превращает запись экспорта в строку для annotations или бросает RecordError.
+
+    На месте tools_json остаётся список инструментов: в набор он превращается
+    при записи батча (см. _with_tool_sets).
+    """
+    if not isinstance(obj, dict):
+        raise RecordError("запись должна быть JSON-объектом")
+    missing = [field for field in REQUIRED_FIELDS if not obj.get(field)]
+    if missing:
+        raise RecordError(f"нет полей: {', '.join(missing)}")
+    not_strings = [field for field in STRING_FIELDS if obj.get(field) is not None and not isinstance(obj[field], str)]
+    if not_strings:
+        raise RecordError(f"должны быть строками: {', '.join(not_strings)}")
+    try:
+        tools_obj = _as_list(obj.get("tools", []), "tools")
+        answers_obj = _as_list(obj.get("answers", []), "answers")
+        turns_obj = _as_list(obj["turns"], "turns")
+    except json.JSONDecodeError as e:
+        raise RecordError(f"некорректный JSON во вложенном поле: {e}") from None
+    if validators is not None:
+        problems = validation.validate_record(answers_obj, turns_obj, validators)
+        if problems:
+            raise RecordError("; ".join(
+                f"{tool or '-'}: {message}" for _, tool, message in problems))
+    return [
+        obj["id"],
+        obj["category"],
+        obj["difficulty"],
+        obj["query"],
+        tools_obj,
+        json.dumps(answers_obj, ensure_ascii=False),
+        json.dumps(turns_obj, ensure_ascii=False),
+        obj.get("author") or default_author,
+    ]
+
+
+# --- ЗАПИСЬ ---
+def _existing_ids(conn, ids):
+    found = set()
+    ids = list(ids)
+    for start in range(0, len(ids), 500):
+        part = ids[start:start + 500]
+        placeholders = ",".join("?" * len(part))
+        found.update(row[0] for row in conn.execute(
+            f"SELECT id FROM annotations WHERE id IN ({placeholders})", part))
+    return found
+
+
+def _existing_rows(conn, ids):
+    """{id: строка с колонками revisions.COLUMNS} для уже сохранённых ids."""
+    found = {}
+    ids = list(ids)
+    for start in range(0, len(ids), 500):
+        part = ids[start:start + 500]
+        placeholders = ",".join("?" * len(part))
+        for row in conn.execute(f"SELECT id, {revisions.SELECT_COLUMNS} FROM annotations "
+                                f"WHERE id IN ({placeholders})", part):
+            found[row[0]] = row[1:]
+    return found
+
+
+def _next_version_id(conn, base_id, taken):
+    version = 2
+    for (existing,) in conn.execute("SELECT id FROM annotations WHERE id GLOB ?",
+                                    (base_id.replace("[", "[[]").replace("*", "[*]").replace("?", "[?]")
+                                     + "_v[0-9]*",)):
+        suffix = existing[len(base_id) + 2:]
+        if suffix.isdigit():
+            version = max(version, int(suffix) + 1)
+    while f"{base_id}_v{version}" in taken:
+        version += 1
+    return f"{base_id}_v{version}"
+
+
+def _with_tool_sets(conn, rows):
+    prepared = []
+    for row in rows:
+        tools_json, tool_set = toolsets.prepare(conn, row[4])
+        prepared.append([*row[:4], tools_json, *row[5:], tool_set])
+    return prepared
+
+
+def _write_batch(conn, rows, on_conflict, signatures=None, author=None):
+    """Пишет батч в транзакции вызывающего; signatures — MinHash запросов в порядке rows.
+
+    В режиме overwrite заменяемые записи получают ревизию с автором author.
+    Возвращает счётчики батча: писатель может повторить задание после
+    "database is locked", поэтому ImportResult обновляет вызывающий.
+    """
+    counts = {"inserted": 0, "replaced": 0, "skipped": 0, "versioned": 0}
+    if signatures is None:
+        signatures = [dedup.signature(row[3]) for row in rows]
+    rows = _with_tool_sets(conn, rows)
+    indexed = list(zip(rows, signatures))
+    if on_conflict == ON_CONFLICT_OVERWRITE:
+        existing = _existing_rows(conn, {row[0] for row in rows})
+        conn.executemany(storage.UPSERT_SQL, rows)
+        current = _existing_rows(conn, existing)
+        for sample_id, previous in existing.items():
+            revisions.record(conn, sample_id, previous, current[sample_id], author=author)
+        replaced = len(existing) + len(rows) - len({row[0] for row in rows})
+        counts["replaced"] += replaced
+        counts["inserted"] += len(rows) - replaced
+    elif on_conflict == ON_CONFLICT_SKIP:
+        existing = _existing_ids(conn, {row[0] for row in rows})
+        # Пропущенные строки не должны попасть в индекс дубликатов
+        fresh = []
+        for row, sig in indexed:
+            if row[0] not in existing:
+                existing.add(row[0])
+                fresh.append((row, sig))
+        conn.executemany(storage.INSERT_SQL, [row for row, _ in fresh])
+        counts["inserted"] += len(fresh)
+        counts["skipped"] += len(rows) - len(fresh)
+        indexed = fresh
+    else:
+        existing = _existing_ids(conn, {row[0] for row in rows})
+        taken = set(existing)
+        for row in rows:
+            if row[0] in taken:
+                row[0] = _next_version_id(conn, row[0], taken)
+                counts["versioned"] += 1
+            else:
+                counts["inserted"] += 1
+            taken.add(row[0])
+        conn.executemany(storage.INSERT_SQL, rows)
+    dedup.index_signatures(conn, [(row[0], sig) for row, sig in indexed])
+    return counts
+
+
+class ImportResult:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.replaced = 0
+        self.skipped = 0
+        self.versioned = 0
+        self.error_count = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    def add(self, counts):
+        for name, value in counts.items():
+            setattr(self, name, getattr(self, name) + value)
+
+    @property
+    def records_per_second(self):
+        return round(self.read / self.seconds, 1) if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "replaced": self.replaced,
+            "skipped": self.skipped,
+            "versioned": self.versioned,
+            "errors": self.error_count,
+            "seconds": round(self.seconds, 3),
+            "records_per_second": self.records_per_second,
+        }
+
+
+def import_stream(fh, on_conflict=ON_CONFLICT_SKIP, author="import", batch_size=BATCH_SIZE,
+                  check_arguments=True, on_error=None, path=None):
+    """Импортирует записи из текстового потока fh.
+
+    on_error(номер, id, сообщение) вызывается для каждой отклонённой записи;
+    первые MAX_KEPT_ERRORS ошибок также сохраняются в результате.
+    """
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f"Неизвестный режим конфликтов: {on_conflict}")
+    started = time.perf_counter()
+    result = ImportResult()
+    validators = validation.get_validators(tools.get_catalog()) if check_arguments else None
+
+    def reject(index, record_id, message):
+        result.error_count += 1
+        if len(result.errors) < MAX_KEPT_ERRORS:
+            result.errors.append({"index": index, "id": record_id, "error": message})
+        if on_error is not None:
+            on_error(index, record_id, message)
+
+    def flush(rows):
+        for start in range(0, len(rows), WRITE_CHUNK):
+            chunk = rows[start:start + WRITE_CHUNK]
+            signatures = [dedup.signature(row[3]) for row in chunk]
+            result.add(writer.write(lambda conn: _write_batch(conn, chunk, on_conflict, signatures, author),
+                                    path=path))
+
+    batch = []
+    try:
+        for index, obj in iter_json_records(fh):
+            result.read += 1
+            if isinstance(obj, RecordError):
+                reject(index, None, str(obj))
+                continue
+            try:
+                batch.append(normalize_record(obj, author, validators))
+            except RecordError as e:
+                reject(index, obj.get("id") if isinstance(obj, dict) else None, str(e))
+                continue
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+    except RecordError as e:
+        # Обрезанный JSON-массив: дальше читать нечего
+        reject(result.read, None, str(e))
+    if batch:
+        flush(batch)
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def import_file(file_path, **kwargs):
+    with open(file_path, encoding="utf-8") as fh:
+        return import_stream(fh, **kwargs)
+
+
+def import_bytes_stream(binary_fh, **kwargs):
+    # Для st.file_uploader: UploadedFile отдаёт байты
+    return import_stream(io.TextIOWrapper(binary_fh, encoding="utf-8"), **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт аннотаций из JSON/JSONL")
+    parser.add_argument("file", help="JSON-массив или JSONL в формате экспорта")
+    parser.add_argument("--on-conflict", choices=CONFLICT_MODES, default=ON_CONFLICT_SKIP,
+                        help="что делать с уже существующими id")
+    parser.add_argument("--author", default="import", help="автор для записей без поля author")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-arg-check", action="store_true", help="не проверять аргументы по схемам")
+    parser.add_argument("--errors", default=None, help="записать отклонённые записи в JSONL")
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    args = parser.parse_args(argv)
+
+    errors_fh = open(args.errors, "w", encoding="utf-8") if args.errors else None
+
+    def on_error(index, record_id, message):
+        if errors_fh is not None:
+            errors_fh.write(json.dumps({"index": index, "id": record_id, "error": message},
+                                       ensure_ascii=False) + "\n")
+
+    try:
+        result = import_file(args.file, on_conflict=args.on_conflict, author=args.author,
+                             batch_size=args.batch_size, check_arguments=not args.no_arg_check,
+                             on_error=on_error, path=args.db)
+    finally:
+        if errors_fh is not None:
+            errors_fh.close()
+    print(json.dumps(result.as_dict(), ensure_ascii=False))
+    return 1 if result.error_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
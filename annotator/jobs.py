@@ -0,0 +1,240 @@
+"""Фоновые задания экспорта со сжатыми артефактами.
+
+Экспорт выполняется в пуле потоков процесса, а не в прогоне Streamlit-скрипта.
+Состояние и прогресс заданий хранятся в таблице export_jobs, страница их
+опрашивает. Готовый .gz-артефакт переиспользуется, пока версия данных
+категории (category_versions, поддерживается триггерами) не изменилась, так
+что несколько аннотаторов скачивают один и тот же файл.
+"""
+import gzip
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from annotator import db, export, snapshot, writer
+
+EXPORT_DIR = os.environ.get("ANNOTATOR_EXPORT_DIR", "exports")
+MAX_WORKERS = 2
+PROGRESS_EVERY_ROWS = 1000
+PROGRESS_EVERY_SECONDS = 0.5
+
+# Пустая строка — версия всего датасета (экспорт без фильтра по категории)
+ALL_CATEGORIES = ""
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+JOB_COLUMNS = ("id", "category", "fmt", "data_version", "status", "progress", "total",
+               "artifact", "error", "requested_by", "created_at", "finished_at", "snapshot", "accepted_only")
+
+
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS category_versions (
+            category TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    bump = '''
+            INSERT INTO category_versions (category, version) VALUES (coalesce({src}.category, ''), 1)
+            ON CONFLICT (category) DO UPDATE SET version = version + 1;'''
+    bump_all = '''
+            INSERT INTO category_versions (category, version) VALUES ('', 1)
+            ON CONFLICT (category) DO UPDATE SET version = version + 1;'''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_version_insert
+        AFTER INSERT ON annotations
+        BEGIN{bump.format(src="NEW")}{bump_all}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_version_delete
+        AFTER DELETE ON annotations
+        BEGIN{bump.format(src="OLD")}{bump_all}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_version_update
+        AFTER UPDATE ON annotations
+        BEGIN{bump.format(src="OLD")}{bump.format(src="NEW")}{bump_all}
+        END
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            id INTEGER PRIMARY KEY,
+            category TEXT NOT NULL,
+            fmt TEXT NOT NULL,
+            data_version INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            artifact TEXT,
+            error TEXT,
+            requested_by TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_export_jobs_key "
+                 "ON export_jobs (category, fmt, data_version, status)")
+
+
+# --- ВЕРСИИ ДАННЫХ ---
+def data_version(category=None, conn=None, path=None):
+    key = ALL_CATEGORIES if category is None else category
+    sql = "SELECT version FROM category_versions WHERE category = ?"
+    row = conn.execute(sql, (key,)).fetchone() if conn is not None else db.fetch_one(sql, (key,), path=path)
+    return row[0] if row else 0
+
+
+# --- ИСПОЛНИТЕЛЬ ---
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor(path=None):
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Задания, оставшиеся активными после перезапуска процесса, уже никто не выполнит
+                writer.write(lambda conn: conn.execute(
+                    "UPDATE export_jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP "
+                    "WHERE status IN (?, ?)",
+                    (STATUS_FAILED, "прервано перезапуском", *ACTIVE_STATUSES)), path=path)
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="export-job")
+    return _executor
+
+
+def _artifact_path(category, fmt, version, accepted_only=False):
+    name = category if category is not None else "all"
+    if accepted_only:
+        name += ".accepted"
+    return os.path.join(EXPORT_DIR, f"{name}.v{version}.{fmt}.gz")
+
+
+def _set(job_id, path=None, **fields):
+    assignments = ", ".join(f"{key} = ?" for key in fields)
+    writer.write(lambda conn: conn.execute(
+        f"UPDATE export_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id)), path=path)
+
+
+def _run_job(job_id, category, fmt, path=None, accepted_only=False):
+    tmp_artifact = None
+    try:
+        # Весь экспорт читается из одного снимка: версия, число строк и сами
+        # строки согласованы, а сохранения аннотаторов идут параллельно
+        with snapshot.open_snapshot(path) as snap:
+            version = data_version(category, conn=snap.conn)
+            artifact = _artifact_path(category, fmt, version, accepted_only)
+            tmp_artifact = f"{artifact}.{job_id}.part"
+            sql, params = export.count_query(category, accepted_only)
+            _set(job_id, path=path, status=STATUS_RUNNING, data_version=version, snapshot=snap.tag,
+                 total=snap.conn.execute(sql, params).fetchone()[0])
+
+            done = 0
+            last_report = time.monotonic()
+
+            def tracked(records):
+                nonlocal done, last_report
+                for record in records:
+                    yield record
+                    done += 1
+                    now = time.monotonic()
+                    if done % PROGRESS_EVERY_ROWS == 0 and now - last_report >= PROGRESS_EVERY_SECONDS:
+                        _set(job_id, path=path, progress=done)
+                        last_report = now
+
+            # Битые строки пропускаются, как и в прежнем экспорте; первые из них попадают в error
+            row_errors = []
+
+            def on_error(row_id, e):
+                if len(row_errors) < 20:
+                    row_errors.append(f"{row_id}: {e}")
+
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            records = export.iter_records(category, on_error=on_error, path=path, conn=snap.conn,
+                                          accepted_only=accepted_only)
+            with gzip.open(tmp_artifact, "wt", encoding="utf-8", compresslevel=6) as fh:
+                export.write_records(tracked(records), fh, fmt)
+        os.replace(tmp_artifact, artifact)
+        _set(job_id, path=path, status=STATUS_DONE, progress=done, artifact=artifact,
+             error="; ".join(row_errors) or None,
+             finished_at=time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
+        _remove_stale_artifacts(category, fmt, version, accepted_only, path=path)
+    except Exception as e:
+        if tmp_artifact is not None and os.path.exists(tmp_artifact):
+            os.remove(tmp_artifact)
+        _set(job_id, path=path, status=STATUS_FAILED, error=str(e),
+             finished_at=time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
+
+
+def _remove_stale_artifacts(category, fmt, version, accepted_only=False, path=None):
+    key = ALL_CATEGORIES if category is None else category
+    stale = db.fetch_all(
+        "SELECT id, artifact FROM export_jobs WHERE category = ? AND fmt = ? AND accepted_only = ? "
+        "AND data_version < ? AND status = ? AND artifact IS NOT NULL",
+        (key, fmt, int(accepted_only), version, STATUS_DONE), path=path)
+    for job_id, artifact in stale:
+        if os.path.exists(artifact):
+            os.remove(artifact)
+        _set(job_id, path=path, artifact=None)
+
+
+# --- API ---
+def submit_export(category, fmt=export.FORMAT_JSON, requested_by=None, path=None, accepted_only=False):
+    """Возвращает id задания: готового, уже выполняющегося или нового.
+
+    accepted_only — только записи, принятые на проверке (annotator.review).
+    """
+    if fmt not in export.SERIALIZERS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+    executor = _get_executor(path)
+    key = ALL_CATEGORIES if category is None else category
+
+    def find_or_create(conn):
+        version = data_version(category, conn)
+        rows = conn.execute(
+            "SELECT id, status, artifact FROM export_jobs "
+            "WHERE category = ? AND fmt = ? AND accepted_only = ? AND data_version = ? AND status IN (?, ?, ?) "
+            "ORDER BY id DESC", (key, fmt, int(accepted_only), version, STATUS_DONE, *ACTIVE_STATUSES)).fetchall()
+        for job_id, status, artifact in rows:
+            if status != STATUS_DONE or (artifact and os.path.exists(artifact)):
+                return job_id, version, False
+        cursor = conn.execute(
+            "INSERT INTO export_jobs (category, fmt, data_version, status, requested_by, accepted_only) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (key, fmt, version, STATUS_QUEUED, requested_by, int(accepted_only)))
+        return cursor.lastrowid, version, True
+
+    job_id, version, created = writer.write(find_or_create, path=path)
+    if created:
+        executor.submit(_run_job, job_id, category, fmt, path, accepted_only)
+    return job_id
+
+
+def get_job(job_id, path=None):
+    row = db.fetch_one(f"SELECT {', '.join(JOB_COLUMNS)} FROM export_jobs WHERE id = ?", (job_id,), path=path)
+    if row is None:
+        return None
+    job = dict(zip(JOB_COLUMNS, row))
+    # Артефакт мог устареть: данные категории изменились после экспорта
+    job["stale"] = job["data_version"] != data_version(job["category"] or None, path=path)
+    return job
+
+
+def recent_jobs(limit=20, path=None):
+    rows = db.fetch_all(f"SELECT {', '.join(JOB_COLUMNS)} FROM export_jobs ORDER BY id DESC LIMIT ?",
+                        (limit,), path=path)
+    return [dict(zip(JOB_COLUMNS, row)) for row in rows]
+
+
+def shutdown(wait=True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
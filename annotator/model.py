@@ -0,0 +1,79 @@
+"""Модель записи датасета и сборка диалога (turns) из шагов редактора.
+
+Формат записи — тот же, что пишет экспорт: id, category, difficulty, query,
+tools, answers, turns и author. Шаг редактора — словарь с полями plan,
+thought, tool, args (JSON-строка) и output.
+"""
+import json
+
+from annotator import tools, validation
+
+CATEGORIES = (
+    "tool_awareness",
+    "planning_multistep",
+    "api_discovery",
+    "argument_schema",
+    "state_context",
+    "exception_handling",
+    "answer_synthesis",
+)
+DIFFICULTIES = ("easy", "hard")
+
+
+class StepError(ValueError):
+    """Шаг с инструментом не прошёл разбор или проверку аргументов."""
+
+    def __init__(self, tool, messages):
+        super().__init__("; ".join(messages))
+        self.tool = tool
+        self.messages = messages
+
+
+def build_turns(query, steps, final_answer, catalog=None):
+    """Собирает (turns, answers) по схеме APIGen: [Мысль -> Вызов -> Результат] на шаг.
+
+    Бросает StepError на первом шаге с некорректным JSON или аргументами.
+    """
+    catalog = catalog or tools.get_catalog()
+    turns = [{"role": "user", "content": query}]
+    answers = []
+    for step in steps:
+        plan = step.get('plan')
+        thought = step.get('thought')
+        # Мысль добавляется, если заполнена, даже без вызова инструмента
+        if thought or plan:
+            turns.append({
+                "role": "assistant",
+                "content": thought if thought else "...",
+                "meta": {"plan": plan if plan else ""}
+            })
+
+        name = step.get('tool', tools.NO_TOOL)
+        if name == tools.NO_TOOL:
+            continue
+        try:
+            args = json.loads(step['args'])
+        except json.JSONDecodeError:
+            raise StepError(name, ["Ошибка JSON в аргументах"]) from None
+        arg_errors = validation.validate_call(name, args, catalog)
+        if arg_errors:
+            raise StepError(name, arg_errors)
+        turns.append({"role": "assistant", "tool_call": {"name": name, "arguments": args}})
+        turns.append({"role": "tool", "content": step['output']})
+        answers.append({"name": name, "arguments": args})
+
+    turns.append({"role": "assistant", "content": final_answer})
+    return turns, answers
+
+
+def build_annotation(sample_id, category, difficulty, query, tool_defs, answers, turns, author):
+    return {
+        "id": sample_id,
+        "category": category,
+        "difficulty": difficulty,
+        "query": query,
+        "tools": tool_defs,
+        "answers": answers,
+        "turns": turns,
+        "author": author,
+    }
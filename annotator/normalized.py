@@ -0,0 +1,314 @@
+"""Нормализованное хранение реплик и вызовов инструментов.
+
+Триггеры раскладывают turns_json и answers_json каждой записи по таблицам:
+
+    turns           (annotation_id, turn_index) -> роль, текст, план, вызов
+    tool_calls      (annotation_id, call_index) -> инструмент, аргументы
+    tool_call_args  (annotation_id, call_index, arg_key) -> значение
+
+Имена инструментов и ключи аргументов индексированы, поэтому аналитика по
+инструментам — обычные индексные SQL-запросы без разбора JSON. Реплики
+нестандартной формы хранятся целиком в raw_json, что позволяет восстановить
+экспорт байт в байт (iter_records / verify).
+
+    python -m annotator.normalized --verify
+"""
+import argparse
+import json
+import sys
+
+from annotator import db, export, toolsets, writer
+
+SHAPE_TEXT = "text"
+SHAPE_THOUGHT = "thought"
+SHAPE_CALL = "call"
+
+_KEYS = "(SELECT group_concat(key) FROM json_each({value}))"
+
+# JSON-текст элемента json_each: контейнеры уже JSON, скаляры нужно закавычить
+_ELEMENT_JSON = "CASE WHEN {alias}.type IN ('object', 'array') THEN {alias}.value ELSE json_quote({alias}.value) END"
+
+
+def _turn_shape(alias):
+    # Форма реплики, если она в точности одна из стандартных, иначе NULL.
+    # CASE задаёт порядок проверок: JSON-функции вызываются только для объектов.
+    value = f"{alias}.value"
+    return f'''CASE
+        WHEN {alias}.type != 'object' OR json_type({value}, '$.role') IS NOT 'text' THEN NULL
+        WHEN {_KEYS.format(value=value)} = 'role,content'
+             AND json_type({value}, '$.content') = 'text' THEN '{SHAPE_TEXT}'
+        WHEN {_KEYS.format(value=value)} = 'role,content,meta'
+             AND json_type({value}, '$.content') = 'text'
+             AND json_type({value}, '$.meta') = 'object'
+             AND json_type({value}, '$.meta.plan') = 'text'
+             AND {_KEYS.format(value=f"json_extract({value}, '$.meta')")} = 'plan' THEN '{SHAPE_THOUGHT}'
+        WHEN {_KEYS.format(value=value)} = 'role,tool_call'
+             AND json_type({value}, '$.tool_call') = 'object'
+             AND json_type({value}, '$.tool_call.name') = 'text'
+             AND json_type({value}, '$.tool_call.arguments') = 'object'
+             AND {_KEYS.format(value=f"json_extract({value}, '$.tool_call')")} = 'name,arguments'
+             THEN '{SHAPE_CALL}'
+    END'''
+
+
+_CALL_IS_CANONICAL = f'''(CASE
+    WHEN c.type != 'object' THEN 0
+    WHEN json_type(c.value, '$.name') = 'text'
+         AND json_type(c.value, '$.arguments') = 'object'
+         AND {_KEYS.format(value="c.value")} = 'name,arguments' THEN 1
+    ELSE 0
+END)'''
+
+
+def _json_array(column, src):
+    return f"json_each(CASE WHEN json_valid({src}.{column}) THEN {src}.{column} ELSE '[]' END)"
+
+
+def _insert_sql(src, source=""):
+    # source — дополнительная таблица в FROM ("annotations AS src, ") для пересборки
+    return f'''
+            INSERT INTO turns (annotation_id, turn_index, shape, role, content, plan,
+                               tool_name, arguments_json, raw_json)
+            SELECT annotation_id, turn_index, shape,
+                   CASE WHEN is_object THEN json_extract(value_json, '$.role') END,
+                   CASE WHEN shape IN ('{SHAPE_TEXT}', '{SHAPE_THOUGHT}')
+                        THEN json_extract(value_json, '$.content') END,
+                   CASE WHEN shape = '{SHAPE_THOUGHT}' THEN json_extract(value_json, '$.meta.plan') END,
+                   CASE WHEN shape = '{SHAPE_CALL}' THEN json_extract(value_json, '$.tool_call.name') END,
+                   CASE WHEN shape = '{SHAPE_CALL}' THEN json_extract(value_json, '$.tool_call.arguments') END,
+                   CASE WHEN shape IS NULL THEN value_json END
+            FROM (
+                SELECT {src}.id AS annotation_id, t.key AS turn_index, t.type = 'object' AS is_object,
+                       {_ELEMENT_JSON.format(alias="t")} AS value_json,
+                       {_turn_shape("t")} AS shape
+                FROM {source}{_json_array("turns_json", src)} AS t
+            );
+            INSERT INTO tool_calls (annotation_id, call_index, tool_name, arguments_json, arg_count, raw_json)
+            SELECT {src}.id, c.key,
+                   CASE WHEN c.type = 'object' THEN json_extract(c.value, '$.name') END,
+                   CASE WHEN {_CALL_IS_CANONICAL} THEN json_extract(c.value, '$.arguments') END,
+                   CASE WHEN {_CALL_IS_CANONICAL}
+                        THEN (SELECT count(*) FROM json_each(c.value, '$.arguments')) END,
+                   CASE WHEN NOT {_CALL_IS_CANONICAL} THEN {_ELEMENT_JSON.format(alias="c")} END
+            FROM {source}{_json_array("answers_json", src)} AS c;
+            INSERT INTO tool_call_args (annotation_id, call_index, tool_name, arg_key, value_type, value_json)
+            SELECT {src}.id, c.key, json_extract(c.value, '$.name'), a.key, a.type,
+                   {_ELEMENT_JSON.format(alias="a")}
+            FROM {source}{_json_array("answers_json", src)} AS c,
+                 json_each(CASE WHEN c.type != 'object' THEN '{{}}'
+                                WHEN json_type(c.value, '$.arguments') = 'object'
+                                THEN json_extract(c.value, '$.arguments') ELSE '{{}}' END) AS a;'''
+
+
+def _delete_sql(src):
+    return f'''
+            DELETE FROM turns WHERE annotation_id = {src}.id;
+            DELETE FROM tool_calls WHERE annotation_id = {src}.id;
+            DELETE FROM tool_call_args WHERE annotation_id = {src}.id;'''
+
+
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS turns (
+            annotation_id TEXT NOT NULL,
+            turn_index INTEGER NOT NULL,
+            shape TEXT,
+            role TEXT,
+            content TEXT,
+            plan TEXT,
+            tool_name TEXT,
+            arguments_json TEXT,
+            raw_json TEXT,
+            PRIMARY KEY (annotation_id, turn_index)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tool_calls (
+            annotation_id TEXT NOT NULL,
+            call_index INTEGER NOT NULL,
+            tool_name TEXT,
+            arguments_json TEXT,
+            arg_count INTEGER,
+            raw_json TEXT,
+            PRIMARY KEY (annotation_id, call_index)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tool_call_args (
+            annotation_id TEXT NOT NULL,
+            call_index INTEGER NOT NULL,
+            tool_name TEXT,
+            arg_key TEXT NOT NULL,
+            value_type TEXT,
+            value_json TEXT,
+            PRIMARY KEY (annotation_id, call_index, arg_key)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_turns_tool ON turns (tool_name, annotation_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tool_calls_tool ON tool_calls (tool_name, annotation_id, call_index)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tool_call_args_key ON tool_call_args (tool_name, arg_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tool_call_args_any_key ON tool_call_args (arg_key)")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_normalized_insert
+        AFTER INSERT ON annotations
+        BEGIN{_insert_sql("NEW")}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_normalized_delete
+        AFTER DELETE ON annotations
+        BEGIN{_delete_sql("OLD")}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_normalized_update
+        AFTER UPDATE OF id, turns_json, answers_json ON annotations
+        BEGIN{_delete_sql("OLD")}{_insert_sql("NEW")}
+        END
+    ''')
+
+
+def rebuild(conn):
+    conn.execute("DELETE FROM turns")
+    conn.execute("DELETE FROM tool_calls")
+    conn.execute("DELETE FROM tool_call_args")
+    # Тот же SQL, что и в триггере вставки, но по всей таблице annotations
+    for statement in _insert_sql("src", source="annotations AS src, ").split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+# --- ВОССТАНОВЛЕНИЕ ЭКСПОРТА ---
+def _turn_from_row(shape, role, content, plan, tool_name, arguments_json, raw_json):
+    if shape == SHAPE_TEXT:
+        return {"role": role, "content": content}
+    if shape == SHAPE_THOUGHT:
+        return {"role": role, "content": content, "meta": {"plan": plan}}
+    if shape == SHAPE_CALL:
+        return {"role": role, "tool_call": {"name": tool_name, "arguments": json.loads(arguments_json)}}
+    return json.loads(raw_json)
+
+
+def load_turns(conn, annotation_id):
+    rows = conn.execute('''
+        SELECT shape, role, content, plan, tool_name, arguments_json, raw_json
+        FROM turns WHERE annotation_id = ? ORDER BY turn_index
+    ''', (annotation_id,))
+    return [_turn_from_row(*row) for row in rows]
+
+
+def load_answers(conn, annotation_id):
+    rows = conn.execute('''
+        SELECT tool_name, arguments_json, raw_json
+        FROM tool_calls WHERE annotation_id = ? ORDER BY call_index
+    ''', (annotation_id,))
+    return [json.loads(raw_json) if raw_json is not None
+            else {"name": tool_name, "arguments": json.loads(arguments_json)}
+            for tool_name, arguments_json, raw_json in rows]
+
+
+def iter_records(category=None, on_error=None, chunk_size=export.CHUNK_SIZE, path=None):
+    """Записи экспорта, собранные из нормализованных таблиц (формат как у export.iter_records)."""
+    sql, params = export.build_query(category)
+    sql = sql.replace(export.EXPORT_COLUMNS, "id, category, difficulty, query, tools_json, tool_set", 1)
+    tool_sets = toolsets.ToolSetCache(path)
+    with db.connection(path) as conn:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row_id, category_, difficulty, query, tools_json, tool_set in rows:
+                try:
+                    yield {
+                        "id": row_id,
+                        "category": category_,
+                        "difficulty": difficulty,
+                        "query": query,
+                        "tools": tool_sets.tools_json(tools_json, tool_set),
+                        "answers": json.dumps(load_answers(conn, row_id), ensure_ascii=False),
+                        "turns": load_turns(conn, row_id),
+                    }
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    on_error(row_id, e)
+
+
+def verify(category=None, path=None):
+    """Сравнивает экспорт из нормализованных таблиц с экспортом из JSON; возвращает id расхождений."""
+    mismatched = []
+    skipped = []
+    blob_records = export.iter_records(category, on_error=lambda row_id, e: skipped.append(row_id), path=path)
+    normalized = {}
+    for record in iter_records(category, on_error=lambda row_id, e: None, path=path):
+        normalized[record["id"]] = json.dumps(record, ensure_ascii=False)
+    for record in blob_records:
+        if normalized.pop(record["id"], None) != json.dumps(record, ensure_ascii=False):
+            mismatched.append(record["id"])
+    mismatched.extend(row_id for row_id in normalized if row_id not in skipped)
+    return mismatched
+
+
+# --- АНАЛИТИКА ---
+def tool_call_counts(path=None):
+    return db.fetch_all('''
+        SELECT tool_name, count(*), count(DISTINCT annotation_id)
+        FROM tool_calls WHERE tool_name IS NOT NULL
+        GROUP BY tool_name ORDER BY 2 DESC
+    ''', path=path)
+
+
+def samples_calling_in_order(first_tool, then_tool, limit=None, path=None):
+    """id записей, где then_tool вызывается после first_tool."""
+    sql = '''
+        SELECT DISTINCT a.annotation_id
+        FROM tool_calls AS a
+        JOIN tool_calls AS b
+          ON b.tool_name = ? AND b.annotation_id = a.annotation_id AND b.call_index > a.call_index
+        WHERE a.tool_name = ?
+        ORDER BY a.annotation_id
+    '''
+    params = (then_tool, first_tool)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params += (limit,)
+    return [row[0] for row in db.fetch_all(sql, params, path=path)]
+
+
+def average_arguments_per_call(tool_name=None, path=None):
+    if tool_name is None:
+        return db.fetch_all('''
+            SELECT tool_name, avg(arg_count) FROM tool_calls
+            WHERE tool_name IS NOT NULL GROUP BY tool_name ORDER BY tool_name
+        ''', path=path)
+    return db.fetch_all("SELECT tool_name, avg(arg_count) FROM tool_calls WHERE tool_name = ?",
+                        (tool_name,), path=path)
+
+
+def argument_key_usage(tool_name, path=None):
+    return db.fetch_all('''
+        SELECT arg_key, count(*), group_concat(DISTINCT value_type)
+        FROM tool_call_args WHERE tool_name = ?
+        GROUP BY arg_key ORDER BY 2 DESC
+    ''', (tool_name,), path=path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нормализованные реплики и вызовы")
+    parser.add_argument("--verify", action="store_true", help="сверить экспорт из таблиц с экспортом из JSON")
+    parser.add_argument("--rebuild", action="store_true", help="заново разложить JSON по таблицам")
+    parser.add_argument("--category", default=None)
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    args = parser.parse_args(argv)
+    if args.rebuild:
+        writer.write(rebuild, path=args.db)
+    if args.verify:
+        mismatched = verify(args.category, path=args.db)
+        print(json.dumps({"mismatched": len(mismatched), "ids": mismatched[:50]}, ensure_ascii=False))
+        return 1 if mismatched else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
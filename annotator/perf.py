@@ -0,0 +1,248 @@
+"""Встроенные замеры: фазы перезапуска Streamlit и SQL-запросы.
+
+Замеры копятся в памяти процесса (общие для всех сессий) в кольцевых
+буферах по ключу; перцентили считаются только при открытии страницы
+администратора. Запись одного замера — пара perf_counter() и append под
+блокировкой, поэтому включённые замеры в продакшене почти бесплатны.
+
+Запросы медленнее SLOW_QUERY_MS дописываются в SLOW_QUERY_LOG (JSONL).
+
+    ANNOTATOR_PERF=0                   выключить замеры
+    ANNOTATOR_SLOW_QUERY_MS=100        порог медленного запроса
+    ANNOTATOR_SLOW_QUERY_LOG=path      файл журнала ("" — только в памяти)
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+
+ENABLED = os.environ.get("ANNOTATOR_PERF", "1") != "0"
+SLOW_QUERY_MS = float(os.environ.get("ANNOTATOR_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.environ.get("ANNOTATOR_SLOW_QUERY_LOG", "slow_queries.jsonl")
+
+# Замеров на ключ и медленных запросов, хранимых в памяти
+MAX_SAMPLES = 2000
+MAX_SLOW = 200
+DEFAULT_WINDOW = 15 * 60
+
+KIND_PHASE = "phase"
+KIND_SQL = "sql"
+
+
+class _Store:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self.slow = deque(maxlen=MAX_SLOW)
+
+    def add(self, kind, key, seconds, rows=None):
+        sample = (time.monotonic(), seconds, rows)
+        with self._lock:
+            buffer = self._samples.get((kind, key))
+            if buffer is None:
+                buffer = self._samples[(kind, key)] = deque(maxlen=MAX_SAMPLES)
+            buffer.append(sample)
+
+    def snapshot(self, kind, since):
+        with self._lock:
+            return {key: [s for s in buffer if s[0] >= since]
+                    for (k, key), buffer in self._samples.items() if k == kind}
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self.slow.clear()
+
+
+_store = _Store()
+_log_lock = threading.Lock()
+_local = threading.local()
+
+
+# --- ФАЗЫ ---
+@contextmanager
+def phase(name):
+    if not ENABLED:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _store.add(KIND_PHASE, name, time.perf_counter() - started)
+
+
+def rerun_started():
+    _local.rerun_started = time.perf_counter()
+
+
+def rerun_finished(page):
+    """Закрывает замер всего перезапуска; page — ключ для разбивки по страницам."""
+    started = getattr(_local, "rerun_started", None)
+    _local.rerun_started = None
+    if ENABLED and started is not None:
+        _store.add(KIND_PHASE, f"rerun: {page}", time.perf_counter() - started)
+
+
+# --- SQL ---
+_SPACES_RE = re.compile(r"\s+")
+_PARAM_LIST_RE = re.compile(r"\?(\s*,\s*\?)+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Ключ запроса: без лишних пробелов, списки "?, ?, ?" схлопнуты."""
+    return _PARAM_LIST_RE.sub("?, ...", _SPACES_RE.sub(" ", sql).strip())
+
+
+def record_sql(sql, seconds, rows):
+    key = normalize_sql(sql)
+    _store.add(KIND_SQL, key, seconds, rows)
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        entry = {
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "sql": key,
+        }
+        _store.slow.append(entry)
+        if SLOW_QUERY_LOG:
+            with _log_lock, open(SLOW_QUERY_LOG, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Курсор, меряющий время выполнения и выборки каждого запроса.
+
+    Замер SELECT закрывается, когда строки выбраны до конца, при следующем
+    execute или при удалении курсора.
+    """
+    _sql = None
+    _seconds = 0.0
+    _rows = 0
+
+    def _finish(self):
+        if self._sql is not None:
+            record_sql(self._sql, self._seconds, self._rows)
+            self._sql = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        started = time.perf_counter()
+        cursor = super().execute(sql, parameters)
+        self._sql, self._seconds, self._rows = sql, time.perf_counter() - started, 0
+        if self.description is None:
+            # DML/DDL: строк для выборки нет
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        started = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_parameters)
+        record_sql(sql, time.perf_counter() - started, max(self.rowcount, 0))
+        return cursor
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._seconds += time.perf_counter() - started
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._seconds += time.perf_counter() - started
+        self._rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._seconds += time.perf_counter() - started
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+        self._seconds += time.perf_counter() - started
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    # Connection.execute() в C не вызывает переопределённый cursor(),
+    # поэтому короткие формы переопределены явно
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+
+# --- ОТЧЁТЫ ---
+def _percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summary(kind, window=DEFAULT_WINDOW):
+    """Перцентили по ключам за последние window секунд, самые медленные сверху."""
+    rows = []
+    for key, samples in _store.snapshot(kind, time.monotonic() - window).items():
+        if not samples:
+            continue
+        ordered = sorted(s[1] for s in samples)
+        counted = [s[2] for s in samples if s[2] is not None]
+        rows.append({
+            "key": key,
+            "count": len(ordered),
+            "p50_ms": round(_percentile(ordered, 0.50) * 1000, 2),
+            "p95_ms": round(_percentile(ordered, 0.95) * 1000, 2),
+            "p99_ms": round(_percentile(ordered, 0.99) * 1000, 2),
+            "max_ms": round(ordered[-1] * 1000, 2),
+            "total_ms": round(sum(ordered) * 1000, 1),
+            "avg_rows": round(sum(counted) / len(counted), 1) if counted else None,
+        })
+    rows.sort(key=lambda row: row["total_ms"], reverse=True)
+    return rows
+
+
+def slow_queries():
+    return list(reversed(_store.slow))
+
+
+def reset():
+    _store.clear()
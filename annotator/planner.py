@@ -0,0 +1,49 @@
+"""EXPLAIN QUERY PLAN для основных запросов приложения.
+
+Запросы строятся теми же функциями, что используют страницы, поэтому план
+в админке соответствует реально выполняемому SQL.
+"""
+from annotator import browse, db, export, writer
+
+SAMPLE_CURSOR = ("2000-01-01 00:00:00", "")
+
+
+def main_queries():
+    return [
+        ("Экспорт категории", *export.build_query("tool_awareness")),
+        ("Просмотр: первая страница", *browse.build_page_query()),
+        ("Просмотр: следующая страница", *browse.build_page_query(cursor=SAMPLE_CURSOR)),
+        ("Просмотр: фильтр по категории", *browse.build_page_query({"category": "tool_awareness"})),
+        ("Просмотр: фильтр по автору", *browse.build_page_query({"author": "admin"})),
+        ("Просмотр: фильтр по сложности", *browse.build_page_query({"difficulty": "hard"})),
+        ("Просмотр: все фильтры", *browse.build_page_query(
+            {"category": "tool_awareness", "difficulty": "hard", "author": "admin"}, SAMPLE_CURSOR)),
+        ("Список категорий", "SELECT DISTINCT category FROM annotations ORDER BY category", ()),
+        ("Вход пользователя", "SELECT password FROM users WHERE username = ?", ("admin",)),
+    ]
+
+
+def uses_full_scan(plan_rows):
+    # "SCAN annotations" без индекса — полный проход по таблице
+    return any(detail.startswith("SCAN") and "INDEX" not in detail for _, _, _, detail in plan_rows)
+
+
+def explain(sql, params=(), path=None):
+    return db.fetch_all(f"EXPLAIN QUERY PLAN {sql}", params, path=path)
+
+
+def explain_main_queries(path=None):
+    report = []
+    for title, sql, params in main_queries():
+        plan = explain(sql, params, path=path)
+        report.append({
+            "title": title,
+            "sql": sql,
+            "plan": [detail for _, _, _, detail in plan],
+            "full_scan": uses_full_scan(plan),
+        })
+    return report
+
+
+def analyze(path=None):
+    writer.write(lambda conn: conn.execute("ANALYZE"), path=path)
@@ -0,0 +1,326 @@
+"""Очередь проверки сохранённых аннотаций с арендой (lease).
+
+Каждая новая или изменённая по содержимому запись попадает в review_queue
+(триггеры на annotations). Проверяющий берёт следующую запись одним
+UPDATE ... RETURNING по частичному индексу ready_at: у ожидающей записи
+ready_at — время постановки в очередь, у взятой — конец аренды. Поэтому
+брошенная запись сама возвращается в очередь, когда аренда истекла, а две
+сессии никогда не получат одну запись: запись идёт через единственного
+писателя (annotator.writer), и UPDATE меняет ready_at атомарно.
+
+Решение (accepted / rejected / edited) принимается только по действующей
+аренде и пишется в review_decisions с номером ревизии записи
+(annotator.revisions). Правка проверяется validation.validate_record и
+сохраняется как новая ревизия от имени проверяющего в той же транзакции,
+что и решение.
+
+    python -m annotator.review stats
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+
+from annotator import db, revisions, storage, tools, validation, writer
+
+LEASE_SECONDS = 15 * 60
+
+STATUS_PENDING = "pending"
+STATUS_CLAIMED = "claimed"
+STATUS_ACCEPTED = "accepted"
+STATUS_REJECTED = "rejected"
+
+OUTCOME_ACCEPTED = "accepted"
+OUTCOME_REJECTED = "rejected"
+OUTCOME_EDITED = "edited"
+OUTCOMES = (OUTCOME_ACCEPTED, OUTCOME_REJECTED, OUTCOME_EDITED)
+
+# Правка проверяющего принимает запись в исправленном виде
+OUTCOME_STATUS = {
+    OUTCOME_ACCEPTED: STATUS_ACCEPTED,
+    OUTCOME_REJECTED: STATUS_REJECTED,
+    OUTCOME_EDITED: STATUS_ACCEPTED,
+}
+
+# Текущее время в секундах Unix средствами SQLite (unixepoch() есть не во всех сборках)
+NOW_SQL = "((julianday('now') - 2440587.5) * 86400.0)"
+CONTENT_COLUMNS = ("category", "difficulty", "query", "tools_json", "tool_set", "answers_json", "turns_json")
+
+QUEUE_COLUMNS = ("annotation_id", "author", "status", "reviewer", "lease_expires", "attempts", "enqueued_at")
+
+
+class LeaseLost(ValueError):
+    """Аренда истекла или запись уже взял другой проверяющий."""
+
+
+class InvalidEdit(ValueError):
+    """Правка проверяющего не проходит проверку записи; аренда сохраняется."""
+
+
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS review_queue (
+            annotation_id TEXT PRIMARY KEY,
+            author TEXT,
+            status TEXT NOT NULL,
+            ready_at REAL,
+            reviewer TEXT,
+            lease_token TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    ''')
+    # Только записи, которые можно взять: ожидающие и взятые (до конца аренды)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_review_queue_ready ON review_queue (ready_at) "
+                 "WHERE ready_at IS NOT NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_review_queue_status ON review_queue (status)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS review_decisions (
+            id INTEGER PRIMARY KEY,
+            annotation_id TEXT NOT NULL,
+            revision INTEGER,
+            reviewer TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            comment TEXT,
+            decided_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_review_decisions_annotation "
+                 "ON review_decisions (annotation_id, id)")
+
+    enqueue = f'''
+            INSERT INTO review_queue (annotation_id, author, status, ready_at)
+            VALUES (NEW.id, NEW.author, '{STATUS_PENDING}', {NOW_SQL})
+            ON CONFLICT (annotation_id) DO UPDATE SET
+                author = excluded.author, status = excluded.status, ready_at = excluded.ready_at,
+                reviewer = NULL, lease_token = NULL, attempts = 0, enqueued_at = CURRENT_TIMESTAMP;'''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_review_insert
+        AFTER INSERT ON annotations
+        BEGIN{enqueue}
+        END
+    ''')
+    # UPSERT перечисляет все колонки, поэтому в очередь возвращает только реальное изменение содержимого
+    changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in ("id",) + CONTENT_COLUMNS)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_review_update
+        AFTER UPDATE ON annotations
+        WHEN {changed}
+        BEGIN
+            DELETE FROM review_queue WHERE annotation_id = OLD.id AND OLD.id != NEW.id;{enqueue}
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_review_delete
+        AFTER DELETE ON annotations
+        BEGIN
+            DELETE FROM review_queue WHERE annotation_id = OLD.id;
+        END
+    ''')
+    # Экспорт «только принятых» кэшируется по версии категории (annotator.jobs)
+    bump = '''
+            INSERT INTO category_versions (category, version)
+            SELECT coalesce(category, ''), 1 FROM annotations WHERE id = NEW.annotation_id
+            ON CONFLICT (category) DO UPDATE SET version = version + 1;
+            INSERT INTO category_versions (category, version) VALUES ('', 1)
+            ON CONFLICT (category) DO UPDATE SET version = version + 1;'''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_review_queue_accepted
+        AFTER UPDATE OF status ON review_queue
+        WHEN (OLD.status = '{STATUS_ACCEPTED}') != (NEW.status = '{STATUS_ACCEPTED}')
+        BEGIN{bump}
+        END
+    ''')
+
+
+def backfill(conn):
+    # Уже сохранённые записи ждут проверки в порядке создания
+    conn.execute(f'''
+        INSERT OR IGNORE INTO review_queue (annotation_id, author, status, ready_at, enqueued_at)
+        SELECT id, author, '{STATUS_PENDING}', (julianday(coalesce(created_at, 'now')) - 2440587.5) * 86400.0,
+               coalesce(created_at, CURRENT_TIMESTAMP)
+        FROM annotations
+    ''')
+
+
+# --- АРЕНДА ---
+def claim_next(reviewer, lease_seconds=LEASE_SECONDS, path=None):
+    """Берёт самую давнюю доступную запись чужого автора.
+
+    Возвращает {"annotation_id", "token", "lease_expires"} или None, если брать нечего.
+    """
+    token = uuid.uuid4().hex
+
+    def claim(conn):
+        now = time.time()
+        rows = conn.execute(f'''
+            UPDATE review_queue
+            SET status = '{STATUS_CLAIMED}', reviewer = ?, lease_token = ?, ready_at = ?, attempts = attempts + 1
+            WHERE annotation_id = (
+                SELECT annotation_id FROM review_queue
+                WHERE ready_at <= ? AND author IS NOT ?
+                ORDER BY ready_at LIMIT 1)
+            RETURNING annotation_id, ready_at
+        ''', (reviewer, token, now + lease_seconds, now, reviewer)).fetchall()
+        return rows[0] if rows else None
+
+    row = writer.write(claim, path=path)
+    if row is None:
+        return None
+    return {"annotation_id": row[0], "token": token, "lease_expires": row[1]}
+
+
+def _check_lease(conn, annotation_id, token):
+    row = conn.execute('''
+        SELECT 1 FROM review_queue WHERE annotation_id = ? AND status = ? AND lease_token = ? AND ready_at > ?
+    ''', (annotation_id, STATUS_CLAIMED, token, time.time())).fetchone()
+    if row is None:
+        raise LeaseLost(f"Аренда записи {annotation_id} истекла или передана другому проверяющему")
+
+
+def extend(annotation_id, token, lease_seconds=LEASE_SECONDS, path=None):
+    """Продлевает действующую аренду; возвращает новое время окончания."""
+    def renew(conn):
+        _check_lease(conn, annotation_id, token)
+        expires = time.time() + lease_seconds
+        conn.execute("UPDATE review_queue SET ready_at = ? WHERE annotation_id = ?", (expires, annotation_id))
+        return expires
+    return writer.write(renew, path=path)
+
+
+def release(annotation_id, token, path=None):
+    """Возвращает взятую запись в очередь сразу, не дожидаясь конца аренды."""
+    def give_back(conn):
+        conn.execute('''
+            UPDATE review_queue SET status = ?, reviewer = NULL, lease_token = NULL, ready_at = ?
+            WHERE annotation_id = ? AND lease_token = ?
+        ''', (STATUS_PENDING, time.time(), annotation_id, token))
+    writer.write(give_back, path=path)
+
+
+def requeue_expired(path=None):
+    """Помечает записи с истёкшей арендой ожидающими; возвращает их число.
+
+    claim_next берёт такие записи и без этого — вызов нужен для отчётов.
+    """
+    return writer.write(lambda conn: conn.execute('''
+        UPDATE review_queue SET status = ?, reviewer = NULL, lease_token = NULL
+        WHERE status = ? AND ready_at <= ?
+    ''', (STATUS_PENDING, STATUS_CLAIMED, time.time())).rowcount, path=path)
+
+
+# --- РЕШЕНИЯ ---
+def _check_edit(edited):
+    problems = validation.validate_record(edited['answers'], edited['turns'],
+                                          validation.get_validators(tools.get_catalog()))
+    if problems:
+        raise InvalidEdit("; ".join(
+            f"turn {index if index is not None else '-'}, {tool or '-'}: {message}"
+            for index, tool, message in problems))
+
+
+def decide(annotation_id, token, reviewer, outcome, comment=None, edited=None, path=None):
+    """Записывает решение по действующей аренде; для edited — сохраняет правку edited.
+
+    Бросает LeaseLost, если аренда уже не принадлежит проверяющему, и
+    InvalidEdit, если правка не проходит validation.validate_record.
+    """
+    if outcome not in OUTCOMES:
+        raise ValueError(f"Неизвестное решение: {outcome}")
+    if (outcome == OUTCOME_EDITED) != (edited is not None):
+        raise ValueError("Исправленная запись передаётся только с решением edited")
+    if edited is not None and edited['id'] != annotation_id:
+        raise ValueError("Исправленная запись должна сохранять id проверяемой")
+    if edited is not None:
+        _check_edit(edited)
+    # Ревизия правки приписывается проверяющему, автор записи не меняется
+    save_edit = storage.annotation_writer(edited, overwrite=True, revision_author=reviewer) if edited else None
+
+    def apply(conn):
+        _check_lease(conn, annotation_id, token)
+        if save_edit is not None:
+            # Триггер вернёт изменённую запись в очередь — решение ниже это перекрывает
+            save_edit(conn)
+        revision = conn.execute("SELECT revision FROM revision_heads WHERE annotation_id = ?",
+                                (annotation_id,)).fetchone()
+        conn.execute('''
+            UPDATE review_queue SET status = ?, reviewer = ?, lease_token = NULL, ready_at = NULL
+            WHERE annotation_id = ?
+        ''', (OUTCOME_STATUS[outcome], reviewer, annotation_id))
+        conn.execute('''
+            INSERT INTO review_decisions (annotation_id, revision, reviewer, outcome, comment)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (annotation_id, revision[0] if revision else None, reviewer, outcome, comment))
+    writer.write(apply, path=path)
+
+
+# --- ЧТЕНИЕ ---
+def load_record(annotation_id, path=None):
+    """Текущая версия записи в формате model.build_annotation."""
+    with db.connection(path) as conn:
+        row = conn.execute(f"SELECT {revisions.SELECT_COLUMNS} FROM annotations WHERE id = ?",
+                           (annotation_id,)).fetchone()
+        return revisions.as_record(annotation_id, revisions.document(row), conn) if row else None
+
+
+def edited_record(record, turns):
+    """Запись с исправленными turns; answers пересобираются из вызовов инструментов.
+
+    Бросает InvalidEdit, если turns — не список объектов или tool_call не вида
+    {"name": str, "arguments": dict}.
+    """
+    if not isinstance(turns, list) or not all(isinstance(turn, dict) for turn in turns):
+        raise InvalidEdit("turns должен быть списком объектов")
+    answers = []
+    for index, turn in enumerate(turns):
+        if "tool_call" not in turn:
+            continue
+        call = turn["tool_call"]
+        if not (isinstance(call, dict) and isinstance(call.get("name"), str)
+                and isinstance(call.get("arguments"), dict)):
+            raise InvalidEdit(f"turn {index}: tool_call должен быть объектом с name (строка) и arguments (объект)")
+        answers.append({"name": call["name"], "arguments": call["arguments"]})
+    return {**record, "turns": turns, "answers": answers}
+
+
+def get_item(annotation_id, path=None):
+    row = db.fetch_one('''
+        SELECT annotation_id, author, status, reviewer, CASE WHEN status = ? THEN ready_at END, attempts, enqueued_at
+        FROM review_queue WHERE annotation_id = ?
+    ''', (STATUS_CLAIMED, annotation_id), path=path)
+    return dict(zip(QUEUE_COLUMNS, row)) if row else None
+
+
+def decisions(annotation_id, path=None):
+    return db.fetch_all('''
+        SELECT revision, reviewer, outcome, comment, decided_at FROM review_decisions
+        WHERE annotation_id = ? ORDER BY id
+    ''', (annotation_id,), path=path)
+
+
+def queue_stats(path=None):
+    counts = dict(db.fetch_all("SELECT status, count(*) FROM review_queue GROUP BY status", path=path))
+    expired = db.fetch_one("SELECT count(*) FROM review_queue WHERE status = ? AND ready_at <= ?",
+                           (STATUS_CLAIMED, time.time()), path=path)[0]
+    return {**{status: counts.get(status, 0)
+               for status in (STATUS_PENDING, STATUS_CLAIMED, STATUS_ACCEPTED, STATUS_REJECTED)},
+            "expired_leases": expired}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Очередь проверки аннотаций")
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="сколько записей в каждом статусе")
+    commands.add_parser("requeue", help="вернуть в очередь записи с истёкшей арендой")
+    args = parser.parse_args(argv)
+    if args.command == "requeue":
+        print(json.dumps({"requeued": requeue_expired(path=args.db)}))
+    else:
+        print(json.dumps(queue_stats(path=args.db)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
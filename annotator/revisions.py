@@ -0,0 +1,297 @@
+"""История правок аннотаций: ревизии только дописываются, хранятся дельтами.
+
+Каждое сохранение через storage.save_annotation и каждая замена записи
+импортом (on_conflict=overwrite) дописывает ревизию в
+annotation_revisions. Ревизия — сжатый zlib JSON: либо полная версия
+записи (full), либо дельта к предыдущей ревизии (delta). В дельте
+скалярные поля хранятся, только если изменились, а turns и answers — как
+список операций над элементами: диапазоны [i, j] копируются из прошлой
+версии, {"i": [...]} — новые элементы.
+
+Последняя версия читается из самой annotations, а revision_heads хранит
+для неё номер ревизии, номер последней полной ревизии и хэш содержимого.
+Не больше чем через SNAPSHOT_EVERY ревизий пишется полная, так что для
+восстановления любой ревизии применяется ограниченное число дельт.
+Если запись появилась в обход истории (новая из импорта, правка до
+миграции), при следующем сохранении её текущая версия сперва
+записывается полной ревизией.
+
+    python -m annotator.revisions history kk_tool_awareness_001
+    python -m annotator.revisions show kk_tool_awareness_001 --revision 3
+    python -m annotator.revisions compact --every 8
+"""
+import argparse
+import difflib
+import json
+import sys
+import zlib
+from contextlib import nullcontext
+
+from annotator import db, toolsets, writer
+
+SNAPSHOT_EVERY = 16
+COMPACT_BATCH = 50
+
+KIND_FULL = "full"
+KIND_DELTA = "delta"
+
+SCALAR_COLUMNS = ("category", "difficulty", "query", "tools_json", "tool_set", "author")
+LIST_COLUMNS = ("answers_json", "turns_json")
+COLUMNS = SCALAR_COLUMNS + LIST_COLUMNS
+SELECT_COLUMNS = ", ".join(COLUMNS)
+
+
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS annotation_revisions (
+            annotation_id TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            author TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (annotation_id, revision)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS revision_heads (
+            annotation_id TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL,
+            full_revision INTEGER NOT NULL,
+            digest TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+
+# --- ВЕРСИИ И ДЕЛЬТЫ ---
+def document(row):
+    """Версия записи из строки annotations (колонки COLUMNS)."""
+    doc = dict(zip(SCALAR_COLUMNS, row[:len(SCALAR_COLUMNS)]))
+    for column, text in zip(LIST_COLUMNS, row[len(SCALAR_COLUMNS):]):
+        # Элемент списка — отдельная строка JSON, дельта сравнивает элементы целиком
+        doc[column] = [json.dumps(item, ensure_ascii=False) for item in json.loads(text or "[]")]
+    return doc
+
+
+def digest(doc):
+    return toolsets.content_id(json.dumps(doc, ensure_ascii=False, sort_keys=True))
+
+
+def diff(old, new):
+    delta = {"set": {column: new[column] for column in SCALAR_COLUMNS if old[column] != new[column]}}
+    for column in LIST_COLUMNS:
+        ops = []
+        matcher = difflib.SequenceMatcher(None, old[column], new[column], autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                ops.append([i1, i2])
+            elif tag != "delete":
+                ops.append({"i": new[column][j1:j2]})
+        delta[column] = ops
+    return delta
+
+
+def patch(old, delta):
+    new = {**old, **delta["set"]}
+    for column in LIST_COLUMNS:
+        items = []
+        for op in delta[column]:
+            if isinstance(op, dict):
+                items.extend(op["i"])
+            else:
+                items.extend(old[column][op[0]:op[1]])
+        new[column] = items
+    return new
+
+
+def _encode(payload):
+    return zlib.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+# --- ЗАПИСЬ ---
+def _append(conn, annotation_id, head, doc, previous_doc, full, author=None):
+    revision = head[0] + 1 if head else 1
+    if full or previous_doc is None:
+        kind, payload, full_revision = KIND_FULL, doc, revision
+    else:
+        kind, payload, full_revision = KIND_DELTA, diff(previous_doc, doc), head[1]
+    doc_digest = digest(doc)
+    conn.execute('''
+        INSERT INTO annotation_revisions (annotation_id, revision, kind, payload, author)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (annotation_id, revision, kind, _encode(payload), author or doc["author"]))
+    conn.execute('''
+        INSERT INTO revision_heads (annotation_id, revision, full_revision, digest) VALUES (?, ?, ?, ?)
+        ON CONFLICT (annotation_id) DO UPDATE SET
+            revision = excluded.revision, full_revision = excluded.full_revision, digest = excluded.digest
+    ''', (annotation_id, revision, full_revision, doc_digest))
+    return revision, full_revision, doc_digest
+
+
+def record(conn, annotation_id, previous_row, current_row, author=None):
+    """Дописывает ревизию после сохранения; previous_row — строка до записи или None.
+
+    author — кто внёс правку, если это не автор записи (импорт, проверяющий).
+    """
+    head = conn.execute("SELECT revision, full_revision, digest FROM revision_heads WHERE annotation_id = ?",
+                        (annotation_id,)).fetchone()
+    previous_doc = document(previous_row) if previous_row is not None else None
+    if previous_doc is not None and (head is None or head[2] != digest(previous_doc)):
+        # Текущая версия появилась в обход истории — она становится полной ревизией
+        head = _append(conn, annotation_id, head, previous_doc, None, full=True)
+    doc = document(current_row)
+    if head is not None and previous_doc is not None and head[2] == digest(doc):
+        return head[0]
+    full = head is None or head[0] + 1 - head[1] >= SNAPSHOT_EVERY
+    return _append(conn, annotation_id, head, doc, previous_doc, full, author)[0]
+
+
+# --- ЧТЕНИЕ ---
+def _connection(conn, path):
+    return nullcontext(conn) if conn is not None else db.connection(path)
+
+
+def as_record(annotation_id, doc, conn):
+    tools_json = toolsets.ToolSetCache(conn=conn).tools_json(doc["tools_json"], doc["tool_set"])
+    return {
+        "id": annotation_id,
+        "category": doc["category"],
+        "difficulty": doc["difficulty"],
+        "query": doc["query"],
+        "tools": json.loads(tools_json),
+        "answers": [json.loads(item) for item in doc["answers_json"]],
+        "turns": [json.loads(item) for item in doc["turns_json"]],
+        "author": doc["author"],
+    }
+
+
+def history(annotation_id, path=None):
+    return db.fetch_all('''
+        SELECT revision, kind, author, created_at, length(payload) FROM annotation_revisions
+        WHERE annotation_id = ? ORDER BY revision
+    ''', (annotation_id,), path=path)
+
+
+def head_revision(annotation_id, path=None):
+    row = db.fetch_one("SELECT revision FROM revision_heads WHERE annotation_id = ?", (annotation_id,), path=path)
+    return row[0] if row else None
+
+
+def _replay(conn, annotation_id, revision):
+    """Версия на ревизии revision: последняя полная ревизия не позже неё и дельты после."""
+    rows = conn.execute('''
+        SELECT revision, kind, payload FROM annotation_revisions
+        WHERE annotation_id = ? AND revision <= ? AND revision >= (
+            SELECT max(revision) FROM annotation_revisions
+            WHERE annotation_id = ? AND revision <= ? AND kind = ?)
+        ORDER BY revision
+    ''', (annotation_id, revision, annotation_id, revision, KIND_FULL)).fetchall()
+    doc = None
+    for _, kind, payload in rows:
+        doc = _decode(payload) if kind == KIND_FULL else patch(doc, _decode(payload))
+    return doc
+
+
+def reconstruct(annotation_id, revision=None, at=None, conn=None, path=None):
+    """Запись на ревизии revision или на момент at ('YYYY-MM-DD HH:MM:SS', UTC).
+
+    Без аргументов — последняя ревизия. None, если такой ревизии нет.
+    """
+    with _connection(conn, path) as conn:
+        if revision is None:
+            if at is None:
+                row = conn.execute("SELECT revision FROM revision_heads WHERE annotation_id = ?",
+                                   (annotation_id,)).fetchone()
+            else:
+                row = conn.execute('''
+                    SELECT max(revision) FROM annotation_revisions WHERE annotation_id = ? AND created_at <= ?
+                ''', (annotation_id, at)).fetchone()
+            revision = row[0] if row else None
+        if revision is None:
+            return None
+        doc = _replay(conn, annotation_id, revision)
+        if doc is None:
+            return None
+        return {**as_record(annotation_id, doc, conn), "revision": revision}
+
+
+# --- УПЛОТНЕНИЕ ---
+def _compact_one(conn, annotation_id, every):
+    """Переписывает дельты, стоящие дальше every от полной ревизии, полными."""
+    rewritten = 0
+    doc = None
+    last_full = None
+    rows = conn.execute('''
+        SELECT revision, kind, payload FROM annotation_revisions WHERE annotation_id = ? ORDER BY revision
+    ''', (annotation_id,)).fetchall()
+    for revision, kind, payload in rows:
+        doc = _decode(payload) if kind == KIND_FULL else patch(doc, _decode(payload))
+        if kind == KIND_FULL:
+            last_full = revision
+        elif revision - last_full >= every:
+            conn.execute('''
+                UPDATE annotation_revisions SET kind = ?, payload = ? WHERE annotation_id = ? AND revision = ?
+            ''', (KIND_FULL, _encode(doc), annotation_id, revision))
+            last_full = revision
+            rewritten += 1
+    if rows:
+        conn.execute("UPDATE revision_heads SET full_revision = ? WHERE annotation_id = ?", (last_full, annotation_id))
+    return rewritten
+
+
+def compact(every=SNAPSHOT_EVERY, path=None):
+    """Ограничивает цепочки дельт длиной every; возвращает сводку."""
+    result = {"annotations": 0, "rewritten": 0}
+    last_id = ""
+    while True:
+        batch = [row[0] for row in db.fetch_all('''
+            SELECT annotation_id FROM revision_heads
+            WHERE annotation_id > ? AND revision > ?
+            ORDER BY annotation_id LIMIT ?
+        ''', (last_id, every, COMPACT_BATCH), path=path)]
+        if not batch:
+            return result
+        rewritten = writer.write(lambda conn: sum(_compact_one(conn, annotation_id, every)
+                                                  for annotation_id in batch), path=path)
+        result["annotations"] += len(batch)
+        result["rewritten"] += rewritten
+        last_id = batch[-1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="История правок аннотаций")
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    history_cmd = commands.add_parser("history", help="список ревизий записи")
+    history_cmd.add_argument("annotation_id")
+    show_cmd = commands.add_parser("show", help="запись на ревизии или на момент времени")
+    show_cmd.add_argument("annotation_id")
+    show_cmd.add_argument("--revision", type=int, default=None)
+    show_cmd.add_argument("--at", default=None, help="момент времени 'YYYY-MM-DD HH:MM:SS' (UTC)")
+    compact_cmd = commands.add_parser("compact", help="заменить старые дельты полными ревизиями")
+    compact_cmd.add_argument("--every", type=int, default=SNAPSHOT_EVERY,
+                             help="максимальная длина цепочки дельт")
+    args = parser.parse_args(argv)
+
+    if args.command == "history":
+        for revision, kind, author, created_at, size in history(args.annotation_id, path=args.db):
+            print(f"{revision}\t{kind}\t{author}\t{created_at}\t{size}")
+    elif args.command == "show":
+        record_at = reconstruct(args.annotation_id, revision=args.revision, at=args.at, path=args.db)
+        if record_at is None:
+            print("Ревизия не найдена", file=sys.stderr)
+            return 1
+        print(json.dumps(record_at, ensure_ascii=False, indent=2))
+    else:
+        if args.every < 1:
+            parser.error("--every должен быть не меньше 1")
+        print(json.dumps(compact(args.every, path=args.db)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Полнотекстовый поиск по запросам, мыслям и финальным ответам (FTS5).
+
+Таблица annotations_fts синхронизируется с annotations триггерами; текст
+мыслей (content + meta.plan) и финального ответа извлекается из turns_json
+средствами JSON1 прямо в триггере. Токенизатор unicode61 с
+remove_diacritics 0: буквы ә, ғ, қ, ң, ө, ұ, ү, һ, і остаются отдельными
+буквами (не сводятся к а, г, к...) и корректно приводятся к нижнему регистру.
+"""
+import re
+
+from annotator import db
+
+TOKENIZER = "unicode61 remove_diacritics 0"
+SNIPPET_TOKENS = 12
+DEFAULT_LIMIT = 20
+
+# bm25: веса колонок (id, query, thoughts, answer)
+RANK_WEIGHTS = (0.0, 3.0, 1.0, 2.0)
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+_TURNS = "json_each(CASE WHEN json_valid({src}.turns_json) THEN {src}.turns_json ELSE '[]' END) AS t"
+
+# Мысли: реплики ассистента с meta (content + план)
+THOUGHTS_SQL = f'''(
+    SELECT group_concat(trim(coalesce(json_extract(t.value, '$.content'), '') || ' ' ||
+                             coalesce(json_extract(t.value, '$.meta.plan'), '')), ' ')
+    FROM {_TURNS}
+    WHERE CASE WHEN t.type = 'object' THEN json_extract(t.value, '$.role') END = 'assistant'
+      AND json_type(t.value, '$.meta') IS NOT NULL
+)'''
+
+# Финальный ответ: последняя реплика ассистента без вызова и без meta
+ANSWER_SQL = f'''(
+    SELECT json_extract(t.value, '$.content')
+    FROM {_TURNS}
+    WHERE CASE WHEN t.type = 'object' THEN json_extract(t.value, '$.role') END = 'assistant'
+      AND json_type(t.value, '$.tool_call') IS NULL
+      AND json_type(t.value, '$.meta') IS NULL
+    ORDER BY t.key DESC LIMIT 1
+)'''
+
+
+def _row_values(src):
+    return (f"{src}.rowid, {src}.id, {src}.query, "
+            f"{THOUGHTS_SQL.format(src=src)}, {ANSWER_SQL.format(src=src)}")
+
+
+def create_schema(conn):
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS annotations_fts USING fts5(
+            id UNINDEXED, query, thoughts, answer,
+            tokenize = '{TOKENIZER}',
+            prefix = '2 3'
+        )
+    ''')
+    # Перезапись записи (UPSERT в storage.UPSERT_SQL) обрабатывает триггер
+    # обновления; REPLACE проходит через триггер удаления (см. CONNECTION_PRAGMAS)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_fts_insert
+        AFTER INSERT ON annotations
+        BEGIN
+            INSERT INTO annotations_fts (rowid, id, query, thoughts, answer)
+            VALUES ({_row_values("NEW")});
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_fts_delete
+        AFTER DELETE ON annotations
+        BEGIN
+            DELETE FROM annotations_fts WHERE rowid = OLD.rowid;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_fts_update
+        AFTER UPDATE OF id, query, turns_json ON annotations
+        BEGIN
+            DELETE FROM annotations_fts WHERE rowid = OLD.rowid;
+            INSERT INTO annotations_fts (rowid, id, query, thoughts, answer)
+            VALUES ({_row_values("NEW")});
+        END
+    ''')
+
+
+def drop_triggers(conn):
+    for trigger in ("insert", "delete", "update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_annotations_fts_{trigger}")
+
+
+def rebuild(conn):
+    conn.execute("DELETE FROM annotations_fts")
+    conn.execute(f'''
+        INSERT INTO annotations_fts (rowid, id, query, thoughts, answer)
+        SELECT {_row_values("a")} FROM annotations AS a
+    ''')
+    conn.execute("INSERT INTO annotations_fts (annotations_fts) VALUES ('optimize')")
+
+
+def build_match(text, prefix=True):
+    """Превращает пользовательский ввод в безопасное выражение MATCH (AND по словам)."""
+    terms = _TERM_RE.findall(text or "")
+    if not terms:
+        return None
+    suffix = "*" if prefix else ""
+    return " ".join(f'"{term}"{suffix}' for term in terms)
+
+
+def search(text, limit=DEFAULT_LIMIT, prefix=True, mark=("**", "**"), path=None):
+    """Возвращает список результатов, отсортированных по bm25."""
+    match = build_match(text, prefix)
+    if match is None:
+        return []
+    open_mark, close_mark = mark
+    weights = ", ".join(str(w) for w in RANK_WEIGHTS)
+    snippets = ", ".join(
+        f"snippet(annotations_fts, {column}, ?, ?, '…', {SNIPPET_TOKENS})" for column in (1, 2, 3))
+    rows = db.fetch_all(f'''
+        SELECT f.id, a.category, a.author, bm25(annotations_fts, {weights}) AS rank, {snippets}
+        FROM annotations_fts AS f
+        JOIN annotations AS a ON a.rowid = f.rowid
+        WHERE annotations_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    ''', (open_mark, close_mark) * 3 + (match, limit), path=path)
+    return [
+        {"id": row[0], "category": row[1], "author": row[2], "rank": row[3],
+         "query": row[4], "thoughts": row[5], "answer": row[6]}
+        for row in rows
+    ]
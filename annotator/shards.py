@@ -0,0 +1,310 @@
+"""Шардированный JSONL-экспорт с бинарным индексом смещений.
+
+Каталог экспорта:
+
+    manifest.json       описание: шарды, число записей, формат индекса
+    shard-00000.jsonl   записи в формате экспорта, по одной на строку
+    index.bin           для каждой записи по порядку: (шард, смещение, длина)
+    ids.bin             хэш-таблица id -> номер записи (открытая адресация)
+
+Читатель отображает файлы в память (mmap) и декодирует только запрошенную
+запись: доступ по номеру и по id — O(1), без разбора всего файла. Шарды
+пишутся параллельно, каждый своим процессом. Читающую транзакцию между
+процессами не разделить, поэтому закреплённый снимок (annotator.snapshot)
+сначала копируется backup API во временную реплику, и все процессы читают
+её: экспорт согласован, а его seq записывается в манифест.
+
+    python -m annotator.shards write out_dir --category tool_awareness
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from annotator import export, snapshot, toolsets
+
+FORMAT_VERSION = 1
+DEFAULT_SHARD_SIZE = 10000
+
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.bin"
+IDS_FILE = "ids.bin"
+SHARD_TEMPLATE = "shard-{:05d}.jsonl"
+
+INDEX_MAGIC = b"KTAIDX01"
+IDS_MAGIC = b"KTAIDS01"
+# Заголовок: magic + число элементов
+HEADER = struct.Struct("<8sQ")
+# Запись индекса: номер шарда, смещение в шарде, длина строки без "\n"
+INDEX_ENTRY = struct.Struct("<IQI")
+# Слот хэш-таблицы: 64-битный хэш id, номер записи + 1 (0 — пустой слот)
+IDS_SLOT = struct.Struct("<QI")
+
+
+def id_hash(record_id):
+    digest = hashlib.blake2b(record_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+# --- ЗАПИСЬ ---
+def _shard_bounds(category, shard_size, conn):
+    # Начальные rowid каждого шарда; сами строки не читаются
+    where = "WHERE category = ?" if category is not None else ""
+    params = (category,) if category is not None else ()
+    rows = conn.execute(f'''
+        SELECT rowid FROM (
+            SELECT rowid, row_number() OVER (ORDER BY rowid) - 1 AS rn
+            FROM annotations {where}
+        ) WHERE rn % ? = 0
+    ''', (*params, shard_size)).fetchall()
+    starts = [row[0] for row in rows]
+    return [(start, starts[i + 1] if i + 1 < len(starts) else None) for i, start in enumerate(starts)]
+
+
+def _write_replica(snap, replica_path):
+    """Копия базы на момент снимка для процессов-писателей шардов."""
+    replica = sqlite3.connect(replica_path)
+    try:
+        snap.conn.backup(replica)
+        # Без WAL реплику можно открыть только для чтения, без файлов -wal/-shm
+        replica.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        replica.close()
+
+
+def _write_shard(out_dir, shard_no, category, start, stop, replica_path):
+    clauses = ["rowid >= ?"]
+    params = [start]
+    if stop is not None:
+        clauses.append("rowid < ?")
+        params.append(stop)
+    if category is not None:
+        clauses.append("category = ?")
+        params.append(category)
+    sql = f"SELECT {export.EXPORT_COLUMNS} FROM annotations WHERE {' AND '.join(clauses)} ORDER BY rowid"
+    entries = []
+    errors = []
+    offset = 0
+    conn = sqlite3.connect(f"file:{replica_path}?mode=ro", uri=True)
+    tool_sets = toolsets.ToolSetCache(conn=conn)
+    with open(os.path.join(out_dir, SHARD_TEMPLATE.format(shard_no)), "wb") as fh:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(export.CHUNK_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                try:
+                    line = json.dumps(export.row_to_record(row, tool_sets), ensure_ascii=False).encode("utf-8")
+                except Exception as e:
+                    errors.append(f"{row[0]}: {e}")
+                    continue
+                fh.write(line)
+                fh.write(b"\n")
+                entries.append((row[0], offset, len(line)))
+                offset += len(line) + 1
+    conn.close()
+    return shard_no, entries, errors
+
+
+def _write_ids_table(out_dir, ids):
+    capacity = 1
+    while capacity < max(len(ids) * 2, 8):
+        capacity <<= 1
+    table = bytearray(IDS_SLOT.size * capacity)
+    mask = capacity - 1
+    for record_no, record_id in enumerate(ids):
+        h = id_hash(record_id)
+        slot = h & mask
+        while IDS_SLOT.unpack_from(table, slot * IDS_SLOT.size)[1]:
+            slot = (slot + 1) & mask
+        IDS_SLOT.pack_into(table, slot * IDS_SLOT.size, h, record_no + 1)
+    with open(os.path.join(out_dir, IDS_FILE), "wb") as fh:
+        fh.write(HEADER.pack(IDS_MAGIC, capacity))
+        fh.write(table)
+
+
+def write_sharded(out_dir, category=None, shard_size=DEFAULT_SHARD_SIZE, workers=None, path=None):
+    """Пишет шардированный экспорт в out_dir и возвращает манифест.
+
+    Все шарды читаются из одного снимка базы; параллельные сохранения в
+    экспорт не попадают.
+    """
+    started = time.perf_counter()
+    os.makedirs(out_dir, exist_ok=True)
+    replica_dir = tempfile.mkdtemp(prefix="shards_", dir=out_dir)
+    replica_path = os.path.join(replica_dir, "snapshot.db")
+    try:
+        with snapshot.open_snapshot(path) as snap:
+            bounds = _shard_bounds(category, shard_size, snap.conn)
+            _write_replica(snap, replica_path)
+        snapshot_tag = snap.tag
+
+        results = [None] * len(bounds)
+        if bounds:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                futures = [pool.submit(_write_shard, out_dir, shard_no, category, start, stop, replica_path)
+                           for shard_no, (start, stop) in enumerate(bounds)]
+                for future in futures:
+                    shard_no, entries, errors = future.result()
+                    results[shard_no] = (entries, errors)
+    finally:
+        if os.path.exists(replica_path):
+            os.remove(replica_path)
+        os.rmdir(replica_dir)
+
+    ids = []
+    errors = []
+    shard_counts = []
+    with open(os.path.join(out_dir, INDEX_FILE), "wb") as fh:
+        fh.write(HEADER.pack(INDEX_MAGIC, sum(len(entries) for entries, _ in results)))
+        for shard_no, (entries, shard_errors) in enumerate(results):
+            errors.extend(shard_errors)
+            shard_counts.append(len(entries))
+            for record_id, offset, length in entries:
+                fh.write(INDEX_ENTRY.pack(shard_no, offset, length))
+                ids.append(record_id)
+    _write_ids_table(out_dir, ids)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "category": category,
+        "records": len(ids),
+        "shard_size": shard_size,
+        "shards": [{"file": SHARD_TEMPLATE.format(n), "records": count} for n, count in enumerate(shard_counts)],
+        "index": INDEX_FILE,
+        "ids": IDS_FILE,
+        "errors": errors,
+        "snapshot": snapshot_tag,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=4)
+    return manifest
+
+
+# --- ЧТЕНИЕ ---
+def _map(file_path):
+    with open(file_path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ShardedDataset:
+    """Ленивый доступ к шардированному экспорту: ds[i], ds.get(id), len(ds)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as fh:
+            self.manifest = json.load(fh)
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия формата: {self.manifest.get('format_version')}")
+        self._index = _map(os.path.join(directory, self.manifest["index"]))
+        magic, self._count = HEADER.unpack_from(self._index, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError("Повреждён index.bin")
+        self._ids = _map(os.path.join(directory, self.manifest["ids"]))
+        magic, self._capacity = HEADER.unpack_from(self._ids, 0)
+        if magic != IDS_MAGIC:
+            raise ValueError("Повреждён ids.bin")
+        self._shards = [None] * len(self.manifest["shards"])
+
+    def __len__(self):
+        return self._count
+
+    def _shard(self, shard_no):
+        shard = self._shards[shard_no]
+        if shard is None:
+            shard = _map(os.path.join(self.directory, self.manifest["shards"][shard_no]["file"]))
+            self._shards[shard_no] = shard
+        return shard
+
+    def raw(self, position):
+        """Байты записи номер position (без разбора JSON)."""
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        shard_no, offset, length = INDEX_ENTRY.unpack_from(self._index, HEADER.size + position * INDEX_ENTRY.size)
+        return self._shard(shard_no)[offset:offset + length]
+
+    def __getitem__(self, position):
+        return json.loads(self.raw(position))
+
+    def position_of(self, record_id):
+        h = id_hash(record_id)
+        mask = self._capacity - 1
+        slot = h & mask
+        while True:
+            slot_hash, record_no = IDS_SLOT.unpack_from(self._ids, HEADER.size + slot * IDS_SLOT.size)
+            if record_no == 0:
+                return None
+            if slot_hash == h:
+                # Хэш совпал — подтверждаем по самой записи
+                if self[record_no - 1]["id"] == record_id:
+                    return record_no - 1
+            slot = (slot + 1) & mask
+
+    def get(self, record_id, default=None):
+        position = self.position_of(record_id)
+        return default if position is None else self[position]
+
+    def __iter__(self):
+        for position in range(self._count):
+            yield self[position]
+
+    def close(self):
+        for mapped in [self._index, self._ids, *self._shards]:
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Шардированный JSONL-экспорт с индексом смещений")
+    sub = parser.add_subparsers(dest="command", required=True)
+    write = sub.add_parser("write", help="записать экспорт")
+    write.add_argument("out_dir")
+    write.add_argument("--category", default=None)
+    write.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="записей в шарде")
+    write.add_argument("--workers", type=int, default=None)
+    write.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    show = sub.add_parser("get", help="прочитать одну запись по id или номеру")
+    show.add_argument("directory")
+    show.add_argument("key", help="id записи или #номер")
+    args = parser.parse_args(argv)
+
+    if args.command == "write":
+        manifest = write_sharded(args.out_dir, category=args.category, shard_size=args.shard_size,
+                                 workers=args.workers, path=args.db)
+        print(json.dumps({key: manifest[key] for key in ("records", "seconds")}
+                         | {"shards": len(manifest["shards"]), "errors": len(manifest["errors"])}))
+        return 0
+
+    with ShardedDataset(args.directory) as dataset:
+        record = dataset[int(args.key[1:])] if args.key.startswith("#") else dataset.get(args.key)
+    if record is None:
+        print("not found", file=sys.stderr)
+        return 1
+    print(json.dumps(record, ensure_ascii=False, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
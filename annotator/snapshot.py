@@ -0,0 +1,49 @@
+"""Чтение из согласованного снимка базы.
+
+Снимок — закреплённая читающая транзакция WAL на отдельном подключении
+пула: все запросы через snap.conn видят базу на один момент, сколько бы ни
+длилось чтение, а писатели при этом не ждут (в WAL читатель не мешает
+записи). Снимок помечается номером последнего изменения из change_log
+(см. annotator.delta), поэтому результат экспорта или пересчёта
+воспроизводим: тот же тег — те же данные.
+
+    with snapshot.open_snapshot() as snap:
+        rows = snap.conn.execute("SELECT ...").fetchall()
+        print(snap.tag)
+"""
+import time
+from contextlib import contextmanager
+
+from annotator import db, delta
+
+
+class Snapshot:
+    __slots__ = ("conn", "seq", "taken_at")
+
+    def __init__(self, conn, seq, taken_at):
+        self.conn = conn
+        self.seq = seq
+        self.taken_at = taken_at
+
+    @property
+    def tag(self):
+        return f"seq-{self.seq}"
+
+
+@contextmanager
+def open_snapshot(path=None):
+    # Отдельное подключение: записи того же потока (прогресс задания и т.п.)
+    # не должны попасть в читающую транзакцию снимка
+    with db.get_pool(path).detached() as conn:
+        conn.execute("BEGIN")
+        try:
+            # Первое чтение закрепляет снимок WAL
+            seq = delta.current_seq(conn)
+            yield Snapshot(conn, seq, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+        finally:
+            conn.execute("ROLLBACK")
+
+
+def current_tag(path=None):
+    with db.connection(path) as conn:
+        return f"seq-{delta.current_seq(conn)}"
@@ -0,0 +1,227 @@
+"""Агрегаты покрытия датасета, поддерживаемые триггерами.
+
+Каждая вставка/удаление/изменение строки annotations корректирует счётчики
+в небольших таблицах stats_*, поэтому дашборд читает только их и не зависит
+от размера датасета. Число шагов диалога — количество вызовов инструментов
+(длина answers_json).
+
+    python -m annotator.stats --rebuild   # пересчитать с нуля
+    python -m annotator.stats --verify    # сверить с пересчётом, ничего не меняя
+"""
+import argparse
+import json
+import sys
+
+from annotator import db, delta, snapshot, writer
+
+# Попыток пересчёта на снимке, прежде чем пересчитать под блокировкой записи
+REBUILD_ATTEMPTS = 3
+
+AGGREGATE_TABLES = {
+    "stats_category_difficulty": ("category", "difficulty"),
+    "stats_author": ("author",),
+    "stats_tool": ("tool",),
+    "stats_steps": ("steps",),
+}
+
+_ANSWERS = ("json_each(CASE WHEN json_valid({src}.answers_json) "
+            "THEN {src}.answers_json ELSE '[]' END)")
+_STEPS = ("(CASE WHEN json_valid({src}.answers_json) "
+          "THEN coalesce(json_array_length({src}.answers_json), 0) ELSE 0 END)")
+
+
+def _apply_sql(src, sign):
+    # sign = "+" для NEW (строка добавлена), "-" для OLD (строка удалена)
+    steps = _STEPS.format(src=src)
+    answers = _ANSWERS.format(src=src)
+    return f'''
+            INSERT INTO stats_category_difficulty (category, difficulty, n)
+            VALUES (coalesce({src}.category, ''), coalesce({src}.difficulty, ''), {sign}1)
+            ON CONFLICT (category, difficulty) DO UPDATE SET n = n + excluded.n;
+            INSERT INTO stats_author (author, n)
+            VALUES (coalesce({src}.author, ''), {sign}1)
+            ON CONFLICT (author) DO UPDATE SET n = n + excluded.n;
+            INSERT INTO stats_steps (steps, n)
+            VALUES ({steps}, {sign}1)
+            ON CONFLICT (steps) DO UPDATE SET n = n + excluded.n;
+            INSERT INTO stats_tool (tool, calls, samples)
+            SELECT coalesce(CASE WHEN type = 'object' THEN json_extract(value, '$.name') END, ''),
+                   {sign}count(*), {sign}1
+            FROM {answers} GROUP BY 1
+            ON CONFLICT (tool) DO UPDATE SET calls = calls + excluded.calls,
+                                             samples = samples + excluded.samples;
+    '''
+
+
+_CLEANUP_SQL = '''
+            DELETE FROM stats_category_difficulty WHERE n <= 0;
+            DELETE FROM stats_author WHERE n <= 0;
+            DELETE FROM stats_steps WHERE n <= 0;
+            DELETE FROM stats_tool WHERE calls <= 0;
+'''
+
+
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_category_difficulty (
+            category TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (category, difficulty)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_author (
+            author TEXT PRIMARY KEY,
+            n INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_tool (
+            tool TEXT PRIMARY KEY,
+            calls INTEGER NOT NULL,
+            samples INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_steps (
+            steps INTEGER PRIMARY KEY,
+            n INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_stats_insert
+        AFTER INSERT ON annotations
+        BEGIN{_apply_sql("NEW", "+")}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_stats_delete
+        AFTER DELETE ON annotations
+        BEGIN{_apply_sql("OLD", "-")}{_CLEANUP_SQL}
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_annotations_stats_update
+        AFTER UPDATE OF category, difficulty, author, answers_json ON annotations
+        BEGIN{_apply_sql("OLD", "-")}{_apply_sql("NEW", "+")}{_CLEANUP_SQL}
+        END
+    ''')
+
+
+def drop_triggers(conn):
+    for trigger in ("insert", "delete", "update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS trg_annotations_stats_{trigger}")
+
+
+# --- ПЕРЕСЧЁТ С НУЛЯ ---
+def _scratch_queries():
+    steps = _STEPS.format(src="a")
+    answers = _ANSWERS.format(src="a")
+    return {
+        "stats_category_difficulty": '''
+            SELECT coalesce(category, ''), coalesce(difficulty, ''), count(*)
+            FROM annotations GROUP BY 1, 2
+        ''',
+        "stats_author": "SELECT coalesce(author, ''), count(*) FROM annotations GROUP BY 1",
+        "stats_tool": f'''
+            SELECT tool, sum(calls), count(*) FROM (
+                SELECT coalesce(CASE WHEN j.type = 'object' THEN json_extract(j.value, '$.name') END, '') AS tool,
+                       count(*) AS calls
+                FROM annotations AS a, {answers} AS j
+                GROUP BY a.rowid, 1
+            ) GROUP BY tool
+        ''',
+        "stats_steps": f"SELECT {steps}, count(*) FROM annotations AS a GROUP BY 1",
+    }
+
+
+def rebuild(conn):
+    for table, sql in _scratch_queries().items():
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} {sql}")
+
+
+def rebuild_all(path=None, attempts=REBUILD_ATTEMPTS):
+    """Пересчитывает агрегаты и возвращает тег снимка, по которому они посчитаны.
+
+    Тяжёлые запросы выполняются на снимке без блокировки записи; под
+    блокировкой таблицы только подменяются, если с момента снимка не было
+    изменений. При непрерывной записи — пересчёт целиком под блокировкой.
+    """
+    for _ in range(attempts):
+        with snapshot.open_snapshot(path) as snap:
+            computed = {table: snap.conn.execute(sql).fetchall() for table, sql in _scratch_queries().items()}
+
+        def swap(conn):
+            if delta.current_seq(conn) != snap.seq:
+                return False
+            for table, rows in computed.items():
+                conn.execute(f"DELETE FROM {table}")
+                if rows:
+                    conn.executemany(f"INSERT INTO {table} VALUES ({','.join('?' * len(rows[0]))})", rows)
+            return True
+
+        if writer.write(swap, path=path):
+            return snap.tag
+
+    def locked(conn):
+        rebuild(conn)
+        return f"seq-{delta.current_seq(conn)}"
+
+    return writer.write(locked, path=path)
+
+
+def verify(path=None):
+    """Сравнивает агрегаты с пересчётом; возвращает {таблица: (лишние, недостающие)}."""
+    differences = {}
+    # Агрегаты и пересчёт читаются из одного снимка, иначе параллельная запись дала бы ложные расхождения
+    with snapshot.open_snapshot(path) as snap:
+        conn = snap.conn
+        for table, sql in _scratch_queries().items():
+            expected = set(conn.execute(sql).fetchall())
+            actual = set(conn.execute(f"SELECT * FROM {table}").fetchall())
+            if expected != actual:
+                differences[table] = (sorted(actual - expected), sorted(expected - actual))
+    return differences
+
+
+# --- ЧТЕНИЕ ДЛЯ ДАШБОРДА ---
+def category_difficulty(path=None):
+    return db.fetch_all("SELECT category, difficulty, n FROM stats_category_difficulty", path=path)
+
+
+def authors(path=None):
+    return db.fetch_all("SELECT author, n FROM stats_author ORDER BY n DESC", path=path)
+
+
+def tool_usage(path=None):
+    return db.fetch_all("SELECT tool, calls, samples FROM stats_tool ORDER BY calls DESC", path=path)
+
+
+def step_distribution(path=None):
+    return db.fetch_all("SELECT steps, n FROM stats_steps ORDER BY steps", path=path)
+
+
+def total(path=None):
+    return db.fetch_one("SELECT coalesce(sum(n), 0) FROM stats_author", path=path)[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Агрегаты статистики датасета")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--rebuild", action="store_true", help="пересчитать агрегаты с нуля")
+    group.add_argument("--verify", action="store_true", help="сверить агрегаты с пересчётом")
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    args = parser.parse_args(argv)
+    if args.rebuild:
+        tag = rebuild_all(path=args.db)
+        print(json.dumps({"rebuilt": list(AGGREGATE_TABLES), "snapshot": tag, "total": total(path=args.db)}))
+        return 0
+    differences = verify(path=args.db)
+    print(json.dumps(differences, ensure_ascii=False, default=list))
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Запись аннотаций и пользователей без зависимости от Streamlit.
+
+Используется приложением и бенчмарком (annotator.bench), чтобы оба
+измеряли и выполняли один и тот же путь записи.
+"""
+import json
+import sqlite3
+
+from annotator import db, dedup, revisions, toolsets, writer
+from annotator.db import make_hashes
+
+
+# --- ПОЛЬЗОВАТЕЛИ ---
+def check_hashes(password, hashed_text):
+    return make_hashes(password) == hashed_text
+
+
+def create_user(username, password, path=None):
+    try:
+        db.run_write(lambda conn: conn.execute(
+            'INSERT INTO users(username, password) VALUES (?,?)',
+            (username, make_hashes(password))), path=path)
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+
+def login_user(username, password, path=None):
+    data = db.fetch_one('SELECT password FROM users WHERE username = ?', (username,), path=path)
+    if data:
+        return check_hashes(password, data[0])
+    return False
+
+
+def get_all_users(path=None):
+    return [row[0] for row in db.fetch_all('SELECT username FROM users', path=path)]
+
+
+def update_user_password(username, new_password, path=None):
+    db.run_write(lambda conn: conn.execute(
+        'UPDATE users SET password = ? WHERE username = ?',
+        (make_hashes(new_password), username)), path=path)
+
+
+# --- АННОТАЦИИ ---
+INSERT_SQL = '''
+    INSERT INTO annotations
+    (id, category, difficulty, query, tools_json, answers_json, turns_json, author, tool_set, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+'''
+
+# Перезапись через UPSERT, а не REPLACE: created_at сохраняется, updated_at
+# обновляется, и журнал изменений видит правку, а не удаление со вставкой
+UPSERT_SQL = INSERT_SQL + '''
+    ON CONFLICT(id) DO UPDATE SET
+        category = excluded.category,
+        difficulty = excluded.difficulty,
+        query = excluded.query,
+        tools_json = excluded.tools_json,
+        answers_json = excluded.answers_json,
+        turns_json = excluded.turns_json,
+        author = excluded.author,
+        tool_set = excluded.tool_set,
+        updated_at = excluded.updated_at
+'''
+
+
+class SaveConflict(ValueError):
+    """Запись с таким id уже есть и принадлежит другому автору."""
+
+    def __init__(self, sample_id, author):
+        super().__init__(f"Запись {sample_id} уже существует (автор: {author})")
+        self.sample_id = sample_id
+        self.author = author
+
+
+def annotation_writer(data, overwrite=False, revision_author=None):
+    """Функция записи data для writer.write или чужой транзакции писателя.
+
+    revision_author — кому приписать ревизию, если правку внёс не автор записи.
+    """
+    # MinHash считается до очереди писателя, а не под блокировкой записи
+    query_signature = dedup.signature(data['query'])
+
+    def write(conn):
+        select = f"SELECT {revisions.SELECT_COLUMNS} FROM annotations WHERE id = ?"
+        previous = conn.execute(select, (data['id'],)).fetchone()
+        if not overwrite and previous is not None:
+            # Проверка внутри транзакции писателя: между ней и UPSERT никто не вклинится
+            previous_author = previous[revisions.COLUMNS.index('author')]
+            if previous_author != data.get('author', 'unknown'):
+                raise SaveConflict(data['id'], previous_author)
+        # Инструменты хранятся один раз в tool_sets, запись ссылается на набор
+        tools_json, tool_set = toolsets.prepare(conn, data['tools'])
+        # UPSERT сохраняет created_at и обновляет updated_at (см. annotator.delta)
+        conn.execute(UPSERT_SQL, (
+            data['id'],
+            data['category'],
+            data['difficulty'],
+            data['query'],
+            tools_json,
+            json.dumps(data['answers'], ensure_ascii=False),
+            json.dumps(data['turns'], ensure_ascii=False),
+            data.get('author', 'unknown'),
+            tool_set
+        ))
+        dedup.index_signatures(conn, [(data['id'], query_signature)])
+        # Прежняя версия не теряется: в историю дописывается дельта к ней
+        revisions.record(conn, data['id'], previous, conn.execute(select, (data['id'],)).fetchone(),
+                         author=revision_author)
+    return write
+
+
+def save_annotation_async(data, path=None, overwrite=False):
+    """Ставит запись в очередь писателя; Future завершается после COMMIT.
+
+    Чужая запись с тем же id перезаписывается только при overwrite=True,
+    иначе Future завершается с SaveConflict.
+    """
+    return writer.submit(annotation_writer(data, overwrite), path=path)
+
+
+def save_annotation(data, path=None, timeout=None, overwrite=False):
+    return save_annotation_async(data, path=path, overwrite=overwrite).result(timeout)
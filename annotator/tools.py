@@ -0,0 +1,130 @@
+"""Реестр инструментов, загружаемый из tool_library.json.
+
+Файл читается один раз на процесс и перечитывается только при изменении
+mtime, так что новые инструменты подхватываются без перезапуска. Для каждого
+инструмента заранее считаются шаблон аргументов, набор обязательных
+параметров и карта типов.
+"""
+import json
+import os
+import threading
+import time
+
+TOOLS_FILE = os.environ.get(
+    "ANNOTATOR_TOOLS_FILE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tool_library.json"),
+)
+
+# Не чаще одного stat() на файл за этот интервал
+RELOAD_CHECK_INTERVAL = 1.0
+
+NO_TOOL = "(Нет вызова)"
+
+
+class ToolSpec:
+    __slots__ = ("name", "namespace", "definition", "arg_template", "required", "types")
+
+    def __init__(self, definition):
+        self.name = definition["name"]
+        self.namespace = self.name.split(".", 1)[0]
+        self.definition = definition
+        params = definition.get("parameters", {})
+        template = {}
+        for param_name, param_details in params.items():
+            p_type = param_details.get("type", "string")
+            is_req = " (обязательно)" if param_details.get("required") else ""
+            template[param_name] = f"<{p_type}>{is_req}"
+        self.arg_template = json.dumps(template, indent=4, ensure_ascii=False)
+        self.required = frozenset(name for name, details in params.items() if details.get("required"))
+        self.types = {name: details.get("type", "string") for name, details in params.items()}
+
+
+class ToolCatalog:
+    """Неизменяемый снимок реестра; при перезагрузке подменяется целиком."""
+
+    def __init__(self, definitions):
+        self.specs = {}
+        self.namespaces = {}
+        for definition in definitions:
+            spec = ToolSpec(definition)
+            if spec.name in self.specs:
+                raise ValueError(f"Повторяющийся инструмент: {spec.name}")
+            self.specs[spec.name] = spec
+            self.namespaces.setdefault(spec.namespace, []).append(spec.name)
+        self.names = list(self.specs)
+        self.library = {name: spec.definition for name, spec in self.specs.items()}
+
+    def get(self, name):
+        return self.specs.get(name)
+
+    def in_namespace(self, pattern):
+        """Имена инструментов по префиксу: "weather", "weather." или "weather.*"."""
+        prefix = pattern[:-2] if pattern.endswith(".*") else pattern.rstrip(".")
+        return list(self.namespaces.get(prefix, ()))
+
+
+def load_catalog(path):
+    with open(path, encoding="utf-8") as fh:
+        data = json.load(fh)
+    # Допускается и список определений, и словарь {имя: определение}
+    definitions = data.values() if isinstance(data, dict) else data
+    return ToolCatalog(definitions)
+
+
+class ToolRegistry:
+    def __init__(self, path=TOOLS_FILE):
+        self.path = path
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._mtime = os.stat(path).st_mtime_ns
+        self._catalog = load_catalog(path)
+        self._checked_at = time.monotonic()
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if now - self._checked_at < RELOAD_CHECK_INTERVAL:
+                return
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime == self._mtime:
+                    return
+                self._catalog = load_catalog(self.path)
+                self._mtime = mtime
+                self.last_error = None
+            except (OSError, ValueError) as e:
+                # Файл в процессе редактирования или битый: остаёмся на прошлом снимке
+                self.last_error = e
+
+    @property
+    def catalog(self):
+        self._maybe_reload()
+        return self._catalog
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(path=None):
+    path = path or TOOLS_FILE
+    registry = _registries.get(path)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.get(path)
+            if registry is None:
+                registry = ToolRegistry(path)
+                _registries[path] = registry
+    return registry
+
+
+def get_catalog(path=None):
+    return get_registry(path).catalog
+
+
+def get_tool_library(path=None):
+    # Общий для всех сессий словарь — не изменять на месте
+    return get_catalog(path).library
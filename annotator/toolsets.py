@@ -0,0 +1,154 @@
+"""Хранение определений инструментов с дедупликацией по содержимому.
+
+Каждое определение хранится один раз в tool_definitions (ключ — хэш его
+JSON), упорядоченный набор определений — один раз в tool_sets, а запись
+annotations ссылается на набор колонкой tool_set вместо полной копии в
+tools_json. Экспорт собирает строку набора из уже сериализованных
+определений и кэширует её, так что каждый набор собирается один раз за
+экспорт.
+
+    python -m annotator.toolsets --report
+"""
+import argparse
+import hashlib
+import json
+import sys
+from contextlib import nullcontext
+
+from annotator import db
+
+BACKFILL_BATCH = 2000
+
+
+def content_id(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tool_definitions (
+            id TEXT PRIMARY KEY,
+            definition_json TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tool_sets (
+            id TEXT PRIMARY KEY,
+            definition_ids TEXT NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(annotations)")}
+    if "tool_set" not in columns:
+        conn.execute("ALTER TABLE annotations ADD COLUMN tool_set TEXT")
+
+
+# --- ЗАПИСЬ ---
+def store_tool_set(conn, tools_obj):
+    """Сохраняет набор (если его ещё нет) и возвращает его id; None — если это не список объектов."""
+    if not isinstance(tools_obj, list) or not all(isinstance(item, dict) for item in tools_obj):
+        return None
+    serialized = [json.dumps(item, ensure_ascii=False) for item in tools_obj]
+    definition_ids = [content_id(text) for text in serialized]
+    set_id = content_id("\n".join(definition_ids))
+    if conn.execute("SELECT 1 FROM tool_sets WHERE id = ?", (set_id,)).fetchone() is None:
+        conn.executemany("INSERT OR IGNORE INTO tool_definitions (id, definition_json) VALUES (?, ?)",
+                         zip(definition_ids, serialized))
+        conn.execute("INSERT INTO tool_sets (id, definition_ids) VALUES (?, ?)",
+                     (set_id, json.dumps(definition_ids)))
+    return set_id
+
+
+def prepare(conn, tools_obj):
+    """Значения колонок (tools_json, tool_set) для записи annotations."""
+    set_id = store_tool_set(conn, tools_obj)
+    if set_id is None:
+        return json.dumps(tools_obj, ensure_ascii=False), None
+    return None, set_id
+
+
+def backfill(conn):
+    last_rowid = 0
+    while True:
+        rows = conn.execute('''
+            SELECT rowid, tools_json FROM annotations
+            WHERE rowid > ? AND tool_set IS NULL AND tools_json IS NOT NULL
+            ORDER BY rowid LIMIT ?
+        ''', (last_rowid, BACKFILL_BATCH)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, tools_json in rows:
+            try:
+                set_id = store_tool_set(conn, json.loads(tools_json))
+            except ValueError:
+                set_id = None
+            if set_id is not None:
+                updates.append((set_id, rowid))
+        conn.executemany("UPDATE annotations SET tool_set = ?, tools_json = NULL WHERE rowid = ?", updates)
+        last_rowid = rows[-1][0]
+
+
+# --- ЧТЕНИЕ ---
+class ToolSetCache:
+    """Кэш сериализованных наборов на время одного экспорта или запроса."""
+
+    def __init__(self, path=None, conn=None):
+        self.path = path
+        # conn — подключение снимка: наборы читаются в той же транзакции, что и строки
+        self.conn = conn
+        self._serialized = {}
+
+    def serialized(self, set_id):
+        text = self._serialized.get(set_id)
+        if text is None:
+            with (nullcontext(self.conn) if self.conn is not None else db.connection(self.path)) as conn:
+                row = conn.execute("SELECT definition_ids FROM tool_sets WHERE id = ?", (set_id,)).fetchone()
+                if row is None:
+                    raise KeyError(f"Нет набора инструментов {set_id}")
+                definition_ids = json.loads(row[0])
+                placeholders = ",".join("?" * len(definition_ids))
+                definitions = dict(conn.execute(
+                    f"SELECT id, definition_json FROM tool_definitions WHERE id IN ({placeholders})",
+                    definition_ids).fetchall()) if definition_ids else {}
+            # Совпадает с json.dumps(list, ensure_ascii=False): элементы через ", "
+            text = "[" + ", ".join(definitions[def_id] for def_id in definition_ids) + "]"
+            self._serialized[set_id] = text
+        return text
+
+    def tools_json(self, tools_json, set_id):
+        """tools в виде JSON-строки для записи с любой формой хранения."""
+        if set_id is not None:
+            return self.serialized(set_id)
+        return json.dumps(json.loads(tools_json), ensure_ascii=False)
+
+
+def report(path=None):
+    row = db.fetch_one('''
+        SELECT
+            (SELECT count(*) FROM annotations),
+            (SELECT count(*) FROM annotations WHERE tool_set IS NOT NULL),
+            (SELECT count(*) FROM tool_sets),
+            (SELECT count(*) FROM tool_definitions),
+            (SELECT coalesce(sum(length(definition_json)), 0) FROM tool_definitions),
+            (SELECT coalesce(sum(length(tools_json)), 0) FROM annotations)
+    ''', path=path)
+    keys = ("annotations", "annotations_with_tool_set", "tool_sets", "tool_definitions",
+            "definition_bytes", "inline_tools_bytes")
+    return dict(zip(keys, row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Дедуплицированные наборы инструментов")
+    parser.add_argument("--report", action="store_true", help="показать сводку по наборам")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM: вернуть место, освобождённое миграцией")
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    args = parser.parse_args(argv)
+    if args.vacuum:
+        with db.connection(args.db) as conn:
+            conn.execute("VACUUM")
+    print(json.dumps(report(path=args.db)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
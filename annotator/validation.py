@@ -0,0 +1,213 @@
+"""Проверка аргументов вызовов по схеме parameters из реестра инструментов.
+
+Для каждого инструмента один раз собирается валидатор (замыкание с заранее
+разобранной схемой), поэтому проверка одного вызова занимает микросекунды.
+Пакетный режим перепроверяет всю таблицу annotations в пуле процессов и
+пишет отчёт о нарушениях в JSONL.
+
+    python -m annotator.validation --report violations.jsonl
+"""
+import argparse
+import json
+import re
+import sys
+import time
+import weakref
+
+from annotator import db, tools
+
+BATCH_SIZE = 2000
+
+TYPE_CHECKS = {
+    "string": lambda v: isinstance(v, str),
+    "str": lambda v: isinstance(v, str),
+    "int": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "float": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "bool": lambda v: isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "list": lambda v: isinstance(v, list),
+    "array": lambda v: isinstance(v, list),
+    "dict": lambda v: isinstance(v, dict),
+    "object": lambda v: isinstance(v, dict),
+}
+
+# Незаполненный шаблон из формы: "<string> (обязательно)", "<int>"
+PLACEHOLDER_RE = re.compile(r"^<\w+>( \(обязательно\))?$")
+
+
+# --- КОМПИЛЯЦИЯ ---
+def compile_validator(spec):
+    checks = tuple(
+        (name, TYPE_CHECKS.get(p_type, lambda v: True), p_type)
+        for name, p_type in spec.types.items()
+    )
+    required = spec.required
+    known = frozenset(spec.types)
+
+    def validate(args):
+        if not isinstance(args, dict):
+            return ["аргументы должны быть JSON-объектом"]
+        errors = []
+        missing = required.difference(args)
+        if missing:
+            errors.append(f"нет обязательных параметров: {', '.join(sorted(missing))}")
+        unknown = args.keys() - known
+        if unknown:
+            errors.append(f"неизвестные параметры: {', '.join(sorted(unknown))}")
+        for name, check, p_type in checks:
+            if name not in args:
+                continue
+            value = args[name]
+            if isinstance(value, str) and PLACEHOLDER_RE.match(value):
+                errors.append(f"{name}: не заполнен шаблон {value!r}")
+            elif not check(value):
+                errors.append(f"{name}: ожидается {p_type}, получено {type(value).__name__}")
+        return errors
+
+    return validate
+
+
+_compiled = weakref.WeakKeyDictionary()
+
+
+def get_validators(catalog=None):
+    catalog = catalog or tools.get_catalog()
+    validators = _compiled.get(catalog)
+    if validators is None:
+        validators = {name: compile_validator(spec) for name, spec in catalog.specs.items()}
+        _compiled[catalog] = validators
+    return validators
+
+
+def validate_call(name, args, catalog=None):
+    validator = get_validators(catalog).get(name)
+    if validator is None:
+        return [f"инструмент {name} отсутствует в реестре"]
+    return validator(args)
+
+
+# --- ПРОВЕРКА ЗАПИСИ ---
+def validate_record(answers, turns, validators):
+    violations = []
+    calls = []
+    for index, turn in enumerate(turns):
+        call = turn.get("tool_call") if isinstance(turn, dict) else None
+        if not call:
+            continue
+        calls.append({"name": call.get("name"), "arguments": call.get("arguments")})
+        validator = validators.get(call.get("name"))
+        if validator is None:
+            violations.append((index, call.get("name"), "инструмент отсутствует в реестре"))
+            continue
+        for message in validator(call.get("arguments")):
+            violations.append((index, call.get("name"), message))
+    if calls != answers:
+        violations.append((None, None, "answers не совпадает с вызовами в turns"))
+    return violations
+
+
+_worker_validators = None
+
+
+def _init_worker(tools_path):
+    global _worker_validators
+    _worker_validators = get_validators(tools.load_catalog(tools_path))
+
+
+def _validate_batch(rows, validators=None):
+    validators = validators if validators is not None else _worker_validators
+    report = []
+    for row_id, answers_json, turns_json in rows:
+        try:
+            violations = validate_record(json.loads(answers_json), json.loads(turns_json), validators)
+        except (TypeError, ValueError) as e:
+            violations = [(None, None, f"некорректный JSON: {e}")]
+        for turn_index, tool_name, message in violations:
+            report.append({"id": row_id, "turn": turn_index, "tool": tool_name, "message": message})
+    return len(rows), report
+
+
+def _iter_batches(batch_size, path):
+    with db.connection(path) as conn:
+        cursor = conn.execute("SELECT id, answers_json, turns_json FROM annotations")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+# --- ПАКЕТНАЯ ПЕРЕПРОВЕРКА ---
+def revalidate_dataset(report_file, workers=None, batch_size=BATCH_SIZE, tools_path=None, path=None):
+    """Проверяет все записи и пишет нарушения в report_file (JSONL).
+
+    workers=0 — проверка порциями в текущем процессе (так вызывает
+    Streamlit: spawn перезапустил бы app.py в каждом процессе пула,
+    потому что Streamlit подменяет __main__ скриптом без __spec__).
+
+    Возвращает сводку: число записей, записей с нарушениями, нарушений, секунд.
+    """
+    started = time.perf_counter()
+    tools_path = tools_path or tools.TOOLS_FILE
+    summary = {"rows": 0, "rows_with_violations": 0, "violations": 0}
+
+    def collect_batch(count, report):
+        summary["rows"] += count
+        summary["violations"] += len(report)
+        summary["rows_with_violations"] += len({item["id"] for item in report})
+        for item in report:
+            fh.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+    if workers == 0:
+        validators = get_validators(tools.load_catalog(tools_path))
+        with open(report_file, "w", encoding="utf-8") as fh:
+            for rows in _iter_batches(batch_size, path):
+                collect_batch(*_validate_batch(rows, validators))
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        return summary
+
+    # Пул процессов нужен только пакетной проверке — не грузим его при импорте
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    # spawn: процесс многопоточный, fork в нём небезопасен
+    context = multiprocessing.get_context("spawn")
+    workers = workers or multiprocessing.cpu_count()
+
+    def collect(future):
+        collect_batch(*future.result())
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_worker, initargs=(tools_path,)) as pool, \
+            open(report_file, "w", encoding="utf-8") as fh:
+        # Ограничиваем число батчей в полёте, чтобы не вычитать всю таблицу в память
+        pending = set()
+        for rows in _iter_batches(batch_size, path):
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+            pending.add(pool.submit(_validate_batch, rows))
+        for future in pending:
+            collect(future)
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Перепроверка аргументов всех записей по реестру инструментов")
+    parser.add_argument("--report", default="violations.jsonl", help="куда записать отчёт (JSONL)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="число процессов (по умолчанию — по числу ядер; 0 — без пула)")
+    parser.add_argument("--db", default=None, help="путь к базе (по умолчанию DB_FILE)")
+    parser.add_argument("--tools", default=None, help="путь к tool_library.json")
+    args = parser.parse_args(argv)
+    summary = revalidate_dataset(args.report, workers=args.workers, tools_path=args.tools, path=args.db)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 1 if summary["violations"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Единственный писатель процесса с групповой фиксацией.
+
+Сохранения из всех сессий Streamlit ставятся в очередь; один поток берёт
+из неё пачку (до MAX_BATCH заданий) и выполняет её в одной транзакции,
+каждое задание — под своим SAVEPOINT, так что ошибка одного не отменяет
+остальные. Вызывающий получает Future, который завершается после COMMIT.
+Потоки не конкурируют за блокировку записи SQLite между собой, а fsync
+делится на всю пачку.
+
+При остановке процесса (atexit) очередь дописывается до конца.
+"""
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+
+from annotator import db
+
+MAX_BATCH = 64
+
+_STOP = object()
+
+
+class Writer:
+    def __init__(self, path=None):
+        self.path = path
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="annotator-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        """Ставит fn(conn) в очередь; Future получает результат fn после COMMIT."""
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # Задание из задания: уже внутри транзакции писателя
+            with db.connection(self.path) as conn:
+                future.set_result(fn(conn))
+            return future
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Писатель остановлен")
+            self._queue.put((fn, future))
+        return future
+
+    def flush(self, timeout=None):
+        """Ждёт фиксации всех заданий, поставленных до вызова."""
+        self.submit(lambda conn: None).result(timeout)
+
+    def close(self, wait=True):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        if wait:
+            self._thread.join()
+
+    def _next_batch(self):
+        # Без ожидания: пока фиксируется одна пачка, следующая копится сама
+        batch = [self._queue.get()]
+        while len(batch) < MAX_BATCH and batch[-1] is not _STOP:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is _STOP
+            items = [item for item in batch if item is not _STOP]
+            items = [(fn, future) for fn, future in items if future.set_running_or_notify_cancel()]
+            if items:
+                self._commit(items)
+            if stop:
+                return
+
+    def _commit(self, items):
+        def attempt():
+            outcomes = []
+            with db.transaction(self.path) as conn:
+                for fn, _ in items:
+                    conn.execute("SAVEPOINT write_behind")
+                    try:
+                        outcomes.append((True, fn(conn)))
+                    except Exception as e:
+                        if db.is_busy_error(e):
+                            raise
+                        conn.execute("ROLLBACK TO write_behind")
+                        outcomes.append((False, e))
+                    conn.execute("RELEASE write_behind")
+            return outcomes
+
+        try:
+            # При "database is locked" пачка повторяется целиком: откат
+            # транзакции отменил и все успешно выполненные задания
+            outcomes = db.with_retry(attempt)
+        except BaseException as e:
+            for _, future in items:
+                future.set_exception(e)
+            return
+        for (_, future), (ok, value) in zip(items, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path=None):
+    path = path or db.DB_FILE
+    writer = _writers.get(path)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(path)
+            if writer is None:
+                # Схема поднимается до старта потока-писателя
+                db.init_db(path)
+                writer = Writer(path)
+                _writers[path] = writer
+    return writer
+
+
+def submit(fn, path=None):
+    return get_writer(path).submit(fn)
+
+
+def write(fn, path=None, timeout=None):
+    return submit(fn, path).result(timeout)
+
+
+def shutdown(wait=True):
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close(wait=wait)
+
+
+atexit.register(shutdown)
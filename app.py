@@ -1,441 +1,177 @@
 import streamlit as st
-import sqlite3
 import json
-import hashlib
-import pandas as pd
-from datetime import datetime
+import os
+import tempfile
+import time
 
-# --- КОНФИГУРАЦИЯ И БАЗА ДАННЫХ ---
-DB_FILE = "kazakh_tool_dataset.db"
+from annotator import (browse, cache, db, dedup, export, ids, importer, jobs, model, normalized, perf, planner,
+                       review, revisions, search, stats, storage, tools, validation)
 
-# --- ФУНКЦИИ БЕЗОПАСНОСТИ ---
-def make_hashes(password):
-    return hashlib.sha256(str.encode(password)).hexdigest()
-
-def check_hashes(password, hashed_text):
-    if make_hashes(password) == hashed_text:
-        return True
-    return False
+# Вся логика — в пакете annotator (его можно импортировать без Streamlit);
+# здесь только интерфейс.
 
+# --- БАЗА ДАННЫХ ---
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # 1. Таблица аннотаций
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS annotations (
-            id TEXT PRIMARY KEY,
-            category TEXT,
-            difficulty TEXT,
-            query TEXT,
-            tools_json TEXT,
-            answers_json TEXT,
-            turns_json TEXT,
-            author TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    # Пул подключений и миграции схемы живут в annotator.db и выполняются
+    # один раз на процесс, а не на каждый перезапуск скрипта
+    db.init_db()
+
+def save_to_db(data, overwrite=False):
+    # Запись идёт через единственного писателя процесса (annotator.writer);
+    # возврат — после COMMIT. Чужая запись с тем же id — SaveConflict
+    storage.save_annotation(data, overwrite=overwrite)
+
+# --- ID ОБРАЗЦОВ ---
+# Сессия держит блок зарезервированных номеров по каждой категории
+# (annotator.ids), поэтому форма предлагает id, не занятый никем
+def suggested_sample_id(category):
+    suggested = st.session_state.setdefault('suggested_ids', {})
+    if category not in suggested:
+        blocks = st.session_state.setdefault('id_blocks', {})
+        suggested[category] = ids.next_id(blocks, category)
+    return suggested[category]
+
+def consume_sample_id(category, sample_id):
+    # Предложенный id использован — следующая запись получит новый
+    suggested = st.session_state.setdefault('suggested_ids', {})
+    if suggested.get(category) == sample_id:
+        del suggested[category]
+
+def dataframe(records, columns=None):
+    # pandas нужен только страницам с таблицами и импортируется при первом вызове
+    import pandas as pd
+    return pd.DataFrame.from_records(records, columns=columns)
+
+# --- КЭШ ЧТЕНИЯ ---
+# Общий для всех сессий; сбрасывается, как только меняется annotations/users
+@cache.cached("annotations")
+def cached_categories(path=None):
+    return export.list_categories(path=path)
+
+@cache.cached("annotations")
+def cached_distinct_values(column, path=None):
+    return browse.distinct_values(column, path=path)
+
+@cache.cached("annotations")
+def cached_browse_page(filters, cursor, path=None):
+    # filters — кортеж пар (колонка, значение), чтобы ключ был хэшируемым
+    page_rows, next_cursor = browse.fetch_page(dict(filters), cursor, path=path)
+    return page_rows, next_cursor, dataframe(page_rows, columns=browse.LIST_COLUMNS)
+
+@cache.cached("annotations")
+def cached_artifact(artifact, path=None):
+    with open(artifact, "rb") as fh:
+        return fh.read()
+
+@cache.cached("users")
+def cached_users(path=None):
+    return storage.get_all_users(path=path)
+
+# --- РЕДАКТОР ШАГОВ ---
+# Состояние шага — компактный словарь в st.session_state['tool_steps'];
+# виджеты синхронизируют его через on_change. Каждый шаг рисуется отдельным
+# фрагментом, поэтому правка одного шага перезапускает только его.
+STEP_DEFAULTS = {"plan": "", "thought": "", "tool": tools.NO_TOOL, "args": "{}", "output": None}
+RATE_LIMIT_OUTPUT = '{"error": "rate_limit_exceeded"}'
+
+def new_step(step_id):
+    return {"id": step_id, **STEP_DEFAULTS}
+
+def default_step_output(index, category):
+    return RATE_LIMIT_OUTPUT if index == 0 and category == "exception_handling" else '{}'
+
+def step_output(step, index, category):
+    # None — результат не редактировался, действует значение по умолчанию
+    return step['output'] if step['output'] is not None else default_step_output(index, category)
+
+def sync_step(step, field):
+    step[field] = st.session_state[f"{field}_{step['id']}"]
+
+def change_step_tool(step, catalog):
+    sync_step(step, "tool")
+    spec = catalog.get(step['tool'])
+    step['args'] = spec.arg_template if spec is not None else "{}"
+    st.session_state[f"args_{step['id']}"] = step['args']
+
+def seed_step_widgets(step, index, category, tool_names):
+    for field, default in STEP_DEFAULTS.items():
+        step.setdefault(field, default)
+    if step['tool'] not in tool_names:
+        step['tool'] = tools.NO_TOOL
+        st.session_state[f"tool_{step['id']}"] = step['tool']
+    # Ключи виджетов пропадают, пока шаг не отрисован (например, на другой
+    # странице) — восстанавливаем их из состояния шага
+    for field in ("plan", "thought", "tool", "args"):
+        st.session_state.setdefault(f"{field}_{step['id']}", step[field])
+    if step['output'] is None:
+        st.session_state[f"output_{step['id']}"] = default_step_output(index, category)
+
+@st.fragment
+@perf.phase("steps: step")
+def step_card(index, step, category, tool_names, catalog):
+    seed_step_widgets(step, index, category, tool_names)
+    step_id = step['id']
+    st.markdown("---")
+    st.subheader(f"Шаг {index+1}")
+
+    # 1. МЫСЛИ (Теперь внутри каждого шага)
+    st.markdown("**1. Мысль перед действием**")
+    col_t1, col_t2 = st.columns(2)
+    with col_t1:
+        st.text_input(
+            f"Assistant Plan (Meta) #{index+1}",
+            placeholder="Retry with lower limit" if index > 0 else "Search for images",
+            key=f"plan_{step_id}", on_change=sync_step, args=(step, "plan")
         )
-    ''')
-    
-    try:
-        c.execute("ALTER TABLE annotations ADD COLUMN author TEXT")
-    except sqlite3.OperationalError:
-        pass
-
-    # 2. Таблица пользователей
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            password TEXT
+    with col_t2:
+        st.text_input(
+            f"Мысль ассистента (на казахском) #{index+1}",
+            placeholder="Сұрау шегі асты, азырақ сурет сұрап қайталаймын." if index > 0 else "Сурет іздеу қызметін пайдаланып көремін.",
+            key=f"thought_{step_id}", on_change=sync_step, args=(step, "thought")
         )
-    ''')
-    
-    c.execute('SELECT * FROM users')
-    if not c.fetchall():
-        c.execute('INSERT INTO users (username, password) VALUES (?, ?)', 
-                  ('admin', make_hashes('admin123')))
-    
-    conn.commit()
-    conn.close()
-
-# --- ФУНКЦИИ РАБОТЫ С ПОЛЬЗОВАТЕЛЯМИ ---
-def create_user(username, password):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    try:
-        c.execute('INSERT INTO users(username, password) VALUES (?,?)', 
-                  (username, make_hashes(password)))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-    finally:
-        conn.close()
-
-def login_user(username, password):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT password FROM users WHERE username = ?', (username,))
-    data = c.fetchall()
-    conn.close()
-    if data:
-        return check_hashes(password, data[0][0])
-    return False
-
-def get_all_users():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT username FROM users')
-    data = [row[0] for row in c.fetchall()]
-    conn.close()
-    return data
-
-def update_user_password(username, new_password):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('UPDATE users SET password = ? WHERE username = ?', 
-              (make_hashes(new_password), username))
-    conn.commit()
-    conn.close()
-
-# --- ФУНКЦИИ СОХРАНЕНИЯ ---
-def save_to_db(data):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        INSERT OR REPLACE INTO annotations 
-        (id, category, difficulty, query, tools_json, answers_json, turns_json, author)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        data['id'], 
-        data['category'], 
-        data['difficulty'], 
-        data['query'],
-        json.dumps(data['tools'], ensure_ascii=False),
-        json.dumps(data['answers'], ensure_ascii=False),
-        json.dumps(data['turns'], ensure_ascii=False),
-        data.get('author', 'unknown')
-    ))
-    conn.commit()
-    conn.close()
-
-# --- БИБЛИОТЕКА ИНСТРУМЕНТОВ ---
-def get_tool_library():
-    return {
-        # === ПОГОДА ===
-        "weather.get": {
-            "name": "weather.get",
-            "description": "Get current weather conditions for a city",
-            "parameters": {
-                "city": {"type": "string", "description": "City name", "required": True},
-                "units": {"type": "string", "description": "metric or imperial", "required": False}
-            }
-        },
-        "weather.forecast": {
-            "name": "weather.forecast",
-            "description": "Get weather forecast for upcoming days",
-            "parameters": {
-                "city": {"type": "string", "description": "City name", "required": True},
-                "days": {"type": "int", "description": "Number of days (1-7)", "required": False}
-            }
-        },
-        "air.quality": {
-            "name": "air.quality",
-            "description": "Get air quality index and pollution levels",
-            "parameters": {
-                "city": {"type": "string", "description": "City name", "required": True}
-            }
-        },
-        # === КАРТЫ ===
-        "maps.geocode": {
-            "name": "maps.geocode",
-            "description": "Convert address to latitude/longitude coordinates",
-            "parameters": {
-                "address": {"type": "string", "description": "Full address or location name", "required": True}
-            }
-        },
-        "maps.route": {
-            "name": "maps.route",
-            "description": "Calculate driving/walking route between locations",
-            "parameters": {
-                "from": {"type": "string", "description": "Starting location", "required": True},
-                "to": {"type": "string", "description": "Destination", "required": True},
-                "mode": {"type": "string", "description": "driving, walking, transit", "required": False}
-            }
-        },
-        # === ПУТЕШЕСТВИЯ ===
-        "flights.search": {
-            "name": "flights.search",
-            "description": "Search available flights between airports",
-            "parameters": {
-                "from": {"type": "string", "description": "Departure airport code", "required": True},
-                "to": {"type": "string", "description": "Arrival airport code", "required": True},
-                "date": {"type": "string", "description": "Departure date YYYY-MM-DD", "required": True},
-                "sort": {"type": "string", "description": "price, duration, departure_time", "required": False}
-            }
-        },
-        "flights.book": {
-            "name": "flights.book",
-            "description": "Book a specific flight",
-            "parameters": {
-                "flightId": {"type": "string", "description": "Flight ID from search", "required": True},
-                "passengerName": {"type": "string", "description": "Passenger full name", "required": True},
-                "phone": {"type": "string", "description": "Contact phone", "required": False}
-            }
-        },
-        "hotels.search": {
-            "name": "hotels.search",
-            "description": "Search hotels in a city",
-            "parameters": {
-                "city": {"type": "string", "description": "City name", "required": True},
-                "checkin": {"type": "string", "description": "Check-in date YYYY-MM-DD", "required": True},
-                "nights": {"type": "int", "description": "Number of nights", "required": False}
-            }
-        },
-        "hotels.book": {
-            "name": "hotels.book",
-            "description": "Book a hotel room",
-            "parameters": {
-                "hotelId": {"type": "string", "description": "Hotel ID from search", "required": True},
-                "checkin": {"type": "string", "description": "Check-in date YYYY-MM-DD", "required": True},
-                "nights": {"type": "int", "description": "Number of nights", "required": True},
-                "guestName": {"type": "string", "description": "Guest name", "required": True}
-            }
-        },
-        "trains.search": {
-            "name": "trains.search",
-            "description": "Search train schedules",
-            "parameters": {
-                "from": {"type": "string", "description": "Departure station", "required": True},
-                "to": {"type": "string", "description": "Arrival station", "required": True},
-                "date": {"type": "string", "description": "Travel date YYYY-MM-DD", "required": True}
-            }
-        },
-        # === КАЛЕНДАРЬ ===
-        "calendar.get": {
-            "name": "calendar.get",
-            "description": "Get calendar events for a specific date",
-            "parameters": {
-                "date": {"type": "string", "description": "Date YYYY-MM-DD", "required": True},
-                "timezone": {"type": "string", "description": "Timezone like Asia/Almaty", "required": False}
-            }
-        },
-        "calendar.add": {
-            "name": "calendar.add",
-            "description": "Add new calendar event",
-            "parameters": {
-                "title": {"type": "string", "description": "Event title", "required": True},
-                "datetime": {"type": "string", "description": "Start time RFC3339", "required": True},
-                "duration": {"type": "int", "description": "Duration in minutes", "required": False},
-                "location": {"type": "string", "description": "Event location", "required": False}
-            }
-        },
-        # === КОММУНИКАЦИЯ ===
-        "email.send": {
-            "name": "email.send",
-            "description": "Send email message",
-            "parameters": {
-                "to": {"type": "string", "description": "Recipient email", "required": True},
-                "subject": {"type": "string", "description": "Email subject", "required": True},
-                "body": {"type": "string", "description": "Email content", "required": True}
-            }
-        },
-        "sms.send": {
-            "name": "sms.send",
-            "description": "Send SMS message",
-            "parameters": {
-                "to": {"type": "string", "description": "Phone number", "required": True},
-                "message": {"type": "string", "description": "SMS text", "required": True}
-            }
-        },
-        # === ПОИСК ===
-        "web.search": {
-            "name": "web.search",
-            "description": "Search the web for information",
-            "parameters": {
-                "query": {"type": "string", "description": "Search query", "required": True},
-                "limit": {"type": "int", "description": "Number of results", "required": False}
-            }
-        },
-        "news.search": {
-            "name": "news.search",
-            "description": "Search recent news articles",
-            "parameters": {
-                "query": {"type": "string", "description": "Search topic", "required": True},
-                "language": {"type": "string", "description": "Language code", "required": False},
-                "pageToken": {"type": "string", "description": "Pagination token", "required": False}
-            }
-        },
-        "wiki.search": {
-            "name": "wiki.search",
-            "description": "Search Wikipedia articles",
-            "parameters": {
-                "query": {"type": "string", "description": "Search term", "required": True},
-                "language": {"type": "string", "description": "Language code like kk, ru, en", "required": False}
-            }
-        },
-        # === ФИНАНСЫ ===
-        "forex.rate": {
-            "name": "forex.rate",
-            "description": "Get currency exchange rate",
-            "parameters": {
-                "from": {"type": "string", "description": "Source currency code", "required": True},
-                "to": {"type": "string", "description": "Target currency code", "required": True}
-            }
-        },
-        "bank.balance": {
-            "name": "bank.balance",
-            "description": "Get bank account balance",
-            "parameters": {
-                "account": {"type": "string", "description": "Account number", "required": True},
-                "api_key": {"type": "string", "description": "Auth key", "required": False}
-            }
-        },
-        "bank.transfer": {
-            "name": "bank.transfer",
-            "description": "Transfer money between accounts",
-            "parameters": {
-                "from_account": {"type": "string", "description": "Source account", "required": True},
-                "to_account": {"type": "string", "description": "Destination account", "required": True},
-                "amount": {"type": "float", "description": "Amount to transfer", "required": True},
-                "api_key": {"type": "string", "description": "Auth key", "required": True}
-            }
-        },
-        "crypto.price": {
-            "name": "crypto.price",
-            "description": "Get cryptocurrency price",
-            "parameters": {
-                "symbol": {"type": "string", "description": "Crypto symbol like BTC, ETH", "required": True},
-                "currency": {"type": "string", "description": "Target currency like USD, KZT", "required": False}
-            }
-        },
-        # === ПОКУПКИ ===
-        "shop.search": {
-            "name": "shop.search",
-            "description": "Search products in online store",
-            "parameters": {
-                "query": {"type": "string", "description": "Product search query", "required": True},
-                "category": {"type": "string", "description": "Product category", "required": False},
-                "sort": {"type": "string", "description": "price_low, price_high, rating", "required": False}
-            }
-        },
-        "shop.add_to_cart": {
-            "name": "shop.add_to_cart",
-            "description": "Add product to shopping cart",
-            "parameters": {
-                "productId": {"type": "string", "description": "Product ID", "required": True},
-                "quantity": {"type": "int", "description": "Number of items", "required": False}
-            }
-        },
-        "shop.checkout": {
-            "name": "shop.checkout",
-            "description": "Complete purchase",
-            "parameters": {
-                "cartId": {"type": "string", "description": "Shopping cart ID", "required": True},
-                "paymentMethod": {"type": "string", "description": "card, cash, bank_transfer", "required": True}
-            }
-        },
-        # === ДОКУМЕНТАЦИЯ ===
-        "docs.retrieve": {
-            "name": "docs.retrieve",
-            "description": "Get API documentation for a service",
-            "parameters": {
-                "service": {"type": "string", "description": "Service name", "required": True},
-                "function": {"type": "string", "description": "Function name", "required": True}
-            }
-        },
-        # === АНАЛИЗ ТЕКСТА ===
-        "nlp.sentiment": {
-            "name": "nlp.sentiment",
-            "description": "Analyze sentiment of text",
-            "parameters": {
-                "text": {"type": "string", "description": "Text to analyze", "required": True},
-                "language": {"type": "string", "description": "Language code", "required": False}
-            }
-        },
-        "nlp.translate": {
-            "name": "nlp.translate",
-            "description": "Translate text between languages",
-            "parameters": {
-                "text": {"type": "string", "description": "Text to translate", "required": True},
-                "from_lang": {"type": "string", "description": "Source language", "required": True},
-                "to_lang": {"type": "string", "description": "Target language", "required": True}
-            }
-        },
-        # === СЕТЬ И СИСТЕМА ===
-        "network.speedtest": {
-            "name": "network.speedtest",
-            "description": "Test internet connection speed",
-            "parameters": {
-                "server": {"type": "string", "description": "Test server location", "required": False}
-            }
-        },
-        "system.time": {
-            "name": "system.time",
-            "description": "Get current time in timezone",
-            "parameters": {
-                "timezone": {"type": "string", "description": "Timezone like Asia/Almaty", "required": True}
-            }
-        },
-        # === МЕДИА ===
-        "images.search": {
-            "name": "images.search",
-            "description": "Search for images",
-            "parameters": {
-                "query": {"type": "string", "description": "Image search query", "required": True},
-                "limit": {"type": "int", "description": "Number of results", "required": False}
-            }
-        },
-        "video.search": {
-            "name": "video.search",
-            "description": "Search for videos",
-            "parameters": {
-                "query": {"type": "string", "description": "Video search query", "required": True},
-                "platform": {"type": "string", "description": "youtube, vimeo, all", "required": False}
-            }
-        },
-        # === СОБЫТИЯ ===
-        "events.search": {
-            "name": "events.search",
-            "description": "Search for events in a city",
-            "parameters": {
-                "city": {"type": "string", "description": "City name", "required": True},
-                "type": {"type": "string", "description": "concert, sports, theater, etc", "required": False},
-                "date": {"type": "string", "description": "Event date YYYY-MM-DD", "required": False}
-            }
-        },
-        "tickets.book": {
-            "name": "tickets.book",
-            "description": "Book event tickets",
-            "parameters": {
-                "eventId": {"type": "string", "description": "Event ID from search", "required": True},
-                "quantity": {"type": "int", "description": "Number of tickets", "required": True},
-                "seatType": {"type": "string", "description": "vip, regular, balcony", "required": False}
-            }
-        },
-        "restaurant.search": {
-            "name": "restaurant.search",
-            "description": "Search restaurants",
-            "parameters": {
-                "city": {"type": "string", "description": "City name", "required": True},
-                "cuisine": {"type": "string", "description": "Cuisine type", "required": False},
-                "priceRange": {"type": "string", "description": "budget, mid, expensive", "required": False}
-            }
-        },
-        "restaurant.reserve": {
-            "name": "restaurant.reserve",
-            "description": "Make restaurant reservation",
-            "parameters": {
-                "restaurantId": {"type": "string", "description": "Restaurant ID", "required": True},
-                "date": {"type": "string", "description": "Reservation date YYYY-MM-DD", "required": True},
-                "time": {"type": "string", "description": "Time HH:MM", "required": True},
-                "guests": {"type": "int", "description": "Number of guests", "required": True}
-            }
-        }
-    }
+
+    # 2. ИНСТРУМЕНТ
+    st.markdown("**2. Вызов и Результат**")
+    c1, c2 = st.columns([1, 1])
+    with c1:
+        st.selectbox(
+            f"Инструмент #{index+1}",
+            [tools.NO_TOOL] + tool_names,
+            key=f"tool_{step_id}", on_change=change_step_tool, args=(step, catalog)
+        )
+        st.text_area(
+            f"Аргументы #{index+1} (JSON)",
+            height=200,
+            key=f"args_{step_id}", on_change=sync_step, args=(step, "args")
+        )
+    with c2:
+        st.text_area(
+            f"Результат API #{index+1} (JSON)",
+            height=268,
+            key=f"output_{step_id}", on_change=sync_step, args=(step, "output")
+        )
+
+@st.fragment
+def step_editor(category, tool_names, catalog):
+    steps = st.session_state['tool_steps']
+    # Кнопки управления шагами
+    col_b1, col_b2 = st.columns([1, 5])
+    with col_b1:
+        if st.button("➕ Добавить шаг"):
+            steps.append(new_step(st.session_state['step_counter']))
+            st.session_state['step_counter'] += 1
+    with col_b2:
+        if st.button("➖ Удалить последний") and len(steps) > 0:
+            steps.pop()
+
+    for i, step in enumerate(steps):
+        step_card(i, step, category, tool_names, catalog)
 
 # --- UI ИНТЕРФЕЙС ---
 st.set_page_config(page_title="Kazakh Tool-Call Annotator", layout="wide")
-init_db()
+perf.rerun_started()
+with perf.phase("init_db"):
+    init_db()
 
 if 'logged_in' not in st.session_state:
     st.session_state['logged_in'] = False
@@ -443,7 +179,7 @@ if 'username' not in st.session_state:
     st.session_state['username'] = None
 
 if 'tool_steps' not in st.session_state:
-    st.session_state['tool_steps'] = [{"id": 0}] 
+    st.session_state['tool_steps'] = [new_step(0)]
 if 'step_counter' not in st.session_state:
     st.session_state['step_counter'] = 1
 
@@ -455,13 +191,16 @@ if not st.session_state['logged_in']:
         username = st.text_input("Логин")
         password = st.text_input("Пароль", type='password')
         if st.button("Войти"):
-            if login_user(username, password):
+            with perf.phase("auth"):
+                logged_in = storage.login_user(username, password)
+            if logged_in:
                 st.session_state['logged_in'] = True
                 st.session_state['username'] = username
                 st.rerun()
             else:
                 st.error("Неверный логин или пароль")
     # st.info("По умолчанию: admin / admin123")
+    perf.rerun_finished("Авторизация")
     st.stop()
 
 # === ОСНОВНОЕ ПРИЛОЖЕНИЕ ===
@@ -474,9 +213,14 @@ if st.sidebar.button("Выйти"):
 st.title("🇰🇿 Kazakh Tool-Calling Dataset Annotator")
 st.markdown("Инструмент для создания датасета согласно методологии APIGen.")
 
-menu_options = ["Аннотация (Добавить данные)", "Экспорт (Скачать JSON)"]
+menu_options = ["Аннотация (Добавить данные)", "Проверка записей", "Экспорт (Скачать JSON)", "Поиск", "Статистика"]
 if st.session_state['username'] == 'admin':
     menu_options.append("Управление пользователями")
+    menu_options.append("Планы запросов")
+    menu_options.append("Проверка аргументов")
+    menu_options.append("Импорт данных")
+    menu_options.append("Дубликаты запросов")
+    menu_options.append("Производительность")
 
 page = st.sidebar.radio("Меню", menu_options)
 
@@ -497,7 +241,7 @@ if page == "Управление пользователями":
             submitted = st.form_submit_button("Создать")
             if submitted:
                 if len(new_user) > 0 and len(new_pass) > 0:
-                    if create_user(new_user, new_pass):
+                    if storage.create_user(new_user, new_pass):
                         st.success(f"Пользователь {new_user} успешно создан")
                     else:
                         st.error("Пользователь с таким именем уже существует")
@@ -506,16 +250,135 @@ if page == "Управление пользователями":
 
     with tab2:
         st.subheader("Сменить пароль")
-        all_users = get_all_users()
+        all_users = cached_users()
         selected_user = st.selectbox("Выберите пользователя", all_users)
         new_pass_edit = st.text_input("Новый пароль для пользователя", type='password', key="edit_pass")
         if st.button("Обновить пароль"):
             if len(new_pass_edit) > 0:
-                update_user_password(selected_user, new_pass_edit)
+                storage.update_user_password(selected_user, new_pass_edit)
                 st.success(f"Пароль для {selected_user} обновлен")
             else:
                 st.warning("Введите новый пароль")
 
+# === СТРАНИЦА ПЛАНОВ ЗАПРОСОВ ===
+elif page == "Планы запросов":
+    if st.session_state['username'] != 'admin':
+        st.error("У вас нет прав доступа к этой странице.")
+        st.stop()
+
+    st.header("Планы основных запросов")
+    st.caption("EXPLAIN QUERY PLAN для запросов экспорта, просмотра и входа.")
+    if st.button("Обновить статистику планировщика (ANALYZE)"):
+        planner.analyze()
+        st.success("Статистика обновлена")
+
+    for item in planner.explain_main_queries():
+        marker = "⚠️" if item['full_scan'] else "✅"
+        st.markdown(f"{marker} **{item['title']}**")
+        st.code(item['sql'], language="sql")
+        st.code("\n".join(item['plan']), language="text")
+
+# === СТРАНИЦА ПРОВЕРКИ АРГУМЕНТОВ ===
+elif page == "Проверка аргументов":
+    if st.session_state['username'] != 'admin':
+        st.error("У вас нет прав доступа к этой странице.")
+        st.stop()
+
+    st.header("Перепроверка датасета по схемам инструментов")
+    st.caption("Все сохранённые вызовы проверяются по текущему tool_library.json.")
+    if st.button("Запустить проверку"):
+        report_file = os.path.join(tempfile.gettempdir(), "violations.jsonl")
+        with st.spinner("Проверка..."):
+            # Без пула процессов — см. validation.revalidate_dataset
+            summary = validation.revalidate_dataset(report_file, workers=0)
+        st.success(f"Записей: {summary['rows']}, с нарушениями: {summary['rows_with_violations']}, "
+                   f"нарушений: {summary['violations']} ({summary['seconds']} с)")
+        if summary['violations']:
+            with open(report_file, "rb") as fh:
+                st.download_button("Скачать отчёт", data=fh, file_name="violations.jsonl",
+                                   mime="application/jsonl")
+
+# === СТРАНИЦА ИМПОРТА ===
+elif page == "Импорт данных":
+    if st.session_state['username'] != 'admin':
+        st.error("У вас нет прав доступа к этой странице.")
+        st.stop()
+
+    st.header("Импорт аннотаций")
+    st.caption("JSON-массив или JSONL в формате экспорта.")
+    uploaded = st.file_uploader("Файл", type=["json", "jsonl"])
+    conflict_labels = {
+        importer.ON_CONFLICT_SKIP: "Пропустить существующие id",
+        importer.ON_CONFLICT_OVERWRITE: "Перезаписать",
+        importer.ON_CONFLICT_VERSION: "Сохранить как новую версию (id_v2, id_v3...)",
+    }
+    on_conflict = st.radio("При совпадении id", importer.CONFLICT_MODES, format_func=conflict_labels.get)
+    import_author = st.text_input("Автор для записей без поля author", value="import")
+    check_args = st.checkbox("Проверять аргументы по схемам инструментов", value=True)
+    if uploaded is not None and st.button("Импортировать", type="primary"):
+        with st.spinner("Импорт..."):
+            result = importer.import_bytes_stream(uploaded, on_conflict=on_conflict, author=import_author,
+                                                  check_arguments=check_args)
+        summary = result.as_dict()
+        st.success(f"Прочитано: {summary['read']}, добавлено: {summary['inserted']}, "
+                   f"перезаписано: {summary['replaced']}, пропущено: {summary['skipped']}, "
+                   f"новых версий: {summary['versioned']} — {summary['records_per_second']} записей/с")
+        if result.error_count:
+            st.error(f"Отклонено записей: {result.error_count}")
+            st.dataframe(dataframe(result.errors), hide_index=True)
+
+# === СТРАНИЦА ДУБЛИКАТОВ ===
+elif page == "Дубликаты запросов":
+    if st.session_state['username'] != 'admin':
+        st.error("У вас нет прав доступа к этой странице.")
+        st.stop()
+
+    st.header("Почти-дубликаты запросов")
+    dup_threshold = st.slider("Порог сходства", 0.5, 1.0, dedup.DEFAULT_THRESHOLD, 0.05)
+    if st.button("Найти кластеры"):
+        with st.spinner("Поиск..."):
+            clusters = dedup.find_clusters(threshold=dup_threshold)
+        if not clusters:
+            st.success("Дубликатов не найдено")
+        else:
+            st.warning(f"Кластеров: {len(clusters)}")
+            for members in clusters:
+                rows = db.fetch_all(
+                    f"SELECT id, author, query FROM annotations WHERE id IN ({','.join('?' * len(members))})",
+                    members)
+                st.dataframe(dataframe(rows, columns=["id", "author", "query"]), hide_index=True)
+
+# === СТРАНИЦА ПРОИЗВОДИТЕЛЬНОСТИ ===
+elif page == "Производительность":
+    if st.session_state['username'] != 'admin':
+        st.error("У вас нет прав доступа к этой странице.")
+        st.stop()
+
+    st.header("Производительность")
+    if not perf.ENABLED:
+        st.warning("Замеры выключены (ANNOTATOR_PERF=0).")
+    window_labels = {5 * 60: "5 минут", 15 * 60: "15 минут", 60 * 60: "1 час", 24 * 60 * 60: "24 часа"}
+    perf_window = st.radio("Окно", list(window_labels), index=1, horizontal=True, format_func=window_labels.get)
+    if st.button("Сбросить замеры"):
+        perf.reset()
+
+    perf_columns = ["key", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms", "total_ms", "avg_rows"]
+    st.subheader("Фазы перезапуска")
+    st.dataframe(dataframe(perf.summary(perf.KIND_PHASE, perf_window), columns=perf_columns[:-1]),
+                 hide_index=True)
+    st.subheader("SQL-запросы")
+    st.dataframe(dataframe(perf.summary(perf.KIND_SQL, perf_window), columns=perf_columns), hide_index=True)
+    cache_info = cache.get_cache().info()
+    st.caption(f"Кэш чтения: записей {cache_info['entries']}, "
+               f"{cache_info['bytes'] / 1048576:.1f} / {cache_info['max_bytes'] / 1048576:.0f} МБ, "
+               f"попаданий {cache_info['hits']}, промахов {cache_info['misses']}")
+    st.subheader(f"Медленные запросы (≥ {perf.SLOW_QUERY_MS:g} мс)")
+    slow = perf.slow_queries()
+    if slow:
+        st.dataframe(dataframe(slow, columns=["at", "ms", "rows", "sql"]), hide_index=True)
+    else:
+        st.info("Медленных запросов нет")
+
 # === СТРАНИЦА АННОТАЦИИ ===
 elif page == "Аннотация (Добавить данные)":
     st.header("Новая запись")
@@ -523,30 +386,32 @@ elif page == "Аннотация (Добавить данные)":
     # 1. Метаданные
     col1, col2 = st.columns(2)
     with col1:
-        category = st.selectbox("Категория (Category)", [
-            "tool_awareness", 
-            "planning_multistep", 
-            "api_discovery", 
-            "argument_schema", 
-            "state_context", 
-            "exception_handling", 
-            "answer_synthesis"
-        ])
+        category = st.selectbox("Категория (Category)", model.CATEGORIES)
     with col2:
-        difficulty = st.selectbox("Сложность (Difficulty)", ["easy", "hard"])
+        difficulty = st.selectbox("Сложность (Difficulty)", model.DIFFICULTIES)
 
-    sample_id = st.text_input("ID образца", value=f"kk_{category}_001")
+    sample_id = st.text_input("ID образца", value=suggested_sample_id(category))
 
     # 2. Запрос
     query = st.text_area("Запрос пользователя (на казахском)", 
                          placeholder="Стамбул туралы көп фотосурет іздеңіз.",
                          help="Используйте культурный контекст.")
 
+    if query:
+        near_duplicates = dedup.find_similar(query, exclude_id=sample_id)
+        if near_duplicates:
+            st.warning("Похожие запросы уже есть в базе: " + ", ".join(
+                f"{dup_id} ({score:.0%})" for dup_id, score in near_duplicates))
+
     # 3. Выбор инструментов
     st.subheader("🛠 Выбор доступных инструментов")
-    tool_lib = get_tool_library()
+    with perf.phase("tool_library"):
+        tool_catalog = tools.get_catalog()
+    if tools.get_registry().last_error:
+        st.warning(f"tool_library.json не перечитан, используется прошлая версия: {tools.get_registry().last_error}")
+    tool_lib = tool_catalog.library
     selected_tool_names = st.multiselect("Выберите доступные инструменты для этого диалога", 
-                                         options=list(tool_lib.keys()))
+                                         options=tool_catalog.names)
     
     selected_tools_objs = [tool_lib[name] for name in selected_tool_names]
     st.json(selected_tools_objs, expanded=False)
@@ -555,83 +420,9 @@ elif page == "Аннотация (Добавить данные)":
     st.subheader("💬 Диалог (Turns)")
     st.info("Формат цепочки: [Мысль (Plan) -> Инструмент -> Ответ] повторяется для каждого шага.")
     
-    # Кнопки управления шагами
-    col_b1, col_b2 = st.columns([1, 5])
-    with col_b1:
-        if st.button("➕ Добавить шаг"):
-            st.session_state['tool_steps'].append({"id": st.session_state['step_counter']})
-            st.session_state['step_counter'] += 1
-    with col_b2:
-        if st.button("➖ Удалить последний") and len(st.session_state['tool_steps']) > 0:
-            st.session_state['tool_steps'].pop()
-
     # Рендеринг шагов
-    steps_data = [] 
-    
-    for i, step in enumerate(st.session_state['tool_steps']):
-        st.markdown(f"---")
-        st.subheader(f"Шаг {i+1}")
-        
-        # 1. МЫСЛИ (Теперь внутри каждого шага)
-        st.markdown("**1. Мысль перед действием**")
-        col_t1, col_t2 = st.columns(2)
-        with col_t1:
-            step_plan = st.text_input(
-                f"Assistant Plan (Meta) #{i+1}", 
-                placeholder="Retry with lower limit" if i > 0 else "Search for images",
-                key=f"plan_{step['id']}"
-            )
-        with col_t2:
-            step_thought = st.text_input(
-                f"Мысль ассистента (на казахском) #{i+1}", 
-                placeholder="Сұрау шегі асты, азырақ сурет сұрап қайталаймын." if i > 0 else "Сурет іздеу қызметін пайдаланып көремін.",
-                key=f"thought_{step['id']}"
-            )
-
-        # 2. ИНСТРУМЕНТ
-        st.markdown("**2. Вызов и Результат**")
-        c1, c2 = st.columns([1, 1])
-        
-        with c1:
-            step_tool = st.selectbox(
-                f"Инструмент #{i+1}", 
-                ["(Нет вызова)"] + selected_tool_names,
-                key=f"tool_select_{step['id']}"
-            )
-            
-            default_json_val = "{}"
-            if step_tool != "(Нет вызова)":
-                current_tool_def = tool_lib[step_tool]
-                params_schema = current_tool_def.get("parameters", {})
-                arg_template = {}
-                for param_name, param_details in params_schema.items():
-                    p_type = param_details.get("type", "string")
-                    is_req = " (обязательно)" if param_details.get("required") else ""
-                    arg_template[param_name] = f"<{p_type}>{is_req}"
-                default_json_val = json.dumps(arg_template, indent=4, ensure_ascii=False)
-
-            step_args = st.text_area(
-                f"Аргументы #{i+1} (JSON)", 
-                value=default_json_val, 
-                height=200,
-                key=f"args_{step['id']}"
-            )
-
-        with c2:
-            step_output = st.text_area(
-                f"Результат API #{i+1} (JSON)", 
-                value='{"error": "rate_limit_exceeded"}' if i == 0 and category == "exception_handling" else '{}',
-                height=268,
-                key=f"output_{step['id']}"
-            )
-
-        steps_data.append({
-            "tool": step_tool,
-            "args": step_args,
-            "output": step_output,
-            "plan": step_plan,
-            "thought": step_thought
-        })
+    with perf.phase("steps"):
+        step_editor(category, selected_tool_names, tool_catalog)
 
     st.markdown("---")
     # 3. Финал
@@ -640,110 +431,299 @@ elif page == "Аннотация (Добавить данные)":
                                 placeholder="Стамбул суреттері табылды: Айя София және басқалары.")
 
     # --- СОХРАНЕНИЕ ---
+    overwrite_foreign = st.checkbox("Перезаписать чужую запись с этим ID",
+                                    help="Без отметки запись другого автора с тем же ID не заменяется")
     if st.button("Сохранить в БД", type="primary"):
         if not query:
             st.error("Введите запрос пользователя!")
         else:
-            turns = []
-            answers = [] 
-            
-            # 1. User
-            turns.append({"role": "user", "content": query})
-            
-            # 2. Loop through Steps (Thought -> Call -> Output)
-            valid_steps = True
-            for step in steps_data:
-                t_name = step['tool']
-                t_args_str = step['args']
-                t_out_str = step['output']
-                t_plan = step['plan']
-                t_thought = step['thought']
-                
-                # ВСЕГДА добавляем мысль, если она заполнена (даже если нет вызова инструмента, например для размышлений)
-                # Но по стандарту APIGen обычно мысль идет перед тулом.
-                if t_thought or t_plan:
-                     turns.append({
-                        "role": "assistant",
-                        "content": t_thought if t_thought else "...",
-                        "meta": {"plan": t_plan if t_plan else ""}
-                    })
-
-                if t_name != "(Нет вызова)":
-                    try:
-                        args_json = json.loads(t_args_str)
-                        # Tool Call
-                        turns.append({
-                            "role": "assistant",
-                            "tool_call": {
-                                "name": t_name,
-                                "arguments": args_json
-                            }
-                        })
-                        
-                        # Tool Output
-                        turns.append({
-                            "role": "tool",
-                            "content": t_out_str
-                        })
-                        
-                        answers.append({"name": t_name, "arguments": args_json})
-                        
-                    except json.JSONDecodeError:
-                        st.error(f"Ошибка JSON в шаге с инструментом {t_name}")
-                        valid_steps = False
-                        break
-            
-            if valid_steps:
-                # 3. Final Answer
-                turns.append({"role": "assistant", "content": final_answer})
-
-                data_obj = {
-                    "id": sample_id,
-                    "category": category,
-                    "difficulty": difficulty,
-                    "query": query,
-                    "tools": selected_tools_objs,
-                    "answers": answers,
-                    "turns": turns,
-                    "author": st.session_state['username']
-                }
-                
-                save_to_db(data_obj)
-                st.success(f"Запись {sample_id} успешно сохранена! Шагов: {len(steps_data)}")
+            steps_data = [
+                dict(step, output=step_output(step, i, category))
+                for i, step in enumerate(st.session_state['tool_steps'])
+            ]
+            try:
+                turns, answers = model.build_turns(query, steps_data, final_answer, tool_catalog)
+            except model.StepError as e:
+                for message in e.messages:
+                    st.error(f"Шаг с инструментом {e.tool}: {message}")
+            else:
+                data_obj = model.build_annotation(sample_id, category, difficulty, query, selected_tools_objs,
+                                                  answers, turns, st.session_state['username'])
+                try:
+                    with perf.phase("save"):
+                        save_to_db(data_obj, overwrite=overwrite_foreign)
+                except storage.SaveConflict as e:
+                    st.error(f"{e}. Измените ID или отметьте «Перезаписать чужую запись с этим ID».")
+                else:
+                    consume_sample_id(category, sample_id)
+                    st.success(f"Запись {sample_id} успешно сохранена! Шагов: {len(steps_data)}")
+
+# === ПРОВЕРКА ЗАПИСЕЙ ===
+elif page == "Проверка записей":
+    st.header("Проверка записей")
+    queue_stats = review.queue_stats()
+    st.caption(f"Ждут проверки: {queue_stats['pending']} · на проверке: {queue_stats['claimed']} · "
+               f"принято: {queue_stats['accepted']} · отклонено: {queue_stats['rejected']}")
+
+    # Аренда живёт в сессии: запись закреплена за проверяющим до её окончания
+    claim = st.session_state.get('review_claim')
+    if claim is None:
+        if st.button("Взять следующую запись", type="primary"):
+            claim = review.claim_next(st.session_state['username'])
+            if claim is None:
+                st.info("Нет записей для проверки (свои записи проверяют другие).")
+            else:
+                st.session_state['review_claim'] = claim
+                st.rerun()
+    else:
+        review_id = claim['annotation_id']
+        record = review.load_record(review_id)
+        if record is None:
+            st.session_state.pop('review_claim')
+            st.warning(f"Запись {review_id} удалена.")
+            st.stop()
+
+        minutes_left = max(0, int((claim['lease_expires'] - time.time()) // 60))
+        st.markdown(f"**{review_id}** · {record['category']} · {record['difficulty']} · автор: {record['author']}")
+        st.caption(f"Запись закреплена за вами ещё {minutes_left} мин.")
+        st.markdown(f"**Запрос:** {record['query']}")
+        st.json(record['tools'], expanded=False)
+        st.json(record['turns'])
+
+        review_comment = st.text_area("Комментарий", key=f"review_comment_{review_id}")
+        edited_turns_text = st.text_area("turns (JSON) — правка перед принятием",
+                                         value=json.dumps(record['turns'], ensure_ascii=False, indent=2),
+                                         height=300, key=f"review_turns_{review_id}")
+
+        def finish_review(outcome, edited=None):
+            try:
+                review.decide(review_id, claim['token'], st.session_state['username'], outcome,
+                              comment=review_comment or None, edited=edited)
+            except review.LeaseLost as e:
+                st.session_state.pop('review_claim')
+                st.error(str(e))
+                return
+            except review.InvalidEdit as e:
+                st.error(f"Правка не прошла проверку: {e}")
+                return
+            st.session_state.pop('review_claim')
+            st.rerun()
+
+        col_r1, col_r2, col_r3, col_r4 = st.columns(4)
+        with col_r1:
+            if st.button("✅ Принять", type="primary"):
+                finish_review(review.OUTCOME_ACCEPTED)
+        with col_r2:
+            if st.button("❌ Отклонить"):
+                finish_review(review.OUTCOME_REJECTED)
+        with col_r3:
+            if st.button("✏️ Сохранить правку"):
+                try:
+                    edited_turns = json.loads(edited_turns_text)
+                    edited = review.edited_record(record, edited_turns)
+                except json.JSONDecodeError as e:
+                    st.error(f"Ошибка JSON в turns: {e}")
+                except review.InvalidEdit as e:
+                    st.error(f"Правка не прошла проверку: {e}")
+                else:
+                    finish_review(review.OUTCOME_EDITED, edited)
+        with col_r4:
+            if st.button("Вернуть в очередь"):
+                review.release(review_id, claim['token'])
+                st.session_state.pop('review_claim')
+                st.rerun()
+
+# === ПОИСК ===
+elif page == "Поиск":
+    st.header("Поиск по записям")
+    search_text = st.text_input("Слова из запроса, мыслей или финального ответа",
+                                placeholder="Алматы ауа райы")
+    search_prefix = st.checkbox("Искать по началу слова (Алматы → Алматыдағы)", value=True)
+    if search_text:
+        results = search.search(search_text, prefix=search_prefix)
+        if not results:
+            st.info("Ничего не найдено")
+        for item in results:
+            st.markdown(f"**{item['id']}** · {item['category']} · {item['author']}")
+            for label, key in (("Запрос", "query"), ("Мысли", "thoughts"), ("Ответ", "answer")):
+                if item[key]:
+                    st.markdown(f"_{label}:_ {item[key]}")
+            st.markdown("---")
+
+# === СТАТИСТИКА ===
+elif page == "Статистика":
+    st.header("Покрытие датасета")
+    st.metric("Всего записей", stats.total())
+
+    st.subheader("Категория × сложность")
+    cd_rows = stats.category_difficulty()
+    if cd_rows:
+        cd_df = dataframe(cd_rows, columns=["category", "difficulty", "n"])
+        st.dataframe(cd_df.pivot(index="category", columns="difficulty", values="n").fillna(0).astype(int))
+
+    col_s1, col_s2 = st.columns(2)
+    with col_s1:
+        st.subheader("По авторам")
+        st.dataframe(dataframe(stats.authors(), columns=["author", "n"]), hide_index=True)
+    with col_s2:
+        st.subheader("Шагов (вызовов) в диалоге")
+        steps_df = dataframe(stats.step_distribution(), columns=["steps", "n"])
+        st.bar_chart(steps_df, x="steps", y="n")
+
+    st.subheader("Вызовы инструментов")
+    st.dataframe(dataframe(stats.tool_usage(), columns=["tool", "calls", "samples"]),
+                 hide_index=True)
+
+    st.subheader("Аналитика вызовов")
+    known_tools = tools.get_catalog().names
+    col_a1, col_a2 = st.columns(2)
+    with col_a1:
+        first_tool = st.selectbox("Сначала вызывается", known_tools, key="seq_first")
+    with col_a2:
+        then_tool = st.selectbox("Затем вызывается", known_tools, key="seq_then")
+    sequence_ids = normalized.samples_calling_in_order(first_tool, then_tool, limit=200)
+    st.caption(f"Записей с {first_tool} → {then_tool}: {len(sequence_ids)}"
+               + (" (показаны первые 200)" if len(sequence_ids) == 200 else ""))
+    if sequence_ids:
+        st.write(", ".join(sequence_ids))
+    arg_usage = normalized.argument_key_usage(first_tool)
+    if arg_usage:
+        st.markdown(f"**Аргументы {first_tool}**")
+        st.dataframe(dataframe(arg_usage, columns=["argument", "calls", "types"]),
+                     hide_index=True)
+
+    if st.session_state['username'] == 'admin':
+        col_r1, col_r2 = st.columns(2)
+        with col_r1:
+            if st.button("Сверить с пересчётом"):
+                differences = stats.verify()
+                if differences:
+                    st.error(f"Расхождения: {differences}")
+                else:
+                    st.success("Агрегаты совпадают с пересчётом")
+        with col_r2:
+            if st.button("Пересчитать с нуля"):
+                st.session_state['stats_snapshot'] = stats.rebuild_all()
+                st.rerun()
+            if st.session_state.get('stats_snapshot'):
+                st.caption(f"Последний пересчёт по снимку {st.session_state['stats_snapshot']}")
 
 # === ЭКСПОРТ ===
 elif page == "Экспорт (Скачать JSON)":
     st.header("Экспорт данных")
-    conn = sqlite3.connect(DB_FILE)
-    df = pd.read_sql_query("SELECT * FROM annotations", conn)
-    conn.close()
-    st.dataframe(df)
-    categories = df['category'].unique().tolist()
+    categories = cached_categories()
+
+    # --- ПРОСМОТР ЗАПИСЕЙ (постранично, без JSON-колонок) ---
+    st.subheader("Просмотр записей")
+    all_label = "(Все)"
+    col_f1, col_f2, col_f3 = st.columns(3)
+    with col_f1:
+        browse_category = st.selectbox("Категория", [all_label] + categories, key="browse_category")
+    with col_f2:
+        browse_difficulty = st.selectbox("Сложность", [all_label] + cached_distinct_values("difficulty"),
+                                         key="browse_difficulty")
+    with col_f3:
+        browse_author = st.selectbox("Автор", [all_label] + cached_distinct_values("author"), key="browse_author")
+
+    browse_filters = {
+        column: value
+        for column, value in (("category", browse_category),
+                              ("difficulty", browse_difficulty),
+                              ("author", browse_author))
+        if value != all_label
+    }
+    # Стек курсоров: последний элемент — начало текущей страницы
+    if st.session_state.get('browse_filters') != browse_filters:
+        st.session_state['browse_filters'] = browse_filters
+        st.session_state['browse_cursors'] = [None]
+    browse_cursors = st.session_state['browse_cursors']
+
+    with perf.phase("export: browse page"):
+        page_rows, next_cursor, page_df = cached_browse_page(tuple(sorted(browse_filters.items())),
+                                                             browse_cursors[-1])
+    table_event = st.dataframe(page_df, hide_index=True, on_select="rerun",
+                               selection_mode="single-row", key="browse_table")
+
+    col_p1, col_p2, col_p3 = st.columns([1, 1, 4])
+    with col_p1:
+        if st.button("◀ Назад", disabled=len(browse_cursors) <= 1):
+            browse_cursors.pop()
+            st.rerun()
+    with col_p2:
+        if st.button("Вперёд ▶", disabled=next_cursor is None):
+            browse_cursors.append(next_cursor)
+            st.rerun()
+    with col_p3:
+        st.caption(f"Страница {len(browse_cursors)}")
+
+    if table_event.selection.rows:
+        selected_row = page_rows[table_event.selection.rows[0]]
+        details = browse.fetch_details(selected_row[0])
+        if details:
+            with st.expander(f"Запись {selected_row[0]}", expanded=True):
+                st.markdown("**tools**")
+                st.json(details['tools_json'], expanded=False)
+                st.markdown("**answers**")
+                st.json(details['answers_json'], expanded=False)
+                st.markdown("**turns**")
+                st.json(details['turns_json'])
+                revision_rows = revisions.history(selected_row[0])
+                if len(revision_rows) > 1:
+                    st.markdown("**История правок**")
+                    st.dataframe(dataframe(revision_rows, columns=["revision", "kind", "author", "created_at", "bytes"]),
+                                 hide_index=True)
+                    shown_revision = st.selectbox("Показать ревизию", [row[0] for row in revision_rows][::-1],
+                                                  key="browse_revision")
+                    st.json(revisions.reconstruct(selected_row[0], revision=shown_revision)['turns'],
+                            expanded=False)
+
+    st.markdown("---")
+    st.subheader("Скачать категорию")
     if categories:
         selected_cat = st.selectbox("Выберите категорию для скачивания", categories)
+        format_labels = {export.FORMAT_JSON: "JSON (массив)", export.FORMAT_JSONL: "JSONL (запись на строку)"}
+        export_fmt = st.radio("Формат", export.FORMATS, horizontal=True, format_func=format_labels.get)
+        export_accepted_only = st.checkbox("Только принятые на проверке")
         if st.button("Сгенерировать JSON файл"):
-            subset = df[df['category'] == selected_cat]
-            final_json_list = []
-            for index, row in subset.iterrows():
-                try:
-                    tools_obj = json.loads(row['tools_json'])
-                    answers_obj = json.loads(row['answers_json'])
-                    turns_obj = json.loads(row['turns_json'])
-                    item = {
-                        "id": row['id'],
-                        "category": row['category'],
-                        "difficulty": row['difficulty'],
-                        "query": row['query'],
-                        "tools": json.dumps(tools_obj, ensure_ascii=False),
-                        "answers": json.dumps(answers_obj, ensure_ascii=False),
-                        "turns": turns_obj 
-                    }
-                    final_json_list.append(item)
-                except Exception as e:
-                    st.error(f"Ошибка при обработке ID {row['id']}: {e}")
-            json_str = json.dumps(final_json_list, indent=4, ensure_ascii=False)
-            fname = f"{selected_cat}.json"
-            st.download_button(label=f"Скачать {fname}", data=json_str, file_name=fname, mime="application/json")
-            st.success(f"Готово к скачиванию!")
+            with perf.phase("export: submit"):
+                st.session_state['export_job_id'] = jobs.submit_export(
+                    selected_cat, export_fmt, requested_by=st.session_state['username'],
+                    accepted_only=export_accepted_only)
+
+        export_job_id = st.session_state.get('export_job_id')
+        export_job = jobs.get_job(export_job_id) if export_job_id else None
+        poll_every = 1.0 if export_job and export_job['status'] in jobs.ACTIVE_STATUSES else None
+
+        # Опрашивается только этот фрагмент, а не вся страница
+        @st.fragment(run_every=poll_every)
+        def export_job_status():
+            job = jobs.get_job(export_job_id) if export_job_id else None
+            if job is None:
+                return
+            if job['status'] in jobs.ACTIVE_STATUSES:
+                total = job['total'] or 0
+                st.progress(min(job['progress'] / total, 1.0) if total else 0.0,
+                            text=f"Экспорт {job['category']}: {job['progress']} / {total}")
+            elif job['status'] == jobs.STATUS_FAILED:
+                st.error(f"Экспорт не удался: {job['error']}")
+            else:
+                if poll_every is not None:
+                    # Задание завершилось — полный перезапуск, чтобы остановить опрос
+                    st.rerun()
+                if job['error']:
+                    st.warning(f"Пропущены записи с ошибками: {job['error']}")
+                if job['stale']:
+                    st.info("Данные изменились после экспорта — сгенерируйте файл заново.")
+                if not job['artifact'] or not os.path.exists(job['artifact']):
+                    st.info("Файл экспорта удалён — сгенерируйте его заново.")
+                    return
+                fname = f"{job['category']}{'.accepted' if job['accepted_only'] else ''}.{job['fmt']}.gz"
+                st.download_button(label=f"Скачать {fname}", data=cached_artifact(job['artifact']),
+                                   file_name=fname, mime="application/gzip")
+                st.success(f"Готово к скачиванию! Записей: {job['progress']} (снимок {job['snapshot']})")
+
+        export_job_status()
     else:
         st.info("База данных пуста.")
+
+perf.rerun_finished(page)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from annotator import db, model, writer  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "annotations.db")
+    db.init_db(path)
+    yield path
+    writer.shutdown()
+    db.close_all()
+
+
+@pytest.fixture
+def make_record():
+    def make(sample_id, author="alice", query="Алматы ауа райы", turns=None, category="tool_awareness"):
+        turns = turns if turns is not None else [{"role": "user", "content": query}]
+        return model.build_annotation(sample_id, category, "easy", query, [], [], turns, author)
+    return make
@@ -0,0 +1,36 @@
+import os
+
+from annotator import delta, snapshot, storage
+
+SAMPLE_ID = "kk_tool_awareness_001"
+
+
+def _seq(db_path):
+    with snapshot.open_snapshot(db_path) as snap:
+        return snap.seq
+
+
+def test_prune_keeps_tombstone_of_previous_category(db_path, make_record, tmp_path):
+    out_dir = str(tmp_path / "sync")
+    storage.save_annotation(make_record(SAMPLE_ID, category="tool_awareness"), path=db_path)
+    first = delta.export_delta(out_dir, category="tool_awareness", path=db_path)
+    assert (first["upserts"], first["deletes"]) == (1, 0)
+
+    storage.save_annotation(make_record(SAMPLE_ID, category="api_discovery", query="Жаңа сұрақ"), path=db_path)
+    storage.save_annotation(make_record(SAMPLE_ID, category="api_discovery", query="Тағы бір сұрақ"), path=db_path)
+    assert delta.prune(_seq(db_path) + 1, path=db_path) > 0
+
+    second = delta.export_delta(out_dir, category="tool_awareness", path=db_path)
+    assert (second["upserts"], second["deletes"]) == (0, 1)
+
+
+def test_no_file_when_category_has_no_changes(db_path, make_record, tmp_path):
+    out_dir = str(tmp_path / "sync")
+    storage.save_annotation(make_record(SAMPLE_ID, category="tool_awareness"), path=db_path)
+    assert delta.export_delta(out_dir, category="tool_awareness", path=db_path)["file"] == "delta-000001.jsonl"
+
+    storage.save_annotation(make_record("kk_api_discovery_001", category="api_discovery"), path=db_path)
+    assert delta.export_delta(out_dir, category="tool_awareness", path=db_path) is None
+    manifest = delta.load_manifest(out_dir)
+    assert len(manifest["deltas"]) == 1
+    assert sorted(os.listdir(out_dir)) == ["delta-000001.jsonl", "manifest.json"]
@@ -0,0 +1,44 @@
+import io
+import json
+
+from annotator import db, ids, importer, storage
+
+
+def _counter(db_path, category):
+    row = db.fetch_one("SELECT next_value FROM id_counters WHERE category = ?", (category,), path=db_path)
+    return row[0] if row else None
+
+
+def test_blocks_do_not_overlap(db_path):
+    first, second = {}, {}
+    issued = [ids.next_id(first, "tool_awareness", path=db_path) for _ in range(ids.BLOCK_SIZE + 2)]
+    issued += [ids.next_id(second, "tool_awareness", path=db_path) for _ in range(3)]
+    assert len(set(issued)) == len(issued)
+    assert issued[0] == "kk_tool_awareness_001"
+
+
+def test_insert_advances_counter(db_path, make_record):
+    storage.save_annotation(make_record("kk_state_context_041"), path=db_path)
+    storage.save_annotation(make_record("kk_state_context_007"), path=db_path)
+    storage.save_annotation(make_record("kk_state_context_041_v2"), path=db_path)
+    assert _counter(db_path, "state_context") == 42
+
+
+def test_allocation_after_bulk_import_reserves_one_block(db_path, monkeypatch):
+    lines = [json.dumps({"id": f"kk_api_discovery_{i}", "category": "api_discovery", "difficulty": "easy",
+                         "query": "сұрақ", "turns": [{"role": "user", "content": "сұрақ"}]}, ensure_ascii=False)
+             for i in range(1, 301)]
+    result = importer.import_stream(io.StringIO("\n".join(lines)), check_arguments=False, path=db_path)
+    assert result.inserted == 300
+    assert _counter(db_path, "api_discovery") == 301
+
+    reserved = []
+    reserve_block = ids.reserve_block
+
+    def counting_reserve(category, size=ids.BLOCK_SIZE, path=None):
+        reserved.append(category)
+        return reserve_block(category, size, path=path)
+
+    monkeypatch.setattr(ids, "reserve_block", counting_reserve)
+    assert ids.next_id({}, "api_discovery", path=db_path) == "kk_api_discovery_301"
+    assert reserved == ["api_discovery"]
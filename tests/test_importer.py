@@ -0,0 +1,89 @@
+import io
+import json
+import sqlite3
+
+import pytest
+
+from annotator import importer
+
+
+def _records(stream):
+    return list(importer.iter_json_records(io.StringIO(stream)))
+
+
+def _line(record_id):
+    return json.dumps({"id": record_id, "category": "tool_awareness", "difficulty": "easy", "query": "сұрақ",
+                       "turns": [{"role": "user", "content": "сұрақ"}]}, ensure_ascii=False)
+
+
+def test_jsonl_bad_line_in_the_middle_keeps_reading():
+    parsed = _records(f"{_line('a')}\n{{\"id\": \"b\",\n{_line('c')}\n")
+    assert [index for index, _ in parsed] == [0, 1, 2]
+    assert parsed[0][1]["id"] == "a"
+    assert isinstance(parsed[1][1], importer.RecordError)
+    assert "строка 2" in str(parsed[1][1])
+    assert parsed[2][1]["id"] == "c"
+
+
+def test_jsonl_trailing_partial_line_is_a_record_error():
+    parsed = _records(f"{_line('a')}\n{_line('b')}\n{{\"id\": \"c\", \"cat")
+    assert [obj["id"] for _, obj in parsed[:2]] == ["a", "b"]
+    assert isinstance(parsed[2][1], importer.RecordError)
+    assert "строка 3" in str(parsed[2][1])
+
+
+def test_jsonl_lines_longer_than_read_chunk(monkeypatch):
+    monkeypatch.setattr(importer, "READ_CHUNK", 7)
+    parsed = _records(f"\ufeff{_line('a')}\n\n{_line('b')}")
+    assert [obj["id"] for _, obj in parsed] == ["a", "b"]
+
+
+def test_array_input():
+    parsed = _records("[\n" + ",\n".join(_line(i) for i in ("a", "b", "c")) + "\n]")
+    assert [obj["id"] for _, obj in parsed] == ["a", "b", "c"]
+
+
+def test_truncated_array_is_fatal():
+    with pytest.raises(importer.RecordError):
+        _records(f"[{_line('a')}, {{\"id\": \"b\"")
+
+
+def test_import_stream_reports_bad_line_and_imports_the_rest(db_path):
+    stream = io.StringIO(f"{_line('a')}\nnot json\n{_line('c')}\n")
+    result = importer.import_stream(stream, check_arguments=False, path=db_path)
+    assert result.read == 3
+    assert result.inserted == 2
+    assert result.error_count == 1
+    assert result.errors[0]["index"] == 1
+    assert "строка 2" in result.errors[0]["error"]
+
+
+@pytest.mark.parametrize("field, value", [("query", 123), ("category", {"name": "x"}),
+                                          ("difficulty", ["easy"]), ("author", 7)])
+def test_non_string_field_rejects_only_that_record(db_path, field, value):
+    bad = {**json.loads(_line("b")), field: value}
+    stream = io.StringIO("\n".join([_line("a"), json.dumps(bad), _line("c")]))
+    result = importer.import_stream(stream, check_arguments=False, path=db_path)
+    assert result.inserted == 2
+    assert result.error_count == 1
+    assert result.errors[0]["id"] == "b"
+    assert field in result.errors[0]["error"]
+
+
+def test_writer_retry_does_not_double_count(db_path, monkeypatch):
+    write_batch = importer._write_batch
+    calls = []
+
+    def busy_once(conn, *args, **kwargs):
+        counts = write_batch(conn, *args, **kwargs)
+        calls.append(counts)
+        if len(calls) == 1:
+            # Писатель откатит пачку и выполнит задание заново
+            raise sqlite3.OperationalError("database is locked")
+        return counts
+
+    monkeypatch.setattr(importer, "_write_batch", busy_once)
+    stream = io.StringIO("\n".join(_line(record_id) for record_id in "abc"))
+    result = importer.import_stream(stream, check_arguments=False, path=db_path)
+    assert len(calls) == 2
+    assert (result.inserted, result.skipped) == (3, 0)
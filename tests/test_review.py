@@ -0,0 +1,66 @@
+import time
+
+import pytest
+
+from annotator import review, revisions, storage
+
+SAMPLE_ID = "kk_tool_awareness_001"
+
+
+@pytest.fixture
+def claimed(db_path, make_record):
+    storage.save_annotation(make_record(SAMPLE_ID, author="alice"), path=db_path)
+    claim = review.claim_next("bob", path=db_path)
+    assert claim["annotation_id"] == SAMPLE_ID
+    return claim
+
+
+def _turns(arguments):
+    return [
+        {"role": "user", "content": "Алматы ауа райы"},
+        {"role": "assistant", "tool_call": {"name": "weather.get", "arguments": arguments}},
+    ]
+
+
+def test_edit_revision_credited_to_reviewer(db_path, claimed):
+    record = review.load_record(SAMPLE_ID, path=db_path)
+    edited = review.edited_record(record, _turns({"city": "Алматы"}))
+    review.decide(SAMPLE_ID, claimed["token"], "bob", review.OUTCOME_EDITED, edited=edited, path=db_path)
+
+    history = revisions.history(SAMPLE_ID, path=db_path)
+    assert [(revision, author) for revision, _, author, *_ in history] == [(1, "alice"), (2, "bob")]
+    assert review.load_record(SAMPLE_ID, path=db_path)["author"] == "alice"
+    assert review.get_item(SAMPLE_ID, path=db_path)["status"] == review.STATUS_ACCEPTED
+
+
+def test_invalid_edit_rejected(db_path, claimed):
+    record = review.load_record(SAMPLE_ID, path=db_path)
+    edited = review.edited_record(record, _turns({"location": "Алматы"}))
+    with pytest.raises(review.InvalidEdit, match="city"):
+        review.decide(SAMPLE_ID, claimed["token"], "bob", review.OUTCOME_EDITED, edited=edited, path=db_path)
+
+    assert review.load_record(SAMPLE_ID, path=db_path) == record
+    assert revisions.head_revision(SAMPLE_ID, path=db_path) == 1
+    # Аренда не потеряна: проверяющий может принять решение заново
+    review.decide(SAMPLE_ID, claimed["token"], "bob", review.OUTCOME_REJECTED, path=db_path)
+
+
+@pytest.mark.parametrize("call", ["weather.get", {"name": "weather.get"}, {"name": 1, "arguments": {}}])
+def test_edited_record_checks_tool_call_shape(call):
+    record = {"id": SAMPLE_ID, "turns": [], "answers": []}
+    with pytest.raises(review.InvalidEdit, match="tool_call"):
+        review.edited_record(record, [{"role": "assistant", "tool_call": call}])
+
+
+def test_expired_lease_reclaimable(db_path, make_record):
+    storage.save_annotation(make_record(SAMPLE_ID, author="alice"), path=db_path)
+    first = review.claim_next("bob", lease_seconds=0.2, path=db_path)
+    assert review.claim_next("carol", path=db_path) is None
+    time.sleep(0.3)
+
+    second = review.claim_next("carol", path=db_path)
+    assert second["annotation_id"] == SAMPLE_ID
+    with pytest.raises(review.LeaseLost):
+        review.decide(SAMPLE_ID, first["token"], "bob", review.OUTCOME_ACCEPTED, path=db_path)
+    review.decide(SAMPLE_ID, second["token"], "carol", review.OUTCOME_ACCEPTED, path=db_path)
+    assert [row[1] for row in review.decisions(SAMPLE_ID, path=db_path)] == ["carol"]
@@ -0,0 +1,60 @@
+import io
+import json
+
+from annotator import importer, revisions, storage
+
+
+def _doc(query, turns, author="alice"):
+    return {
+        "category": "tool_awareness", "difficulty": "easy", "query": query, "tools_json": "[]",
+        "tool_set": None, "author": author, "answers_json": [],
+        "turns_json": [json.dumps(turn, ensure_ascii=False) for turn in turns],
+    }
+
+
+def test_diff_patch_round_trip_kazakh():
+    old = _doc("Алматыда ауа райы қандай?", [
+        {"role": "user", "content": "Алматыда ауа райы қандай?"},
+        {"role": "assistant", "content": "Қазір тексеремін."},
+        {"role": "assistant", "content": "Бүгін күн ашық, +18°C."},
+    ])
+    new = _doc("Астанада ауа райы қандай?", [
+        {"role": "user", "content": "Астанада ауа райы қандай?"},
+        {"role": "assistant", "content": "Қазір тексеремін."},
+        {"role": "assistant", "content": "Ертең жаңбыр жауады, рахмет сұрағаныңызға!"},
+    ], author="бекжан")
+    delta = revisions.diff(old, new)
+    assert delta["set"] == {"query": new["query"], "author": "бекжан"}
+    assert revisions.patch(old, delta) == new
+    assert revisions._decode(revisions._encode(delta)) == delta
+
+
+def test_compaction_keeps_reconstruction(db_path, make_record):
+    sample_id = "kk_tool_awareness_001"
+    for n in range(1, 8):
+        storage.save_annotation(make_record(sample_id, query=f"Сұрақ нөмірі {n}"), path=db_path)
+    before = [revisions.reconstruct(sample_id, revision=n, path=db_path) for n in range(1, 8)]
+    assert [kind for _, kind, *_ in revisions.history(sample_id, path=db_path)] == ["full"] + ["delta"] * 6
+
+    result = revisions.compact(every=2, path=db_path)
+    assert result == {"annotations": 1, "rewritten": 3}
+    kinds = [kind for _, kind, *_ in revisions.history(sample_id, path=db_path)]
+    assert kinds == ["full", "delta", "full", "delta", "full", "delta", "full"]
+    assert [revisions.reconstruct(sample_id, revision=n, path=db_path) for n in range(1, 8)] == before
+    assert before[-1]["query"] == "Сұрақ нөмірі 7"
+
+
+def test_overwrite_import_records_revision(db_path, make_record):
+    sample_id = "kk_tool_awareness_001"
+    storage.save_annotation(make_record(sample_id, query="Бастапқы сұрақ"), path=db_path)
+    line = json.dumps({"id": sample_id, "category": "tool_awareness", "difficulty": "hard",
+                       "query": "Импортталған сұрақ", "author": "alice",
+                       "turns": [{"role": "user", "content": "Импортталған сұрақ"}]}, ensure_ascii=False)
+    result = importer.import_stream(io.StringIO(line), on_conflict=importer.ON_CONFLICT_OVERWRITE,
+                                    author="bulk-loader", check_arguments=False, path=db_path)
+    assert result.replaced == 1
+
+    history = revisions.history(sample_id, path=db_path)
+    assert [(revision, author) for revision, _, author, *_ in history] == [(1, "alice"), (2, "bulk-loader")]
+    assert revisions.reconstruct(sample_id, revision=1, path=db_path)["query"] == "Бастапқы сұрақ"
+    assert revisions.reconstruct(sample_id, path=db_path)["query"] == "Импортталған сұрақ"
@@ -0,0 +1,45 @@
+import json
+
+from annotator import delta, db, shards, storage
+
+
+def _seed(db_path, make_record, count):
+    for i in range(count):
+        storage.save_annotation(make_record(f"kk_tool_awareness_{i:03d}", query=f"Алматы ауа райы {i}"),
+                                path=db_path)
+
+
+def test_index_and_mmap_reader(db_path, make_record, tmp_path):
+    _seed(db_path, make_record, 7)
+    out_dir = tmp_path / "sharded"
+    manifest = shards.write_sharded(str(out_dir), shard_size=3, workers=2, path=db_path)
+    assert manifest["records"] == 7
+    assert [shard["records"] for shard in manifest["shards"]] == [3, 3, 1]
+
+    with shards.ShardedDataset(str(out_dir)) as dataset:
+        assert len(dataset) == 7
+        assert [record["id"] for record in dataset] == [f"kk_tool_awareness_{i:03d}" for i in range(7)]
+        assert dataset[-1]["id"] == "kk_tool_awareness_006"
+        assert dataset.get("kk_tool_awareness_004")["query"] == "Алматы ауа райы 4"
+        assert dataset.position_of("missing") is None
+        assert json.loads(dataset.raw(2))["id"] == "kk_tool_awareness_002"
+
+
+def test_export_reads_pinned_snapshot(db_path, make_record, tmp_path, monkeypatch):
+    _seed(db_path, make_record, 4)
+    with db.connection(db_path) as conn:
+        seq = delta.current_seq(conn)
+    write_replica = shards._write_replica
+
+    def write_during_export(snap, replica_path):
+        # Запись после закрепления снимка не должна попасть в экспорт
+        storage.save_annotation(make_record("late"), path=db_path)
+        write_replica(snap, replica_path)
+
+    monkeypatch.setattr(shards, "_write_replica", write_during_export)
+    manifest = shards.write_sharded(str(tmp_path / "sharded"), shard_size=2, workers=1, path=db_path)
+    assert manifest["snapshot"] == f"seq-{seq}"
+    assert manifest["records"] == 4
+    with shards.ShardedDataset(str(tmp_path / "sharded")) as dataset:
+        assert dataset.get("late") is None
+    assert not [name for name in (tmp_path / "sharded").iterdir() if name.name.startswith("shards_")]